@@ -3,26 +3,221 @@ A CRUD REST API for viewing, creating, deleting, and updating sports,
 events for each sport, and selections for each event
 """
 
+import contextlib
+import contextvars
+import io
+import os
 import sqlite3
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from flask import Flask, request, jsonify
-from dateutil.parser import parse
-from dateutil.tz import UTC
-from slugify import slugify
+from pathlib import Path
+from flask import Flask, Response, has_request_context, request, jsonify
+from params import (Field, Schema, accepts, cents, choice, field_list, flag,
+                    integer, number, number_between, parse_datetime)
+from singleflight import SingleFlight
+from ratelimit import (AdmissionControl, Overloaded, RateLimiter,
+                       retry_after_header)
+from schedule import EventSchedule
+from replica import SnapshotPublisher
+from scheduler import AutoStarter
+import lifecycle
+import archive
+import catalogue
+import rollups
 
 app = Flask(__name__)
 
 DATABASE = "app.db"
 
+# number of SQLite files to spread the data across, each sport living in
+# one shard along with all of its events and selections. 0 (the default)
+# keeps everything in DATABASE
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "0"))
+
+# runs queries against every shard in parallel, created on first use
+shard_pool = None
+shard_pool_lock = threading.Lock()
+
+# each database file only keeps names unique within itself, so when
+# sharding is enabled this is held while an event or selection name is
+# checked in every shard and then written (see names_lock)
+shard_names_lock = threading.Lock()
+
+# seconds between snapshots published to the read replicas used by
+# searches. 0 (the default) disables replicas, so searches read the primary
+REPLICA_INTERVAL = float(os.environ.get("REPLICA_INTERVAL", "0"))
+
+# searches fall back to the primary once the snapshot is older than this
+REPLICA_MAX_STALENESS = float(os.environ.get("REPLICA_MAX_STALENESS",
+                                             3 * REPLICA_INTERVAL))
+
+# number of read-only copies of each snapshot to spread searches across
+REPLICA_COUNT = int(os.environ.get("REPLICA_COUNT", "1"))
+
+# publishes the replica snapshots, created by start_replicas()
+replica_publisher = None
+
+# set AUTO_START=1 to start events automatically at their scheduled start
+AUTO_START = os.environ.get("AUTO_START", "0") == "1"
+
+# seconds between reloads of the upcoming starts from the database
+AUTO_START_RESYNC = float(os.environ.get("AUTO_START_RESYNC", "60"))
+
+# starts events at their scheduled start, created by start_scheduler()
+auto_starter = None
+
+# most sub-requests accepted by /batch, and the number of its searches run
+# at once
+BATCH_LIMIT = int(os.environ.get("BATCH_LIMIT", "100"))
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", "4"))
+
+# requests a second allowed for each client on each route, with bursts of
+# up to RATE_BURST at once. 0 (the default) turns rate limiting off
+RATE_LIMIT = float(os.environ.get("RATE_LIMIT", "0"))
+RATE_BURST = float(os.environ.get("RATE_BURST", str(2 * RATE_LIMIT)))
+
+# searches with no filters (or only ones that match everything), the
+# hierarchy, the summary and exports read a whole table, so at most
+# FULL_SCAN_LIMIT of them run at once. Up to FULL_SCAN_QUEUE more wait at most
+# FULL_SCAN_TIMEOUT seconds for a turn, and any others are turned away
+FULL_SCAN_LIMIT = int(os.environ.get("FULL_SCAN_LIMIT", "4"))
+FULL_SCAN_QUEUE = int(os.environ.get("FULL_SCAN_QUEUE", "16"))
+FULL_SCAN_TIMEOUT = float(os.environ.get("FULL_SCAN_TIMEOUT", "2"))
+
+rate_limiter = RateLimiter(RATE_LIMIT, RATE_BURST) if RATE_LIMIT > 0 else None
+full_scans = AdmissionControl(FULL_SCAN_LIMIT, FULL_SCAN_QUEUE,
+                              FULL_SCAN_TIMEOUT)
+
+# the routes that can be called from /batch, by their first path segment,
+# and the methods that write (the rest, i.e. GET, are searches)
+BATCH_TABLES = ["sports", "events", "selections"]
+BATCH_WRITES = ["POST", "PUT", "DELETE"]
+
+# runs the searches in a batch, created on first use
+batch_pool = None
+batch_pool_lock = threading.Lock()
+
+# the connections shared by the writes of the batch running in the current
+# context, by shard, or None outside of a batch (see run_batch_writes)
+batch_connections = contextvars.ContextVar("batch_connections", default=None)
+
+# the version of the tables, indexes, views and triggers created by
+# init_database, stored in each database's user_version. Databases already
+# at this version are left as they are when the app starts, so this must be
+# increased whenever init_database changes what it creates or converts
+SCHEMA_VERSION = 3
+
+# columns stored in the case given by their choice() parsers, which is the
+# first letter capitalized for all of them
+CAPITALIZED_COLUMNS = [("events", "status"), ("events", "type"),
+                       ("selections", "outcome")]
+
+# all times are stored in UTC in this format, which sorts in time order
+# as plain text and matches the output of SQLite's DATETIME()
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# events and selections are keyed by an integer id (an alias for the rowid),
+# with their names kept unique, so lookups by name still use an index while
+# selections reference their event, and joins and cascades compare ids.
+# Prices are stored as a whole number of cents, so they compare exactly
+EVENTS_TABLE = """CREATE TABLE IF NOT EXISTS {table} (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE,
+                    slug TEXT,
+                    active BOOLEAN,
+                    type TEXT,
+                    sport TEXT,
+                    status TEXT,
+                    scheduled_start TEXT,
+                    actual_start TEXT,
+                    FOREIGN KEY (sport)
+                        REFERENCES sports (name)
+                        ON UPDATE RESTRICT
+                        ON DELETE RESTRICT
+                );"""
+SELECTIONS_TABLE = """CREATE TABLE IF NOT EXISTS {table} (
+                        id INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL UNIQUE,
+                        event_id INTEGER NOT NULL,
+                        price_cents INTEGER,
+                        active BOOLEAN,
+                        outcome TEXT,
+                        FOREIGN KEY (event_id)
+                            REFERENCES events (id)
+                            ON UPDATE RESTRICT
+                            ON DELETE RESTRICT
+                    );"""
+
+# the columns returned for events and selections, as they were before the
+# integer keys were added, with prices converted back from cents. Selection
+# columns are selected from SELECTIONS_JOIN, by the expression for each
+# field in SELECTION_FIELDS
+EVENT_COLUMNS = """name, slug, active, type, sport, status, scheduled_start,
+                   actual_start"""
+SELECTION_FIELDS = {"name": "selections.name", "event": "events.name AS event",
+                    "price": "selections.price_cents / 100.0 AS price",
+                    "active": "selections.active",
+                    "outcome": "selections.outcome"}
+SELECTION_COLUMNS = ", ".join(SELECTION_FIELDS.values())
+
+# the fields searches for sports and events return, like SELECTION_FIELDS.
+# Each search can be narrowed down to some of them with the fields parameter
+SPORT_FIELDS = {field: f"sports.{field}" for field in
+                ["name", "slug", "active"]}
+EVENT_FIELDS = {field: f"events.{field}" for field in
+                ["name", "slug", "active", "type", "sport", "status",
+                 "scheduled_start", "actual_start"]}
+
+# joins the parents a search can include with its results (see
+# include_parents), by the kind of parent. {events} is the events table to
+# join, i.e. its archive when searching archived selections
+PARENT_JOINS = {"event": "JOIN {events} ON events.id = selections.event_id",
+                "sport": "LEFT JOIN sports ON sports.name = events.sport"}
+SELECTIONS_JOIN = "selections JOIN events ON events.id = selections.event_id"
+
+# the column in SELECTIONS_JOIN each selection search parameter filters on.
+# Searches go to the join rather than selection_rows, so prices are
+# compared in cents on the price_cents index rather than after converting
+SELECTION_FILTERS = {"name": "selections.name", "event": "events.name",
+                     "price": "selections.price_cents",
+                     "active": "selections.active",
+                     "outcome": "selections.outcome"}
+
+# shares one database execution between concurrent identical searches
+search_flight = SingleFlight()
+
+# in-memory schedule of events by scheduled start, loaded on first use
+event_schedule = None
+event_schedule_lock = threading.Lock()
+
 def init_db():
 
     """
-    Initializes the database with the correct tables for sports,
-    events and selections
+    Initializes the database (or every shard, when sharding is enabled)
+    with the correct tables for sports, events and selections
+    """
+
+    for path in database_paths():
+        init_database(path)
+
+def init_database(path):
+
+    """
+    Initializes a single database file with the correct tables for sports,
+    events and selections, converting any data stored by older versions.
+    Does nothing if the database is already at SCHEMA_VERSION
     """
 
-    conn = sqlite3.connect(DATABASE)
+    conn = sqlite3.connect(path)
+    if conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+        conn.close()
+        return
     conn.execute("PRAGMA foreign_keys = ON") # ensure foreign keys are enabled
+    # the migrations convert prices with CENTS(price), so they round them
+    # the same way as prices given to the API
+    conn.create_function("CENTS", 1, stored_cents, deterministic=True)
     cursor = conn.cursor()
 
     cursor.execute("""CREATE TABLE IF NOT EXISTS sports (
@@ -30,46 +225,721 @@ def init_db():
                         slug TEXT,
                         active BOOLEAN
                     );""")
-    cursor.execute("""CREATE TABLE IF NOT EXISTS events (
-                        name TEXT PRIMARY KEY,
-                        slug TEXT,
-                        active BOOLEAN,
-                        type TEXT,
-                        sport TEXT,
-                        status TEXT,
-                        scheduled_start TEXT,
-                        actual_start TEXT,
-                        FOREIGN KEY (sport)
-                            REFERENCES sports (name)
-                            ON UPDATE RESTRICT
-                            ON DELETE RESTRICT
-                    );""")
-    cursor.execute("""CREATE TABLE IF NOT EXISTS selections (
-                        name TEXT PRIMARY KEY,
-                        event TEXT,
-                        price REAL,
-                        active BOOLEAN,
-                        outcome TEXT,
-                        FOREIGN KEY (event)
-                            REFERENCES events (name)
-                            ON UPDATE RESTRICT
-                            ON DELETE RESTRICT
-                    );""")
+    # databases created before events and selections had integer keys are
+    # converted first, as the tables below already exist in them
+    if needs_integer_keys(cursor):
+        migrate_to_integer_keys(conn)
+
+    cursor.execute(EVENTS_TABLE.format(table="events"))
+    cursor.execute(SELECTIONS_TABLE.format(table="selections"))
+    if needs_price_cents(cursor):
+        migrate_to_price_cents(conn)
+    # the columns of events and selections as the API shows them, with each
+    # selection's event given by name rather than by its internal id
+    cursor.execute(f"""CREATE VIEW IF NOT EXISTS event_rows AS
+                        SELECT {EVENT_COLUMNS} FROM events""")
+    cursor.execute(f"""CREATE VIEW IF NOT EXISTS selection_rows AS
+                        SELECT {SELECTION_COLUMNS} FROM {SELECTIONS_JOIN}""")
+
+    # normalize timestamps stored before they were kept in TIMESTAMP_FORMAT,
+    # so they can be compared as plain text and served from the index.
+    # strftime() returns NULL for anything it can't parse, leaving it as is
+    cursor.execute("""UPDATE events SET actual_start = NULL
+                        WHERE actual_start = 'NULL'""")
+    for column in ["scheduled_start", "actual_start"]:
+        cursor.execute(f"""UPDATE events
+                        SET {column} = strftime('%Y-%m-%d %H:%M:%S', {column})
+                        WHERE {column} != strftime('%Y-%m-%d %H:%M:%S', {column})""")
+    cursor.execute("""CREATE INDEX IF NOT EXISTS events_scheduled_start
+                        ON events (scheduled_start)""")
+
+    # active flags are stored as 0 or 1, so they can be compared with the
+    # typed values of search parameters
+    for table in ["sports", "events", "selections"]:
+        cursor.execute(f"""UPDATE {table}
+                        SET active = LOWER(active) IN ('true', '1')
+                        WHERE typeof(active) = 'text'""")
+    # used to check whether a sport has any active events left
+    cursor.execute("""CREATE INDEX IF NOT EXISTS events_sport
+                        ON events (sport)""")
+    # used to find an event's selections, for searches by event and for
+    # checking whether an event has any active selections left
+    cursor.execute("""CREATE INDEX IF NOT EXISTS selections_event_id
+                        ON selections (event_id)""")
+    # used for searches by price, and by min-price and max-price
+    cursor.execute("""CREATE INDEX IF NOT EXISTS selections_price_cents
+                        ON selections (price_cents)""")
+    # counts and prices for /summary, kept up to date by triggers
+    rollups.create(cursor)
+    # finished events and their selections, moved out of the tables above
+    archive.create(cursor)
+    # statuses, types and outcomes are stored capitalized (e.g. Started,
+    # Inplay, Win), as the API's parsers give them, so searches, bulk
+    # transitions, the rollups and the archive can match them exactly.
+    # Updates to selections adjust the rollups through their triggers
+    for table, column in CAPITALIZED_COLUMNS:
+        for name in [table, archive.NAMES[table]]:
+            cursor.execute(f"""UPDATE {name}
+                        SET {column} = UPPER(SUBSTR({column}, 1, 1))
+                                       || LOWER(SUBSTR({column}, 2))
+                        WHERE {column} != UPPER(SUBSTR({column}, 1, 1))
+                                          || LOWER(SUBSTR({column}, 2))""")
+    # set in the same transaction, so it is only set once all of the above
+    # is done
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
     conn.close()
 
-def get_db_connection():
+def needs_integer_keys(cursor):
+
+    """
+    Checks whether a database still has the events table from before
+    events and selections were given integer keys, i.e. one keyed by name
+    """
+
+    columns = [row[1] for row in
+               cursor.execute("PRAGMA table_info(events)").fetchall()]
+    return bool(columns) and "id" not in columns
+
+def migrate_to_integer_keys(conn):
+
+    """
+    Converts a database whose events and selections are keyed by name to
+    integer keys, with selections referencing their event by id. Follows
+    SQLite's procedure for changing a table's schema: the new tables are
+    built alongside the old ones and renamed over them, in one transaction,
+    with foreign keys checked before it commits. Names stay unique, and
+    events and selections keep their order
+    """
+
+    conn.commit()
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        conn.execute("BEGIN")
+        conn.execute(EVENTS_TABLE.format(table="events_new"))
+        conn.execute(f"""INSERT INTO events_new ({EVENT_COLUMNS})
+                        SELECT {EVENT_COLUMNS} FROM events ORDER BY rowid""")
+        conn.execute(SELECTIONS_TABLE.format(table="selections_new"))
+        # a selection whose event is missing fails the NOT NULL check on
+        # event_id, rolling the whole migration back
+        conn.execute("""INSERT INTO selections_new
+                        (name, event_id, price_cents, active, outcome)
+                        SELECT selections.name, events_new.id,
+                               CENTS(selections.price),
+                               selections.active, selections.outcome
+                        FROM selections
+                        LEFT JOIN events_new
+                            ON events_new.name = selections.event
+                        ORDER BY selections.rowid""")
+        conn.execute("DROP TABLE selections")
+        conn.execute("DROP TABLE events")
+        conn.execute("ALTER TABLE events_new RENAME TO events")
+        conn.execute("ALTER TABLE selections_new RENAME TO selections")
+        if conn.execute("PRAGMA foreign_key_check").fetchall():
+            raise sqlite3.IntegrityError("foreign key check failed while "
+                                         "migrating to integer keys")
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+
+def needs_price_cents(cursor):
+
+    """
+    Checks whether a database still stores selection prices as REAL in a
+    price column, from before they were kept in cents
+    """
+
+    columns = [row[1] for row in
+               cursor.execute("PRAGMA table_info(selections)").fetchall()]
+    return "price" in columns
+
+def stored_cents(price):
+
+    """
+    Converts a price stored by an older version (a REAL, or text) to a
+    whole number of cents, using params.cents like the API does. A float
+    gives the shortest string that reads back as the same float, so e.g.
+    1.005 is 101 cents, not the 100 that rounding 1.005 * 100 would give
+    """
+
+    return None if price is None else cents(str(price))
+
+def migrate_to_price_cents(conn):
+
+    """
+    Converts the price of every selection to a whole number of cents, in
+    a new price_cents column that replaces price, in one transaction. The
+    selection_rows view reads price, so it is dropped first, to be created
+    again from SELECTION_COLUMNS
+    """
+
+    conn.commit()
+    try:
+        conn.execute("BEGIN")
+        conn.execute("DROP VIEW IF EXISTS selection_rows")
+        conn.execute("ALTER TABLE selections ADD COLUMN price_cents INTEGER")
+        conn.execute("""UPDATE selections
+                        SET price_cents = CENTS(price)""")
+        conn.execute("ALTER TABLE selections DROP COLUMN price")
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+def all_shards():
+
+    """
+    Gets every shard to query for a search across all the data, or [None]
+    when sharding is disabled, meaning the single DATABASE file
+    """
+
+    return list(range(SHARD_COUNT)) or [None]
+
+def database_path(shard=None):
+
+    """
+    Gets the file for the given shard, e.g. app.shard2.db, or DATABASE when
+    no shard is given
+    """
+
+    if shard is None:
+        return DATABASE
+    root, ext = os.path.splitext(DATABASE)
+    return f"{root}.shard{shard}{ext}"
+
+def database_paths():
+
+    """
+    Gets the files holding all the data, i.e. every shard, or just
+    DATABASE when sharding is disabled
+    """
+
+    return [database_path(shard) for shard in all_shards()]
+
+def shard_for_sport(sport):
+
+    """
+    Gets the shard that holds the given sport along with all its events and
+    selections, or None when sharding is disabled. A stable hash is used,
+    so the same sport always maps to the same shard
+    """
+
+    if not SHARD_COUNT:
+        return None
+    return zlib.crc32(sport.encode()) % SHARD_COUNT
+
+def map_shards(fn, shards):
+
+    """
+    Calls fn(shard) for each of the given shards, in parallel when there is
+    more than one, and returns the results in the same order
+    """
+
+    global shard_pool
+    # a batch's writes must use its own connections, which belong to this
+    # thread
+    if len(shards) == 1 or batch_connections.get() is not None:
+        return [fn(shard) for shard in shards]
+    with shard_pool_lock:
+        if shard_pool is None:
+            shard_pool = ThreadPoolExecutor(max_workers=SHARD_COUNT)
+    return list(shard_pool.map(fn, shards))
+
+def shards_with(table, name):
+
+    """
+    Gets the shards that have an event or selection with the given name,
+    by looking it up by its unique key in every shard in parallel
+    """
+
+    def lookup(shard):
+        conn = get_db_connection(shard)
+        found = conn.execute(f"SELECT 1 FROM {table} WHERE name = ?",
+                             (name,)).fetchone()
+        conn.close()
+        return found is not None
+
+    shards = all_shards()
+    return [shard for shard, found in zip(shards, map_shards(lookup, shards))
+            if found]
+
+def find_shard(table, name):
+
+    """
+    Gets the shard holding the event or selection with the given name. As
+    names are kept unique across the shards (see name_taken), at most one
+    shard has it. Falls back to the first shard if no shard has it, so that
+    updates and deletes affect nothing, and inserts referencing it fail
+    their foreign key check, just as they would without sharding. Returns
+    None when sharding is disabled
+    """
+
+    if not SHARD_COUNT:
+        return None
+    found = shards_with(table, name)
+    return found[0] if found else 0
+
+def name_taken(table, name):
+
+    """
+    Checks whether an event or selection name is already used in another
+    shard, before a record is created with it or renamed to it. Each
+    database file only keeps names unique within itself, so without this
+    the same name could be used in two shards. Always False when sharding
+    is disabled, where the file's UNIQUE constraint is enough. Call it
+    while holding names_lock()
+    """
+
+    return bool(SHARD_COUNT) and bool(shards_with(table, name))
+
+def names_lock(needed=True):
+
+    """
+    Gets the lock to hold while checking a new event or selection name with
+    name_taken and writing it, so two requests can't claim the same name in
+    different shards at once. Does nothing when sharding is disabled, or
+    when not needed (e.g. an update that doesn't rename)
+    """
+
+    if SHARD_COUNT and needed:
+        return shard_names_lock
+    return contextlib.nullcontext()
+
+def get_db_connection(shard=None, replica=False):
 
     """
     Get the database connection for persisting new records, updating,
-    retrieving, or deleting existing records
+    retrieving, or deleting existing records. When sharding is enabled,
+    the shard must be given (see shard_for_sport and find_shard).
+
+    With replica set, the connection is a read-only one to the latest
+    published snapshot instead, for searches. During the writes of a batch,
+    every call for a shard gets the batch's one connection to it
     """
 
-    conn = sqlite3.connect(DATABASE)
+    if replica:
+        path = replica_publisher.replica_for(database_path(shard))
+        conn = sqlite3.connect(Path(path).resolve().as_uri() + "?mode=ro",
+                               uri=True)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    connections = batch_connections.get()
+    if connections is not None and shard in connections:
+        return connections[shard]
+
+    conn = sqlite3.connect(database_path(shard))
     conn.execute("PRAGMA foreign_keys = ON") # ensure foreign keys are enabled
     conn.row_factory = sqlite3.Row
+    if connections is not None:
+        connections[shard] = BatchConnection(conn)
+        return connections[shard]
     return conn
 
+class BatchConnection:
+
+    """
+    A connection shared by every write in a batch. The routes' own commits
+    and closes are ignored, so the batch is committed or rolled back as a
+    whole once all its writes have run
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+def start_replicas():
+
+    """
+    Publishes the first snapshot of every database file and starts
+    publishing new ones every REPLICA_INTERVAL seconds, if replicas are
+    enabled
+    """
+
+    global replica_publisher
+    if REPLICA_INTERVAL > 0:
+        replica_publisher = SnapshotPublisher(database_paths(),
+                                              REPLICA_INTERVAL, REPLICA_COUNT)
+        replica_publisher.start()
+
+def fresh_snapshot_age():
+
+    """
+    Gets the age in seconds of the replica snapshot, if replicas are enabled
+    and the snapshot is recent enough to serve searches from, or None if
+    searches should read the primary database. The searches of a batch
+    always read the primary, so they see the batch's writes
+    """
+
+    if replica_publisher is None:
+        return None
+    if has_request_context() and request.environ.get("app.batch"):
+        return None
+    age = replica_publisher.age()
+    if age is None or age > REPLICA_MAX_STALENESS:
+        return None
+    return age
+
+def select_fields(available, fields):
+
+    """
+    Gets the select list for the given fields of a search, from the
+    expressions of all the fields it can return
+    """
+
+    return ", ".join(available[field] for field in fields)
+
+def parent_fields(kind, available):
+
+    """
+    Gets the select list for every field of an included parent, each named
+    kind.field (e.g. event.status) to tell it apart from the result's own
+    """
+
+    return ", ".join(f'{expression} AS "{kind}.{field}"'
+                     for field, expression in available.items())
+
+def include_parents(rows, kinds, fields):
+
+    """
+    Splits the fields of included parents (named kind.field) out of the
+    rows of a search, and leaves out any other field that wasn't asked for
+    (i.e. the link to the parent, selected so the parents can be matched
+    up). Returns the rows, and for each kind of parent (e.g. events for
+    event) the parents of the rows, each given once, in the order they
+    were first found
+    """
+
+    results = []
+    parents = {kind: {} for kind in kinds}
+    for row in rows:
+        result = {}
+        found = {kind: {} for kind in kinds}
+        for key, value in row.items():
+            kind, _, field = key.partition(".")
+            if field:
+                found[kind][field] = value
+            elif key in fields:
+                result[key] = value
+        results.append(result)
+        for kind, parent in found.items():
+            if parent["name"] is not None:
+                parents[kind].setdefault(parent["name"], parent)
+    return results, {f"{kind}s": list(found.values())
+                     for kind, found in parents.items()}
+
+def search_response(rows, snapshot_age):
+
+    """
+    Builds the response for a search. When replicas are enabled, the
+    X-Snapshot-Age header gives the age in seconds of the data returned,
+    which is 0 when it was read from the primary database
+    """
+
+    response = jsonify(rows)
+    if replica_publisher is not None:
+        response.headers['X-Snapshot-Age'] = f"{snapshot_age or 0:.3f}"
+    return response, 200
+
+def is_full_scan(args):
+
+    """
+    Checks whether a search's filters leave it reading a whole table, i.e.
+    it has none, or only ones that match every row: a name-start, name-end
+    or name-contains of an empty string, or a minimum of 0 or less
+    """
+
+    return all((arg.startswith("name-") and value == "") or
+               (arg.startswith("min-") and value <= 0)
+               for arg, value in args.items())
+
+def run_search(query, params, shards=None, replica=False, full_scan=False):
+
+    """
+    Runs a search query and returns the matching rows as dicts. Concurrent
+    requests that produce the same query and parameters share a single
+    database execution and its result, so a burst of identical searches
+    (e.g. at kickoff) only hits the database once.
+
+    When sharding is enabled, the query runs on every shard in parallel
+    (or just the given shards, when the search can be narrowed down) and
+    the results are combined. With replica set, the query reads the latest
+    replica snapshot instead of the primary database. With full_scan set
+    (for searches that read a whole table, see is_full_scan), the query waits for a slot in the full
+    scans' budget, and raises Overloaded if it can't get one
+    """
+
+    if shards is None:
+        shards = all_shards()
+
+    def execute_shard(shard):
+        conn = get_db_connection(shard, replica)
+        cur = conn.cursor()
+        cur.execute(query, params)
+        rows = [dict(row) for row in cur.fetchall()]
+        conn.close()
+        return rows
+
+    def execute():
+        rows = []
+        for shard_rows in map_shards(execute_shard, shards):
+            rows.extend(shard_rows)
+        return rows
+
+    def admit():
+        # searches sharing another's execution don't take a slot of their own
+        return full_scans.run(execute) if full_scan else execute()
+
+    return search_flight.do((query, tuple(params), tuple(shards), replica),
+                            admit)
+
+def make_slug(name):
+
+    """
+    Makes a slug from a name with slugify, which is imported on first use
+    as it is slow to import and only needed when creating records
+    """
+
+    from slugify import slugify # pylint: disable=import-outside-toplevel
+    return slugify(name)
+
+def to_utc_timestamp(value):
+
+    """
+    Parses a date and time given by the user (which may include an offset
+    for its timezone) and converts it to UTC in the format stored in the
+    database
+    """
+
+    return parse_datetime(value).strftime(TIMESTAMP_FORMAT)
+
+def from_timestamp(value):
+
+    """
+    Converts a time stored in the database back to a UTC datetime
+    """
+
+    return datetime.strptime(value, TIMESTAMP_FORMAT).replace(
+        tzinfo=timezone.utc)
+
+def utc_now_timestamp():
+
+    """
+    Gets the current time in UTC in the format stored in the database
+    """
+
+    return datetime.now(timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+def get_event_schedule():
+
+    """
+    Gets the in-memory schedule of events, loading it from the database
+    the first time it is needed. After that, the event handlers keep it up
+    to date as events are created, rescheduled and deleted
+    """
+
+    global event_schedule
+    with event_schedule_lock:
+        if event_schedule is None:
+            rows = run_search("SELECT name, scheduled_start FROM events", [])
+            event_schedule = EventSchedule(
+                (row['name'], row['scheduled_start']) for row in rows)
+        return event_schedule
+
+def schedule_event(name, scheduled_start):
+
+    """
+    Adds or moves an event in the in-memory schedule, and lets the auto
+    starter know about its start time if it is running. Does nothing to the
+    schedule if it hasn't been loaded yet, as it will be read fresh from
+    the database when it is
+    """
+
+    if event_schedule is not None:
+        event_schedule.add(name, scheduled_start)
+    if auto_starter is not None and scheduled_start is not None:
+        auto_starter.notify(from_timestamp(scheduled_start))
+
+def transition_due_events(status, now, scheduled_before):
+
+    """
+    Moves every event scheduled to start at or before the given time that
+    is allowed to make the transition to the given status, with one batch
+    of updates per database, and returns the names of the events changed
+    """
+
+    def transition_shard(shard):
+        conn = get_db_connection(shard)
+        cur = conn.cursor()
+        names = lifecycle.transition_events(cur, status, now,
+                                            "scheduled_start <= ?",
+                                            (scheduled_before,))
+        conn.commit()
+        conn.close()
+        return names
+
+    changed = []
+    for names in map_shards(transition_shard, all_shards()):
+        changed.extend(names)
+    return changed
+
+def load_due_starts(until):
+
+    """
+    Gets the scheduled starts of every pending event due to start by the
+    given time, including any that are overdue, for the auto starter
+    """
+
+    rows = run_search("""SELECT scheduled_start FROM events
+                        WHERE status = 'Pending' AND scheduled_start <= ?""",
+                      [until.strftime(TIMESTAMP_FORMAT)])
+    return [from_timestamp(row['scheduled_start']) for row in rows]
+
+def start_due_events(now):
+
+    """
+    Starts every pending event that is due to start by now, for the auto
+    starter
+    """
+
+    now = now.strftime(TIMESTAMP_FORMAT)
+    return transition_due_events("Started", now, now)
+
+def start_scheduler():
+
+    """
+    Starts the background thread that starts events at their scheduled
+    start, if AUTO_START is enabled
+    """
+
+    global auto_starter
+    if AUTO_START:
+        auto_starter = AutoStarter(load_due_starts, start_due_events,
+                                   AUTO_START_RESYNC)
+        auto_starter.start()
+
+def unschedule_event(name):
+
+    """
+    Removes an event from the in-memory schedule, if it has been loaded
+    """
+
+    if event_schedule is not None:
+        event_schedule.remove(name)
+
+# the query parameters accepted by each route, parsed before any database
+# connection is opened. Timestamps are converted to TIMESTAMP_FORMAT and
+# statuses, types and outcomes to the case they are stored in
+NAME_FILTERS = {"name-start": Field(), "name-end": Field(),
+                "name-contains": Field()}
+TIMESTAMP = Field(to_utc_timestamp)
+EVENT_TYPE = Field(choice("Preplay", "Inplay"))
+EVENT_STATUS = Field(choice(*lifecycle.STATUSES))
+OUTCOME = Field(choice("Win", "Lose", "Void", "Unsettled"))
+
+CREATE_SPORT_PARAMS = Schema({"name": Field(required=True), "slug": Field(),
+                              "active": Field(flag)})
+SEARCH_SPORTS_PARAMS = Schema({"name": Field(), "slug": Field(),
+                               "active": Field(flag),
+                               "min-events": Field(integer), **NAME_FILTERS,
+                               "fields": Field(field_list(*SPORT_FIELDS))})
+UPDATE_SPORT_PARAMS = Schema({"name": Field(), "slug": Field(),
+                              "active": Field(flag)})
+
+CREATE_EVENT_PARAMS = Schema({"name": Field(required=True), "slug": Field(),
+                              "active": Field(flag), "type": EVENT_TYPE,
+                              "sport": Field(required=True),
+                              "scheduled-start": Field(to_utc_timestamp,
+                                                       required=True)})
+SEARCH_EVENTS_PARAMS = Schema({"name": Field(), "slug": Field(),
+                               "active": Field(flag), "type": EVENT_TYPE,
+                               "sport": Field(), "status": EVENT_STATUS,
+                               "scheduled-start": TIMESTAMP,
+                               "actual-start": TIMESTAMP,
+                               "timeframe": TIMESTAMP,
+                               "min-selections": Field(integer),
+                               **NAME_FILTERS,
+                               "fields": Field(field_list(*EVENT_FIELDS)),
+                               "include": Field(field_list("sport")),
+                               "archived": Field(flag)})
+# hours further ahead than this would take the end of the window past the
+# last date datetime can hold
+MAX_UPCOMING_HOURS = 24 * 365 * 1000
+UPCOMING_EVENTS_PARAMS = Schema({
+    "hours": Field(number_between(0, MAX_UPCOMING_HOURS))})
+UPDATE_EVENT_PARAMS = Schema({"name": Field(), "slug": Field(),
+                              "active": Field(flag), "type": EVENT_TYPE,
+                              "sport": Field(), "status": EVENT_STATUS,
+                              "scheduled-start": TIMESTAMP,
+                              "actual-start": TIMESTAMP})
+UPDATE_EVENTS_PARAMS = Schema({"status": Field(EVENT_STATUS.parser,
+                                               required=True),
+                               "scheduled-before": TIMESTAMP})
+
+CREATE_SELECTION_PARAMS = Schema({"name": Field(required=True),
+                                  "event": Field(required=True),
+                                  "price": Field(cents, required=True),
+                                  "active": Field(flag)})
+SEARCH_SELECTIONS_PARAMS = Schema({"name": Field(), "event": Field(),
+                                   "price": Field(cents),
+                                   "active": Field(flag), "outcome": OUTCOME,
+                                   "min-price": Field(cents),
+                                   "max-price": Field(cents),
+                                   **NAME_FILTERS,
+                                   "fields": Field(
+                                       field_list(*SELECTION_FIELDS)),
+                                   "include": Field(
+                                       field_list("event", "sport")),
+                                   "archived": Field(flag)})
+UPDATE_SELECTION_PARAMS = Schema({"name": Field(), "event": Field(),
+                                  "price": Field(cents),
+                                  "active": Field(flag), "outcome": OUTCOME})
+
+SUMMARY_PARAMS = Schema({"sport": Field()})
+
+# like MAX_UPCOMING_HOURS, the furthest the cutoff can be moved either way
+MAX_RETENTION_DAYS = 365 * 1000
+ARCHIVE_PARAMS = Schema({"retention-days": Field(
+    number_between(-MAX_RETENTION_DAYS, MAX_RETENTION_DAYS))})
+
+CATALOGUE_PARAMS = Schema({"format": Field(choice(*catalogue.FORMATS)),
+                           "table": Field(choice(*catalogue.TABLES))})
+
+@app.before_request
+def limit_rate():
+
+    """
+    Refuses a request with a 429 error once its client has used up its
+    requests for the route. Requests within a batch aren't counted, as the
+    batch was
+    """
+
+    if rate_limiter is None or request.environ.get("app.batch"):
+        return
+    rate_limiter.check((request.remote_addr, request.endpoint))
+
+@app.errorhandler(Overloaded)
+def refuse_overloaded(e):
+
+    """
+    Refuses a request turned away by the rate limiter or the full scans'
+    budget, telling the client when to try again
+    """
+
+    return jsonify({'error': str(e)}), e.status, {
+        'Retry-After': retry_after_header(e.retry_after)}
+
 @app.route("/", methods=['GET'])
 def hello():
 
@@ -82,7 +952,8 @@ def hello():
             add "sports", "events" or "selections" to the URL"""
 
 @app.route("/sports", methods=['POST'])
-def create_sport():
+@accepts(CREATE_SPORT_PARAMS)
+def create_sport(args):
 
     """
     Create a new sport with a given name, and optionally a slug and active 
@@ -92,24 +963,11 @@ def create_sport():
     """
 
     try:
-        name = request.args.get('name')
-        slug = request.args.get('slug')
-        if name and not slug:
-            slug = slugify(name)
-        active = request.args.get('active') or False
-
-        if type(active) == "str":
-            if active.lower() in ["false", "0"]:
-                active = False
-            elif active.lower() in ["true", "1"]:
-                active = True
-            else:
-                return jsonify({'error': "active must be either true or false"}), 400
+        name = args['name']
+        slug = args.get('slug') or make_slug(name)
+        active = args.get('active', False)
 
-        if not name:
-            return jsonify({'error': "Name of sport is required"}), 400
-
-        conn = get_db_connection()
+        conn = get_db_connection(shard_for_sport(name))
         cur = conn.cursor()
         cur.execute("""INSERT INTO sports (name, slug, active)
                         VALUES (?, ?, ?)""", (
@@ -124,7 +982,8 @@ def create_sport():
         return jsonify({'message': f'error creating sport: {e}'}), 500
 
 @app.route("/sports", methods=['GET'])
-def search_sports():
+@accepts(SEARCH_SPORTS_PARAMS)
+def search_sports(args):
 
     """
     Searches the sports table for all records, or when query parameters
@@ -141,59 +1000,57 @@ def search_sports():
     slug: gets all sports whose slug exactly matches the given slug
     active: gets all sports whose active status matches the given active
             status
+    fields: only returns the given fields of each sport, separated by
+            commas, e.g. name,active
     """
 
-    data = request.args
-
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    query = "SELECT * FROM sports"
+    fields = args.pop('fields', SPORT_FIELDS)
+    query = f"SELECT {select_fields(SPORT_FIELDS, fields)} FROM sports"
 
     params = []
 
-    if len(data) != 0:
+    if len(args) != 0:
         query += " WHERE "
-        for arg in data:
+        for arg, value in args.items():
             # subquery to handle more complex query of getting sports
             # with a certain minimum number of active events
             if arg == "min-events":
                 query += """name IN
                             (SELECT sport FROM events GROUP BY sport 
                             HAVING SUM(active) >= ?) AND """
-                params.append(int(data[arg]))
+                params.append(value)
             elif arg.startswith("name-"):
                 query += "name LIKE ? AND "
-                param = data[arg]
+                param = value
                 if arg == "name-start":
-                    param = data[arg] + "%"
+                    param = value + "%"
                 elif arg == "name-end":
-                    param = "%" + data[arg]
+                    param = "%" + value
                 elif arg == "name-contains":
-                    param = "%" + data[arg] + "%"
+                    param = "%" + value + "%"
                 params.append(param)
 
             # Avoid hardcoding parameters where possible, to make potential
             # updates for parameters for new columns in sports table easier
-            # If it's not a parameter listed above, it should be one of the
-            # columns in the sports table. Invalid parameters will result
-            # in an error message
+            # If it's not a parameter listed above, it is one of the
+            # columns in the sports table, as SEARCH_SPORTS_PARAMS has
+            # already rejected any others
             else:
                 arg = arg.replace("-", "_")
                 query += f"{arg} = ? AND "
-                params.append(data[arg])
+                params.append(value)
         query = query[:-4] # remove the last "AND" from the query
-        cur.execute(query, params)
 
-    else:
-        cur.execute(query)
-
-    sports = cur.fetchall()
-    conn.close()
-    return jsonify([dict(row) for row in sports]), 200
+    # a sport by name can only be in one shard
+    shards = [shard_for_sport(args['name'])] if 'name' in args else None
+    snapshot_age = fresh_snapshot_age()
+    sports = run_search(query, params, shards, snapshot_age is not None,
+                        full_scan=is_full_scan(args))
+    return search_response(sports, snapshot_age)
 
 @app.route("/sports/<string:name>", methods=['PUT'])
-def update_sport(name):
+@accepts(UPDATE_SPORT_PARAMS)
+def update_sport(name, args):
 
     """
     Updates the sport with the given name, setting new values in the
@@ -208,30 +1065,24 @@ def update_sport(name):
     Name cannot be updated because it is a primary key
     """
 
-    data = request.args
-    
-    if 'active' in data.keys():
-        active = data['active']
-
-        if active.lower() == "false":
-            active = False
-        elif active.lower() == "true":
-            active = True
-        else:
-            return jsonify({'error': "active must be either true or false"}), 400
-
-    if len(data) == 0:
+    if len(args) == 0:
         return jsonify({'message': 'No data provided to update'}), 400
-
-    conn = get_db_connection()
+    # a sport's shard comes from its name, so it can't be renamed to a name
+    # that belongs in another shard without moving all of its events
+    if 'name' in args and \
+            shard_for_sport(args['name']) != shard_for_sport(name):
+        return jsonify({'error': 'sport can\'t be renamed to a name in '
+                                 'another shard'}), 409
+
+    conn = get_db_connection(shard_for_sport(name))
     cur = conn.cursor()
 
     update_fields = []
     update_params = []
 
-    for arg in data:
+    for arg, value in args.items():
         update_fields.append(f"{arg} = ?")
-        update_params.append(data[arg])
+        update_params.append(value)
     update_params.append(name)
 
     query = f"UPDATE sports SET {', '.join(update_fields)} WHERE name = ?"
@@ -247,18 +1098,20 @@ def delete_sport(name):
     Deletes a sport with the given name from the sports table
     """
 
-    conn = get_db_connection()
+    conn = get_db_connection(shard_for_sport(name))
     cur = conn.cursor()
     try:
         cur.execute("DELETE FROM sports WHERE name = ?", (name,))
     except sqlite3.Error as e:
-        return jsonify({'error': f"error deleting sport: {e}"}, 500)
+        conn.close()
+        return jsonify({'error': f"error deleting sport: {e}"}), 500
     conn.commit()
     conn.close()
     return jsonify({'message': "sport deleted"}), 204
 
 @app.route("/events", methods=['POST'])
-def create_event():
+@accepts(CREATE_EVENT_PARAMS)
+def create_event(args):
 
     """
     Create a new event with a given name, sport, scheduled start time, 
@@ -269,67 +1122,55 @@ def create_event():
     """
 
     try:
-        name = request.args.get('name')
-        slug = request.args.get('slug')
-        if name and not slug:
-            slug = slugify(name)
-        active = request.args.get('active') or False
-        
-        if type(active) == "str":
-            if active.lower() in ["false", "0"]:
-                active = False
-            elif active.lower() in ["true", "1"]:
-                active = True
-            else:
-                return jsonify({'error': "active must be either true or false"}), 400
-            
+        name = args['name']
+        slug = args.get('slug') or make_slug(name)
+        active = args.get('active', False)
+
         # the event has not taken place yet, play has not started, so
-        # it should be Preplay until it is started.
+        # it should be Preplay until it is started, whatever type is given.
         # Variable name is event_type to avoid confusion with Python's
         # 'type' function
         event_type = "Preplay"
-        sport = request.args.get('sport')
+        sport = args['sport']
         # event must start as Pending, as it has not taken place yet
         # so it can't be passed as a parameter, it makes no sense
         # to create an event after it's started (or ended, or been
         # cancelled)
         status = "Pending"
-        scheduled_start = request.args.get('scheduled-start')
-        if scheduled_start:
-            scheduled_start = parse(scheduled_start)
-            scheduled_start_utc = scheduled_start.astimezone(UTC)
+        scheduled_start = args['scheduled-start']
         # this won't be set until the event type is changed to Started,
         # so it can't be passed as a parameter
-        actual_start = "NULL"
-
-        if not (name and sport and scheduled_start):
-            create_event_message = "Name, type, sport and scheduled start "
-            create_event_message += "of event are all required"
-            return jsonify({'error': create_event_message}), 400
-
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""INSERT INTO events
-                        (name, slug, active, type, sport, status, 
-                        scheduled_start, actual_start)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", (
-            name,
-            slug,
-            active,
-            event_type,
-            sport,
-            status,
-            scheduled_start_utc,
-            actual_start
-        ))
-        conn.commit()
-        conn.close()
+        actual_start = None
+
+        with names_lock():
+            if name_taken("events", name):
+                return jsonify({'message': f'error creating event: {name} '
+                                           'already exists'}), 409
+            conn = get_db_connection(shard_for_sport(sport))
+            cur = conn.cursor()
+            cur.execute("""INSERT INTO events
+                            (name, slug, active, type, sport, status, 
+                            scheduled_start, actual_start)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", (
+                name,
+                slug,
+                active,
+                event_type,
+                sport,
+                status,
+                scheduled_start,
+                actual_start
+            ))
+            conn.commit()
+            conn.close()
+        schedule_event(name, scheduled_start)
         return jsonify({'message': 'event created'}), 201
     except sqlite3.Error as e:
         return jsonify({'message': f'error creating event: {e}'}), 500
 
 @app.route("/events", methods=['GET'])
-def search_events():
+@accepts(SEARCH_EVENTS_PARAMS)
+def search_events(args):
 
     """
     Searches the events table for all records, or when query parameters
@@ -348,59 +1189,98 @@ def search_events():
     slug: gets all sports whose slug exactly matches the given slug
     active: gets all sports whose active status matches the given active
             status
+    fields: only returns the given fields of each event, separated by
+            commas, e.g. name,status
+    include: sport, to return each event's sport as well, from the same
+             query. The events are then under events, and their sports
+             (each given once) under sports
+    archived: true to search the archived events instead (see
+              archive_events)
     """
 
-    data = request.args
-
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    query = "SELECT * FROM events"
+    fields = args.pop('fields', EVENT_FIELDS)
+    include = args.pop('include', [])
+    archived = args.pop('archived', False)
+    query = f"SELECT {select_fields(EVENT_FIELDS, fields)}"
+    if include:
+        # the sport links each event to its included sport
+        if "sport" not in fields:
+            query += f", {EVENT_FIELDS['sport']}"
+        query += f", {parent_fields('sport', SPORT_FIELDS)}"
+    query += f" FROM {archive.source('events', archived)}"
+    if include:
+        query += f" {PARENT_JOINS['sport']}"
 
     params = []
 
-    if len(data) != 0:
+    if len(args) != 0:
         query += " WHERE "
-        for arg in data:
+        for arg, value in args.items():
             # subquery to handle more complex query of getting events
             # with a certain minimum number of active selections
             if arg == "min-selections":
-                query += """name IN (SELECT event FROM selections
-                            GROUP BY event HAVING SUM(active) >= ?) AND"""
-                params.append(int(data[arg]))
+                query += f"""events.id IN (SELECT event_id
+                             FROM {archive.source('selections', archived)}
+                             GROUP BY event_id HAVING SUM(active) >= ?) AND """
+                params.append(value)
+            # timestamps are stored in TIMESTAMP_FORMAT, so this is a
+            # plain range scan on the scheduled_start index
             elif arg == "timeframe":
-                param = parse(data[arg])
-                param_utc = param.astimezone(UTC)
-                query += """scheduled_start BETWEEN DATETIME('now')
-                            AND DATETIME(?) AND """
-                params.append(param_utc)
+                query += "events.scheduled_start BETWEEN ? AND ? AND "
+                params.append(utc_now_timestamp())
+                params.append(value)
             elif arg.startswith("name-"):
-                query += "name LIKE ? AND "
-                param = data[arg]
+                query += "events.name LIKE ? AND "
+                param = value
                 if arg == "name-start":
-                    param = data[arg] + "%"
+                    param = value + "%"
                 elif arg == "name-end":
-                    param = "%" + data[arg]
+                    param = "%" + value
                 elif arg == "name-contains":
-                    param = "%" + data[arg] + "%"
+                    param = "%" + value + "%"
                 params.append(param)
             else:
                 arg = arg.replace("-", "_")
-                query += f"{arg} = ? AND "
-                params.append(data[arg])
+                query += f"{EVENT_FIELDS[arg]} = ? AND "
+                params.append(value)
         query = query[:-4]
         print(query, params)
-        cur.execute(query, params)
 
-    else:
-        cur.execute(query)
+    # all events for a sport are in the same shard as the sport
+    shards = [shard_for_sport(args['sport'])] if 'sport' in args else None
+    snapshot_age = fresh_snapshot_age()
+    events = run_search(query, params, shards, snapshot_age is not None,
+                        full_scan=is_full_scan(args))
+    if include:
+        events, parents = include_parents(events, include, fields)
+        return search_response({"events": events, **parents}, snapshot_age)
+    return search_response(events, snapshot_age)
 
-    events = cur.fetchall()
-    conn.close()
-    return jsonify([dict(row) for row in events]), 200
+@app.route("/events/upcoming", methods=['GET'])
+@accepts(UPCOMING_EVENTS_PARAMS)
+def upcoming_events(args):
+
+    """
+    Lists the name and scheduled start of every event due to start between
+    now and the given number of hours from now, in start order. This is
+    answered from the in-memory schedule with a binary search, without
+    touching the database
+
+    Possible parameters:
+    hours: how many hours ahead to look (24 by default)
+    """
+
+    hours = args.get('hours', 24)
+    now = datetime.now(timezone.utc)
+    end = now + timedelta(hours=hours)
+    upcoming = get_event_schedule().between(now.strftime(TIMESTAMP_FORMAT),
+                                            end.strftime(TIMESTAMP_FORMAT))
+    return jsonify([{'name': event_name, 'scheduled_start': start}
+                    for start, event_name in upcoming]), 200
 
 @app.route("/events/<string:name>", methods=['PUT'])
-def update_event(name):
+@accepts(UPDATE_EVENT_PARAMS)
+def update_event(name, args):
 
     """
     Updates the event with the given name, setting new values in the
@@ -418,77 +1298,110 @@ def update_event(name):
     status: updates the status in the database to the specified value in the
             query string
     
-    Name cannot be updated because it is a primary key
+    Name cannot be updated because it is a unique key
     Sport cannot be updated because it is a foreign key referencing the sports table
     """
 
-    data = request.args
-
-    if len(data) == 0:
+    if len(args) == 0:
         return jsonify({'error': 'No data provided to update'}), 400
-    
-    if 'status' in data.keys() and data['status'].lower() not in \
-        ['pending', 'started', 'ended', 'cancelled']:
-        return jsonify({'error': 'Invalid status'}), 400
-    
-    if 'type' in data.keys() and data['type'].lower() not in \
-        ['preplay', 'inplay']:
-        return jsonify({'error': 'Invalid event type'}), 400
-
-    conn = get_db_connection()
-    cur = conn.cursor()
 
-    update_fields = []
-    update_params = []
+    shard = find_shard("events", name)
+    # an event lives in its sport's shard, so it can't be moved to a sport
+    # in another shard
+    if 'sport' in args and shard_for_sport(args['sport']) != shard:
+        return jsonify({'error': 'event can\'t be moved to a sport in '
+                                 'another shard'}), 409
 
-    for arg in data:
-        if arg == "scheduled-start":
-            scheduled_start = parse(scheduled_start)
-            scheduled_start_utc = scheduled_start.astimezone(UTC)
-            update_params.append(scheduled_start_utc)
-        else:
-            update_params.append(data[arg])
-        update_fields.append(f"{arg} = ?")
-
-    update_params.append(name)
+    conn = get_db_connection(shard)
+    cur = conn.cursor()
 
-    query = f"UPDATE events SET {', '.join(update_fields)} WHERE name = ?"
-    cur.execute(query, update_params)
+    # work out every column that changes up front, so the event can be
+    # written with a single UPDATE
+    changes = {}
+    for arg, value in args.items():
+        if arg != "status":
+            changes[arg.replace("-", "_")] = value
+
+    if 'status' in args:
+        current = cur.execute("SELECT status FROM events WHERE name = ?",
+                              (name,)).fetchone()
+        if current is None:
+            conn.close()
+            return jsonify({'error': 'Event not found'}), 404
+
+        # starting an event sets its actual start and sets its type to
+        # Inplay, ending or cancelling it makes it inactive. These take
+        # priority over any other parameters given
+        try:
+            changes.update(lifecycle.transition(current['status'],
+                                                args['status'],
+                                                utc_now_timestamp()))
+        except lifecycle.InvalidTransition as e:
+            conn.close()
+            return jsonify({'error': str(e)}), 409
+
+    # a status change is only written if the event still has the status
+    # it was checked against, so two concurrent changes (e.g. starting and
+    # cancelling a pending event) can't both pass the check
+    condition = "name = ?"
+    params = [name]
+    if 'status' in args:
+        condition += " AND status = ?"
+        params.append(current['status'])
+
+    renaming = changes.get('name', name) != name
+    updated = []
+    with names_lock(renaming):
+        if renaming and name_taken("events", changes['name']):
+            conn.close()
+            return jsonify({'error': f"{changes['name']} already exists"}), 409
+        if changes:
+            assignments = ", ".join(f"{column} = ?" for column in changes)
+            cur.execute(f"""UPDATE events SET {assignments} WHERE {condition}
+                            RETURNING sport, scheduled_start""",
+                        [*changes.values(), *params])
+            updated = cur.fetchall()
+            if not updated and 'status' in args:
+                conn.close()
+                return jsonify({'error': 'the event was changed by another '
+                                         'request, try again'}), 409
+
+            # for any update that deactivates an event,
+            # check if it was the last one for its sport
+            if updated and not changes.get('active', True):
+                lifecycle.deactivate_sports(cur, [updated[0]['sport']])
 
-    if 'status' in data.keys():
-        status = data['status']
+        conn.commit()
+        conn.close()
+    # the schedule only changes if there was an event to update
+    if updated and renaming:
+        unschedule_event(name)
+    if updated and (renaming or 'scheduled_start' in changes):
+        schedule_event(changes.get('name', name),
+                       updated[0]['scheduled_start'])
+    return jsonify({'message': 'Updated successfully'}), 200
 
-        # if the status is started,
-        # the actual start should be set to the current time,
-        # and the event type should be set to Inplay, as play has begun
-        if status.lower() == "started":
-            cur.execute("UPDATE events SET actual_start = ? WHERE name = ?",
-                        (datetime.now(timezone.utc), name))
-            cur.execute("UPDATE events SET type = 'Inplay' WHERE name = ?",
-                        (name,))
+@app.route("/events", methods=['PUT'])
+@accepts(UPDATE_EVENTS_PARAMS)
+def update_events(args):
 
-        # if the status is ended or cancelled,
-        # the event should be inactive, as it is no longer taking place
-        elif status.lower() in ["ended", "cancelled"]:
-            cur.execute("UPDATE events SET active = 0 WHERE name = ?", (name,))
-            cur.execute("""UPDATE sports SET active = 0 WHERE name IN
-                        (SELECT sport FROM events GROUP BY sport 
-                        HAVING SUM(active) = 0)""")
+    """
+    Moves every event scheduled to start by a given time to the given
+    status in one go, e.g. starting every event that is due to start now.
+    Each database gets one UPDATE for all of its events, plus one update
+    for their sports if they became inactive. Events that can't make the
+    transition (e.g. ones that have already ended) are left alone
 
-    
-    if 'active' in data.keys():
-        active = data['active']
-        
-        # for any update that deactivates an event,
-        # check if it was the last one for its sport
-        if active.lower() in ["false", "0"]:
-            cur.execute("""UPDATE sports SET active = 0 WHERE name IN
-                        (SELECT sport FROM events GROUP BY sport 
-                        HAVING SUM(active) = 0)""")
+    Possible parameters:
+    status: the status to move the events to (required)
+    scheduled-before: only events scheduled to start at or before this time
+                      are changed (now by default)
+    """
 
-    conn.commit()
-    conn.close()
-    return jsonify({'message': 'Updated successfully'}), 200
+    now = utc_now_timestamp()
+    scheduled_before = args.get('scheduled-before', now)
+    updated = transition_due_events(args['status'], now, scheduled_before)
+    return jsonify({'message': 'Updated successfully', 'updated': updated}), 200
 
 @app.route("/events/<string:name>", methods=['DELETE'])
 def delete_event(name):
@@ -497,18 +1410,21 @@ def delete_event(name):
     Deletes an event with the given name from the events table
     """
 
-    conn = get_db_connection()
+    conn = get_db_connection(find_shard("events", name))
     cur = conn.cursor()
     try:
         cur.execute("DELETE FROM events WHERE name = ?", (name,))
     except sqlite3.Error as e:
-        return jsonify({'error': f'error deleting event {e}'})
+        conn.close()
+        return jsonify({'error': f'error deleting event: {e}'}), 500
     conn.commit()
     conn.close()
+    unschedule_event(name)
     return jsonify({'message': "event deleted"}), 204
 
 @app.route("/selections", methods=['POST'])
-def create_selection():
+@accepts(CREATE_SELECTION_PARAMS)
+def create_selection(args):
 
     """
     Create a new selection with a given name, event, price, 
@@ -517,47 +1433,42 @@ def create_selection():
     """
 
     try:
-        name = request.args.get('name')
-        event = request.args.get('event')
-        # convert price to float with 2 decimal places
-        price = "{:.2f}".format(float(request.args.get('price')))
-        active = request.args.get('active') or False
-        
-        if type(active) == "str":
-            if active.lower() in ["false", "0"]:
-                active = False
-            elif active.lower() in ["true", "1"]:
-                active = True
-            else:
-                return jsonify({'error': "active must be either true or false"}), 400
-            
+        name = args['name']
+        event = args['event']
+        # already converted to cents
+        price = args['price']
+        active = args.get('active', False)
+
         # outcome will be Unsettled by default, as we don't know the result yet
         outcome = "Unsettled"
 
-        if not (name and event and price):
-            return jsonify({'error': "Name, event and price of selection are required"}), 400
-
-        print(request.args)
-
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""INSERT INTO selections
-                    (name, event, price, active, outcome)
-                    VALUES (?, ?, ?, ?, ?)""", (
-            name,
-            event,
-            price,
-            active,
-            outcome
-        ))
-        conn.commit()
-        conn.close()
+        with names_lock():
+            if name_taken("selections", name):
+                return jsonify({'message': 'error creating selection: '
+                                           f'{name} already exists'}), 409
+            conn = get_db_connection(find_shard("events", event))
+            cur = conn.cursor()
+            # a missing event leaves event_id NULL, which fails its NOT NULL
+            # check, as the foreign key check would have
+            cur.execute("""INSERT INTO selections
+                        (name, event_id, price_cents, active, outcome)
+                        VALUES (?, (SELECT id FROM events WHERE name = ?),
+                                ?, ?, ?)""", (
+                name,
+                event,
+                price,
+                active,
+                outcome
+            ))
+            conn.commit()
+            conn.close()
         return jsonify({'message': 'selection created'}), 201
     except sqlite3.Error as e:
         return jsonify({'message': f'error creating selection: {e}'}), 500
 
 @app.route("/selections", methods=['GET'])
-def search_selections():
+@accepts(SEARCH_SELECTIONS_PARAMS)
+def search_selections(args):
 
     """
     Searches the selections table for all records, or when query parameters
@@ -576,54 +1487,81 @@ def search_selections():
     active: gets all selections whose active status matches the given string
     outcome: gets all selections whose outcome exactly matches the given
              string
+    fields: only returns the given fields of each selection, separated by
+            commas, e.g. name,price
+    include: event and/or sport, separated by commas, to return each
+             selection's event and its sport as well, from the same query.
+             The selections are then under selections, their events (each
+             given once) under events, and their sports under sports
+    archived: true to search the archived selections instead (see
+              archive_events)
     """
-    data = request.args
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    query = "SELECT * FROM selections"
+    fields = args.pop('fields', SELECTION_FIELDS)
+    include = args.pop('include', [])
+    archived = args.pop('archived', False)
+    # sports are linked to selections through their events, so including
+    # sports includes events too
+    if "sport" in include and "event" not in include:
+        include = ["event", *include]
+
+    query = f"SELECT {select_fields(SELECTION_FIELDS, fields)}"
+    if include:
+        # the event links each selection to its included event
+        if "event" not in fields:
+            query += f", {SELECTION_FIELDS['event']}"
+        query += f", {parent_fields('event', EVENT_FIELDS)}"
+    if "sport" in include:
+        query += f", {parent_fields('sport', SPORT_FIELDS)}"
+    query += f" FROM {archive.source('selections', archived)}"
+    # events are only joined to show, search by or include a selection's
+    # event
+    if "event" in fields or "event" in args or include:
+        query += " " + PARENT_JOINS['event'].format(
+            events=archive.source('events', archived))
+    if "sport" in include:
+        query += f" {PARENT_JOINS['sport']}"
 
     params = []
 
-    if len(data) != 0:
+    if len(args) != 0:
         query += " WHERE "
-        for arg in data:
-            # prices must always be shown with two decimal places
+        for arg, value in args.items():
+            # prices are given in cents, to compare with price_cents
             if arg == "min-price":
-                query += "price >= ? AND"
-                params.append("{:.2f}".format(float(data[arg])))
+                query += "selections.price_cents >= ? AND "
+                params.append(value)
             elif arg == "max-price":
-                query += "price <= ? AND"
-                params.append("{:.2f}".format(float(data[arg])))
+                query += "selections.price_cents <= ? AND "
+                params.append(value)
             elif arg.startswith("name-"):
-                query += "name LIKE ? AND "
-                param = data[arg]
+                query += "selections.name LIKE ? AND "
+                param = value
                 if arg == "name-start":
-                    param = data[arg] + "%"
+                    param = value + "%"
                 elif arg == "name-end":
-                    param = "%" + data[arg]
+                    param = "%" + value
                 elif arg == "name-contains":
-                    param = "%" + data[arg] + "%"
+                    param = "%" + value + "%"
                 params.append(param)
             else:
-                arg = arg.replace("-", "_")
-                query += f"{arg} = ? AND "
-                params.append(data[arg])
+                query += f"{SELECTION_FILTERS[arg]} = ? AND "
+                params.append(value)
         query = query[:-4]
-        #params = " AND ".join([arg + " = " + data[arg] for arg in data])
         print(query, params)
-        cur.execute(query, params)
 
-    else:
-        cur.execute(query)
-
-    sports = cur.fetchall()
-    conn.close()
-    return jsonify([dict(row) for row in sports]), 200
+    snapshot_age = fresh_snapshot_age()
+    selections = run_search(query, params, None, snapshot_age is not None,
+                            full_scan=is_full_scan(args))
+    if include:
+        selections, parents = include_parents(selections, include, fields)
+        return search_response({"selections": selections, **parents},
+                               snapshot_age)
+    return search_response(selections, snapshot_age)
 
 @app.route("/selections/<string:name>", methods=['PUT'])
-def update_selection(name):
+@accepts(UPDATE_SELECTION_PARAMS)
+def update_selection(name, args):
 
     """
     Updates the selection with the given name, setting new values in the
@@ -637,47 +1575,63 @@ def update_selection(name):
     outcome: updates the outcome in the database to the specified value in the
              query string
     
-    Name cannot be updated because it is a primary key
+    Name cannot be updated because it is a unique key
     Event cannot be updated because it is a foreign key referencing the events table
     """
 
-    data = request.args
-
-    if len(data) == 0:
+    if len(args) == 0:
         return jsonify({'message': 'No data provided to update'}), 400
-    
-    if 'outcome' in data.keys() and data['outcome'].lower() not in \
-        ['win', 'lose', 'void', 'unsettled']:
-        return jsonify({'error': 'Invalid outcome'}), 400
 
-    conn = get_db_connection()
+    # a selection lives in its event's shard, so it can't be moved to an
+    # event in another shard
+    if 'event' in args and \
+            find_shard("events", args['event']) != find_shard("selections", name):
+        return jsonify({'error': 'selection can\'t be moved to an event in '
+                                 'another shard'}), 409
+
+    renaming = args.get('name', name) != name
+    with names_lock(renaming):
+        if renaming and name_taken("selections", args['name']):
+            return jsonify({'error': f"{args['name']} already exists"}), 409
+        return write_selection_update(name, args)
+
+def write_selection_update(name, args):
+
+    """
+    Writes the changes to a selection given to update_selection, along with
+    the changes to the active status of its event and sport that follow
+    """
+
+    conn = get_db_connection(find_shard("selections", name))
     cur = conn.cursor()
 
     update_fields = []
     update_params = []
 
-    for arg in data:
-        if arg == "price":
-            update_params.append("{:.2f}".format(float(data[arg])))
+    for arg, value in args.items():
+        update_params.append(value)
+        # selections reference their event by id
+        if arg == "event":
+            update_fields.append(
+                "event_id = (SELECT id FROM events WHERE name = ?)")
+        elif arg == "price":
+            update_fields.append("price_cents = ?")
         else:
-            update_params.append(data[arg])
-        update_fields.append(f"{arg} = ?")
+            update_fields.append(f"{arg} = ?")
 
     update_params.append(name)
 
     query = f"UPDATE selections SET {', '.join(update_fields)} WHERE name = ?"
     cur.execute(query, update_params)
 
-    if "outcome" in data.keys():
-        outcome = data['outcome']
-        
+    if "outcome" in args:
         # if the outcome is not unsettled, it is either a win, loss or void,
         # all of which mean the selection is inactive
-        if outcome.lower() != "unsettled":
+        if args['outcome'] != "Unsettled":
             cur.execute("UPDATE selections SET active = 0 WHERE name = ?", 
                         (name,))
-            cur.execute("""UPDATE events SET active = 0 WHERE name IN
-                        (SELECT event FROM selections GROUP BY event 
+            cur.execute("""UPDATE events SET active = 0 WHERE id IN
+                        (SELECT event_id FROM selections GROUP BY event_id
                         HAVING SUM(active) = 0)""")
             # if the event was the last event for its sport,
             # the sport should also be inactive
@@ -685,14 +1639,12 @@ def update_selection(name):
                     (SELECT sport FROM events GROUP BY sport 
                     HAVING SUM(active) = 0)""")
     
-    if "active" in data.keys():
-        active = data['active']
-
+    if "active" in args:
         # if selection is set to inactive, and it was the last selection
         # for its event, set the event to inactive
-        if active.lower() in ["false", "0"]:
-            cur.execute("""UPDATE events SET active = 0 WHERE name IN
-                        (SELECT event FROM selections GROUP BY event 
+        if not args['active']:
+            cur.execute("""UPDATE events SET active = 0 WHERE id IN
+                        (SELECT event_id FROM selections GROUP BY event_id
                         HAVING SUM(active) = 0)""")
             # if the event was the last event for its sport,
             # the sport should also be inactive
@@ -710,16 +1662,505 @@ def delete_selection(name):
     Deletes a selection with the given name from the selections table
     """
 
-    conn = get_db_connection()
+    conn = get_db_connection(find_shard("selections", name))
     cur = conn.cursor()
     try:
         cur.execute("DELETE FROM selections WHERE name = ?", (name,))
     except sqlite3.Error as e:
-        return jsonify({'error': f'error deleting event {e}'})
+        conn.close()
+        return jsonify({'error': f'error deleting selection: {e}'}), 500
     conn.commit()
     conn.close()
     return jsonify({'message': "selection deleted"}), 204
 
+@app.route("/summary", methods=['GET'])
+@accepts(SUMMARY_PARAMS)
+def get_summary(args):
+
+    """
+    Gets the counts dashboards need, read from the rollup tables, so the
+    cost depends on the number of sports and events rather than selections:
+    for each sport, its events and active events, and for each event, its
+    selections and active selections, its lowest, highest and average
+    price, and the number of its selections with each outcome
+
+    Possible parameters:
+    sport: only summarizes the given sport and its events
+    """
+
+    sports_query = """SELECT sports.name, sports.active,
+                             COALESCE(sport_summary.events, 0) AS events,
+                             COALESCE(sport_summary.active_events, 0)
+                                 AS active_events
+                      FROM sports LEFT JOIN sport_summary
+                          ON sport_summary.sport = sports.name"""
+    events_query = """SELECT events.name, events.sport, events.status,
+                             events.active, event_summary.*
+                      FROM event_summary
+                      JOIN events ON events.id = event_summary.event_id"""
+    params = []
+    shards = None
+    if 'sport' in args:
+        sports_query += " WHERE sports.name = ?"
+        events_query += " WHERE events.sport = ?"
+        params.append(args['sport'])
+        shards = [shard_for_sport(args['sport'])]
+
+    snapshot_age = fresh_snapshot_age()
+    # without a sport, every sport and event is read
+    sports = run_search(sports_query, params, shards, snapshot_age is not None,
+                        full_scan=not args)
+    events = run_search(events_query, params, shards, snapshot_age is not None,
+                        full_scan=not args)
+    return search_response({"sports": sports,
+                            "events": [rollups.event_summary(row)
+                                       for row in events]}, snapshot_age)
+
+def parse_batch(body):
+
+    """
+    Checks the body of a batch request, a list of requests to the sports,
+    events and selections routes, each given as {"method": ..., "path":
+    ..., "params": {...}}, and returns them as (method, path, params)
+    tuples, with the params as strings as they would be in a query string.
+    Raises ValueError if it isn't valid
+    """
+
+    if not isinstance(body, list) or not body:
+        raise ValueError("body must be a list of requests")
+    if len(body) > BATCH_LIMIT:
+        raise ValueError(f"at most {BATCH_LIMIT} requests can be batched")
+
+    subrequests = []
+    for index, item in enumerate(body):
+        if not isinstance(item, dict):
+            raise ValueError(f"request {index} must be an object")
+        method = str(item.get("method", "GET")).upper()
+        path = item.get("path")
+        params = item.get("params", {})
+        if method not in ["GET", *BATCH_WRITES]:
+            raise ValueError(f"request {index} has an unknown method")
+        if not isinstance(path, str) or not path.startswith("/") or \
+                path.split("/")[1] not in BATCH_TABLES:
+            raise ValueError(f"request {index} must be to sports, events "
+                             "or selections")
+        if not isinstance(params, dict):
+            raise ValueError(f"request {index} params must be an object")
+        subrequests.append((method, path, {
+            name: str(value).lower() if isinstance(value, bool) else str(value)
+            for name, value in params.items()}))
+    return subrequests
+
+def run_subrequest(method, path, params):
+
+    """
+    Runs one request of a batch through the app's routes, in a request
+    context of its own, and returns its status and JSON body
+    """
+
+    with app.test_request_context(path, method=method, query_string=params,
+                                  environ_overrides={"app.batch": True}):
+        try:
+            response = app.full_dispatch_request()
+        except Exception as e: # the same as an uncaught error in a route
+            return {"status": 500, "body": {"error": str(e)}}
+        return {"status": response.status_code,
+                "body": response.get_json(silent=True)}
+
+def failed(result):
+
+    """
+    Checks whether a request of a batch failed, i.e. it has an error status
+    or gave an error in its body
+    """
+
+    body = result["body"]
+    return result["status"] >= 400 or (isinstance(body, dict) and
+                                       "error" in body)
+
+def run_batch_writes(writes):
+
+    """
+    Runs the writes of a batch in order, sharing one connection, and so one
+    transaction, per database between them. If every write succeeds they
+    are all committed, otherwise they are all rolled back, and the writes
+    after the one that failed aren't run. Returns the results of the writes
+    that ran, and whether they were committed
+    """
+
+    connections = {}
+    token = batch_connections.set(connections)
+    results = []
+    try:
+        for method, path, params in writes:
+            results.append(run_subrequest(method, path, params))
+            if failed(results[-1]):
+                break
+    finally:
+        batch_connections.reset(token)
+
+    committed = not any(failed(result) for result in results)
+    for conn in connections.values():
+        if committed:
+            conn.conn.commit()
+        else:
+            conn.conn.rollback()
+        conn.conn.close()
+    return results, committed
+
+@app.route("/batch", methods=['POST'])
+def run_batch():
+
+    """
+    Runs many requests to the sports, events and selections routes in one
+    go, given in the body as a JSON list of {"method": ..., "path": ...,
+    "params": {...}} objects, e.g. {"method": "PUT", "path":
+    "/selections/Chelsea", "params": {"price": "3.50"}}.
+
+    The writes (POST, PUT and DELETE) run first, in the order given, in one
+    transaction per database, so if any of them fails none of them are
+    kept, and the writes after it aren't run. The searches (GET) then run
+    in parallel, and see the batch's writes, as they read the primary
+    database even when replicas are enabled. Returns the status and body of
+    each request in the order given, and whether the writes were committed
+    """
+
+    global batch_pool, event_schedule
+
+    try:
+        subrequests = parse_batch(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    writes = [index for index, (method, _, _) in enumerate(subrequests)
+              if method in BATCH_WRITES]
+    reads = [index for index, (method, _, _) in enumerate(subrequests)
+             if method not in BATCH_WRITES]
+    results = [None] * len(subrequests)
+
+    write_results, committed = run_batch_writes(
+        [subrequests[index] for index in writes])
+    for index, result in zip(writes, write_results):
+        results[index] = result
+    for index in writes[len(write_results):]:
+        results[index] = {"status": 424, "body": {
+            "error": "not run, as an earlier write in the batch failed"}}
+    if not committed:
+        # the in-memory schedule may have events that were rolled back, so
+        # it is reloaded on next use
+        event_schedule = None
+
+    with batch_pool_lock:
+        if batch_pool is None:
+            batch_pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
+    read_results = batch_pool.map(lambda subrequest: run_subrequest(*subrequest),
+                                  [subrequests[index] for index in reads])
+    for index, result in zip(reads, read_results):
+        results[index] = result
+
+    return jsonify({'committed': committed, 'results': results}), 200
+
+@app.route("/limits", methods=['GET'])
+def get_limits():
+
+    """
+    Gets the counters for the rate limiter (null when it is off) and the
+    full scans' budget: the requests allowed and limited, and the full
+    searches running, waiting, admitted, queued and rejected
+    """
+
+    return jsonify({
+        'rate_limit': rate_limiter.stats() if rate_limiter else None,
+        'full_scans': full_scans.stats()}), 200
+
+def archive_events(before):
+
+    """
+    Moves every finished event that started before the given time (in
+    TIMESTAMP_FORMAT), with all of its selections, into the archive tables
+    of its database, and takes it off the in-memory schedule. Each database
+    is archived in one transaction. Returns the names of the events archived
+    """
+
+    def archive_shard(shard):
+        conn = get_db_connection(shard)
+        try:
+            return archive.archive(conn, before)
+        finally:
+            conn.close()
+
+    archived = []
+    for names in map_shards(archive_shard, all_shards()):
+        archived.extend(names)
+    for name in archived:
+        unschedule_event(name)
+    return archived
+
+@app.route("/archive", methods=['POST'])
+@accepts(ARCHIVE_PARAMS)
+def archive_finished_events(args):
+
+    """
+    Archives the events that have finished (cancelled, or ended with every
+    selection settled) and started more than retention-days ago (30 by
+    default), along with their selections. They can then only be found by
+    searches with archived=true
+    """
+
+    retention_days = args.get('retention-days', archive.RETENTION_DAYS)
+    archived = archive_events(archive.cutoff(retention_days))
+    return jsonify({'message': f"archived {len(archived)} events",
+                    'events': archived}), 200
+
+def catalogue_importer():
+
+    """
+    Gets an importer that loads rows into the right database for each
+    sport, so bulk imports work the same with or without sharding
+    """
+
+    # selections are routed to the shard of their event, which is
+    # usually imported just before them
+    event_shards = {}
+
+    def route(table, row):
+        if table == "sports":
+            return shard_for_sport(row["name"])
+        if table == "events":
+            shard = shard_for_sport(row["sport"])
+            if SHARD_COUNT:
+                event_shards[row["name"]] = shard
+            return shard
+        if row["event"] in event_shards:
+            return event_shards[row["event"]]
+        return find_shard("events", row["event"])
+
+    return catalogue.CatalogueImporter(get_db_connection, all_shards(), route)
+
+def names_in_shards(table, names):
+
+    """
+    Gets which of the given event or selection names are already used in
+    any shard, looking them up a few hundred at a time in every shard in
+    parallel
+    """
+
+    names = list(names)
+
+    def lookup(shard):
+        conn = get_db_connection(shard)
+        found = set()
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            found.update(row[0] for row in conn.execute(
+                f"""SELECT name FROM {table}
+                    WHERE name IN ({", ".join("?" * len(chunk))})""", chunk))
+        conn.close()
+        return found
+
+    return set().union(*map_shards(lookup, all_shards()))
+
+def unique_names(records):
+
+    """
+    Passes the (table, row) pairs of an import through, checking that the
+    event and selection names stay unique across the shards, as name_taken
+    does for single records: each name can only be imported once, and only
+    if no shard has it already. Raises ValueError once the records run
+    out, before the import commits, if any name is taken. Call it while
+    holding names_lock()
+    """
+
+    names = {"events": set(), "selections": set()}
+    for table, row in records:
+        if table in names and isinstance(row, dict):
+            if row.get("name") in names[table]:
+                raise ValueError(f"{row['name']} is imported more than once")
+            names[table].add(row.get("name"))
+        yield table, row
+
+    for table, imported in names.items():
+        taken = names_in_shards(table, imported)
+        if taken:
+            raise ValueError(f"{', '.join(sorted(taken))} already exist")
+
+@app.route("/export", methods=['GET'])
+@accepts(CATALOGUE_PARAMS)
+def export_catalogue(args):
+
+    """
+    Streams the whole catalogue, so large databases can be downloaded
+    without building the whole response in memory.
+
+    Possible parameters:
+    format: ndjson (the default), which returns every table, or csv or
+            parquet, which return a single table. Parquet falls back to csv
+            if pyarrow is not installed
+    table: the table to export for csv and parquet (sports, events or
+           selections)
+    """
+
+    file_format = args.get('format', 'ndjson')
+    table = args.get('table')
+
+    if file_format != "ndjson" and table is None:
+        return jsonify({'error': 'table is required for csv and parquet'}), 400
+    if file_format == "parquet":
+        file_format = catalogue.columnar_format()
+
+    # an export reads whole tables, so it holds a slot of the full scans'
+    # budget until the response has been sent
+    full_scans.acquire()
+    conns = [get_db_connection(shard) for shard in all_shards()]
+
+    if file_format == "parquet":
+        buffer = io.BytesIO()
+        try:
+            catalogue.export_parquet(conns, table, buffer)
+        finally:
+            for conn in conns:
+                conn.close()
+            full_scans.release()
+        return Response(buffer.getvalue(),
+                        mimetype="application/vnd.apache.parquet")
+
+    def generate():
+        try:
+            if file_format == "ndjson":
+                yield from catalogue.export_ndjson(conns)
+            else:
+                yield from catalogue.export_csv(conns, table)
+        finally:
+            for conn in conns:
+                conn.close()
+
+    mimetype = "application/x-ndjson" if file_format == "ndjson" else "text/csv"
+    response = Response(generate(), mimetype=mimetype)
+    # called once the response is closed, even if the body was never read
+    response.call_on_close(full_scans.release)
+    return response
+
+@app.route("/import", methods=['POST'])
+@accepts(CATALOGUE_PARAMS)
+def import_catalogue(args):
+
+    """
+    Loads records in bulk from the request body, in one transaction per
+    database, so either every record is imported or none are.
+
+    Possible parameters:
+    format: ndjson (the default), with records for any of the tables, or
+            csv or parquet, with records for a single table
+    table: the table to import into for csv and parquet (sports, events or
+           selections)
+    """
+
+    file_format = args.get('format', 'ndjson')
+    table = args.get('table')
+
+    if file_format != "ndjson" and table is None:
+        return jsonify({'error': 'table is required for csv and parquet'}), 400
+    if file_format == "parquet" and not catalogue.HAVE_PYARROW:
+        return jsonify({'error': 'pyarrow is needed to import parquet'}), 400
+
+    stream = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+    if file_format == "ndjson":
+        records = catalogue.read_ndjson(stream)
+    elif file_format == "csv":
+        records = catalogue.table_records(table, catalogue.read_csv(stream))
+    else:
+        body = io.BytesIO(request.get_data())
+        records = catalogue.table_records(table, catalogue.read_parquet(body))
+
+    try:
+        # each database's UNIQUE constraint only keeps names unique within
+        # one shard
+        with names_lock():
+            if SHARD_COUNT:
+                records = unique_names(records)
+            counts = catalogue.import_records(catalogue_importer(), records)
+    except (sqlite3.Error, ValueError, KeyError) as e:
+        return jsonify({'message': f'error importing catalogue: {e}'}), 400
+
+    # the in-memory schedule is reloaded on next use to include the events
+    # imported
+    global event_schedule
+    event_schedule = None
+    return jsonify({'message': 'catalogue imported', 'imported': counts}), 201
+
+def load_hierarchy():
+
+    """
+    Builds the catalogue hierarchy from the name, parent and active status
+    of every sport, event and selection, read from the replica snapshot
+    when there is a fresh one. Returns the hierarchy and the snapshot age.
+    It reads every table, so it waits for a slot of the full scans' budget
+    """
+
+    return full_scans.run(build_hierarchy)
+
+def build_hierarchy():
+
+    """
+    Builds the catalogue hierarchy for load_hierarchy
+    """
+
+    snapshot_age = fresh_snapshot_age()
+    queries = [
+        "SELECT name, NULL AS parent, active FROM sports ORDER BY rowid",
+        "SELECT name, sport AS parent, active FROM events ORDER BY id",
+        """SELECT selections.name, events.name AS parent, selections.active
+           FROM selections JOIN events ON events.id = selections.event_id
+           ORDER BY selections.id""",
+    ]
+    # imported here, as it needs NumPy, which is slow to import and only
+    # used by the hierarchy routes
+    import hierarchy # pylint: disable=import-outside-toplevel
+
+    tables = [[(row['name'], row['parent'], row['active'])
+               for row in run_search(query, [], None,
+                                     snapshot_age is not None)]
+              for query in queries]
+    return hierarchy.Hierarchy(*tables), snapshot_age
+
+@app.route("/hierarchy", methods=['GET'])
+def get_hierarchy():
+
+    """
+    Exports the catalogue as a parent array, where each sport, event and
+    selection is a node given by its index, and parents[i] is the index of
+    node i's parent (-1 for sports). names[i] is the name of node i, and
+    ranges gives the indexes of the sports, events and selections as
+    [start, end). The stats from /hierarchy/stats are included
+    """
+
+    tree, snapshot_age = load_hierarchy()
+    return search_response({**tree.to_dict(), "stats": tree.stats()},
+                           snapshot_age)
+
+@app.route("/hierarchy/stats", methods=['GET'])
+def get_hierarchy_stats():
+
+    """
+    Gets stats about the catalogue hierarchy, worked out in one pass over
+    its parent array: the number of nodes of each kind, internal nodes
+    (sports with events and events with selections), active internal nodes,
+    leaves, selections per event, events per sport, and the names of the
+    events with no selections and the sports with no events
+    """
+
+    tree, snapshot_age = load_hierarchy()
+    return search_response(tree.stats(), snapshot_age)
+
+# the address and port the server listens on when run with python app.py
+HOST = os.environ.get("HOST", "127.0.0.1")
+PORT = int(os.environ.get("PORT", "5000"))
+
 if __name__ == '__main__':
+    # the databases are created or migrated, and the replicas and the
+    # scheduler started, before any request is served, so the server must
+    # be started this way rather than with flask run
     init_db()
-    app.run()
+    start_replicas()
+    start_scheduler()
+    app.run(host=HOST, port=PORT)
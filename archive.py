@@ -0,0 +1,169 @@
+"""
+Archival of finished events into cold storage tables. Events and
+selections are never deleted once they are over, so without this the
+tables that every search, cascade and summary reads would grow forever.
+Archiving moves each finished event that started before the retention
+window, along with all of its selections, into archived_events and
+archived_selections, which have the same columns and are only read by
+searches asking for archived records.
+
+Usage:
+    python archive.py [--retention-days 30]
+"""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+
+# the outcomes of a settled selection. An event that has ended is only
+# archived once none of its selections are left to settle
+SETTLED = ["Win", "Lose", "Void"]
+
+# days finished events are kept in the hot tables for, counted from their
+# actual start (or their scheduled start, if they never started)
+RETENTION_DAYS = 30
+
+# the archive table for each hot table. Searches of the archive read these
+# aliased to the hot table's name, so the same columns and joins work
+NAMES = {"events": "archived_events", "selections": "archived_selections"}
+
+EVENT_COLUMNS = ["name", "slug", "active", "type", "sport", "status",
+                 "scheduled_start", "actual_start"]
+SELECTION_COLUMNS = ["name", "price_cents", "active", "outcome"]
+
+# names aren't unique in the archive, as a name can be used again once the
+# record that had it has been archived. Archived records get ids of their
+# own, as the hot tables may hand out the same ids again
+TABLES = ["""CREATE TABLE IF NOT EXISTS archived_events (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                slug TEXT,
+                active BOOLEAN,
+                type TEXT,
+                sport TEXT,
+                status TEXT,
+                scheduled_start TEXT,
+                actual_start TEXT,
+                archived_at TEXT
+            );""",
+          """CREATE TABLE IF NOT EXISTS archived_selections (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                event_id INTEGER NOT NULL,
+                price_cents INTEGER,
+                active BOOLEAN,
+                outcome TEXT,
+                FOREIGN KEY (event_id)
+                    REFERENCES archived_events (id)
+                    ON UPDATE RESTRICT
+                    ON DELETE RESTRICT
+            );"""]
+
+# the same lookups the hot tables have indexes for
+INDEXES = {"archived_events_name": "archived_events (name)",
+           "archived_events_sport": "archived_events (sport)",
+           "archived_events_scheduled_start":
+               "archived_events (scheduled_start)",
+           "archived_selections_name": "archived_selections (name)",
+           "archived_selections_event_id": "archived_selections (event_id)",
+           "archived_selections_price_cents":
+               "archived_selections (price_cents)"}
+
+# finished events that started before the cutoff: cancelled ones, and ended
+# ones with every selection settled
+FINISHED_EVENTS = f"""SELECT id, name FROM events
+                      WHERE COALESCE(actual_start, scheduled_start) < ?
+                      AND (status = 'Cancelled' OR (status = 'Ended'
+                           AND NOT EXISTS (
+                               SELECT 1 FROM selections
+                               WHERE event_id = events.id
+                               AND COALESCE(outcome, 'Unsettled') NOT IN
+                                   ({", ".join(f"'{o}'" for o in SETTLED)}))))
+                      ORDER BY id"""
+
+def create(cursor):
+
+    """
+    Creates the archive tables and their indexes
+    """
+
+    for sql in TABLES:
+        cursor.execute(sql)
+    for name, columns in INDEXES.items():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {columns}")
+
+def source(table, archived):
+
+    """
+    Gets the table to search for events or selections, i.e. its archive
+    table under the hot table's name when archived is set
+    """
+
+    return f"{NAMES[table]} AS {table}" if archived else table
+
+def cutoff(retention_days, now=None):
+
+    """
+    Gets the time before which finished events are archived, in the stored
+    timestamp format
+    """
+
+    now = now or datetime.now(timezone.utc)
+    return (now - timedelta(days=retention_days)).strftime("%Y-%m-%d %H:%M:%S")
+
+def archive(conn, before):
+
+    """
+    Moves every finished event that started before the given time, with all
+    of its selections, from the hot tables to the archive tables of one
+    database, in a single transaction. Returns the names of the events
+    archived
+    """
+
+    archived_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    events = ", ".join(EVENT_COLUMNS)
+    selections = ", ".join(SELECTION_COLUMNS)
+    cursor = conn.cursor()
+    try:
+        finished = cursor.execute(FINISHED_EVENTS, (before,)).fetchall()
+        for event_id, _ in finished:
+            archived_id = cursor.execute(
+                f"""INSERT INTO archived_events ({events}, archived_at)
+                    SELECT {events}, ? FROM events WHERE id = ?""",
+                (archived_at, event_id)).lastrowid
+            cursor.execute(
+                f"""INSERT INTO archived_selections ({selections}, event_id)
+                    SELECT {selections}, ? FROM selections
+                    WHERE event_id = ? ORDER BY id""",
+                (archived_id, event_id))
+            cursor.execute("DELETE FROM selections WHERE event_id = ?",
+                           (event_id,))
+            cursor.execute("DELETE FROM events WHERE id = ?", (event_id,))
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return [name for _, name in finished]
+
+def main(argv=None):
+
+    """
+    Archives the finished events of the app's database(s) from the command
+    line
+    """
+
+    # imported here, as the app imports this module for its own endpoints
+    import app # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--retention-days", type=float,
+                        default=RETENTION_DAYS,
+                        help="days finished events are kept before they "
+                             "are archived")
+    args = parser.parse_args(argv)
+
+    app.init_db()
+    archived = app.archive_events(cutoff(args.retention_days))
+    print(f"archived {len(archived)} events")
+
+if __name__ == "__main__":
+    main()
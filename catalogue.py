@@ -0,0 +1,475 @@
+"""
+Bulk import and export of the whole catalogue (sports, events and
+selections) as CSV, NDJSON, or Parquet when pyarrow is installed (falling
+back to CSV when it isn't). Rows are streamed in batches in both
+directions, and imports are loaded with executemany in one large
+transaction per database, with indexes dropped during the load and rebuilt
+once at the end.
+
+Usage:
+    python catalogue.py export ndjson catalogue.ndjson
+    python catalogue.py export csv|parquet <directory>
+    python catalogue.py import ndjson catalogue.ndjson
+    python catalogue.py import csv|parquet <directory>
+
+CSV and Parquet use one file per table (sports.csv, events.csv, ...),
+NDJSON holds every table in one file, one {"table": ..., "row": {...}}
+object per line
+"""
+
+import argparse
+import csv
+import importlib.util
+import io
+import json
+import os
+import sys
+from datetime import timezone
+import lifecycle
+from params import cents, choice, flag, parse_datetime
+
+# pyarrow takes longer to import than the rest of the app put together and
+# is only needed for Parquet, so it is imported on first use (see
+# load_pyarrow)
+HAVE_PYARROW = importlib.util.find_spec("pyarrow") is not None
+pa = pq = None
+
+# in the order they must be loaded, as each references the one before
+TABLES = ["sports", "events", "selections"]
+
+FORMATS = ["csv", "ndjson", "parquet"]
+
+# rows fetched or inserted at a time
+BATCH_SIZE = 10000
+
+# events and selections are keyed by integer ids that only mean something
+# within one database, so they are exported through these views, which
+# leave the ids out and give each selection's event by name
+VIEWS = {"events": "event_rows", "selections": "selection_rows"}
+
+# columns given by name in files that are stored as an id:
+# (table, column): (id column, referenced table)
+NAME_REFERENCES = {("selections", "event"): ("event_id", "events")}
+
+# columns given as decimals in files that are stored as whole numbers of
+# hundredths: (table, column): stored column. Views give them back as REAL
+SCALED_COLUMNS = {("selections", "price"): "price_cents"}
+
+def timestamp(value):
+
+    """
+    Parses a timestamp to UTC in the format stored in the database. Times
+    without an offset are taken to be in UTC already, as they are in an
+    export
+    """
+
+    return parse_datetime(value, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+# the parsers the API uses for each column that has a normal form, so
+# imported rows are stored the same way as rows written through the API:
+# (table, column): parser. Values are parsed as strings, as NDJSON and
+# Parquet give numbers and booleans
+PARSERS = {("sports", "active"): flag,
+           ("events", "active"): flag,
+           ("events", "type"): choice("Preplay", "Inplay"),
+           ("events", "status"): choice(*lifecycle.STATUSES),
+           ("events", "scheduled_start"): timestamp,
+           ("events", "actual_start"): timestamp,
+           ("selections", "active"): flag,
+           ("selections", "outcome"): choice("Win", "Lose", "Void",
+                                             "Unsettled"),
+           ("selections", "price"): cents}
+
+def columnar_format():
+
+    """
+    Gets the compact columnar format to use, i.e. parquet when pyarrow is
+    installed, or csv otherwise
+    """
+
+    return "parquet" if HAVE_PYARROW else "csv"
+
+def load_pyarrow():
+
+    """
+    Imports pyarrow the first time Parquet is read or written
+    """
+
+    global pa, pq # pylint: disable=global-statement
+    if pq is None:
+        # pylint: disable=import-outside-toplevel
+        import pyarrow
+        import pyarrow.parquet
+        pa = pyarrow
+        pq = pyarrow.parquet
+
+def source(conn, table):
+
+    """
+    Gets the view to export a table through, or the table itself when it
+    has no view
+    """
+
+    view = VIEWS.get(table)
+    if view and conn.execute("""SELECT 1 FROM sqlite_master
+                                WHERE type = 'view' AND name = ?""",
+                             (view,)).fetchone():
+        return view
+    return table
+
+def table_columns(conn, table):
+
+    """
+    Gets the names and declared types of the columns exported for a table
+    """
+
+    columns = conn.execute(f"PRAGMA table_info({source(conn, table)})")
+    # a view column that converts a scaled column has no declared type
+    return [(row[1], "REAL" if (table, row[1]) in SCALED_COLUMNS
+             else row[2].upper()) for row in columns]
+
+def iter_batches(conns, table):
+
+    """
+    Yields the rows of a table from each of the given connections (one per
+    shard) in batches of tuples, without loading the whole table
+    """
+
+    for conn in conns:
+        cur = conn.execute(f"SELECT * FROM {source(conn, table)}")
+        while True:
+            batch = cur.fetchmany(BATCH_SIZE)
+            if not batch:
+                break
+            yield [tuple(row) for row in batch]
+
+def export_csv(conns, table):
+
+    """
+    Yields a table as chunks of CSV text, starting with a header row of
+    its column names. NULLs are written as empty fields
+    """
+
+    names = [name for name, _ in table_columns(conns[0], table)]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for batch in iter_batches(conns, table):
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def export_ndjson(conns):
+
+    """
+    Yields every table as chunks of NDJSON text, one
+    {"table": ..., "row": {...}} object per line, in load order
+    """
+
+    for table in TABLES:
+        names = [name for name, _ in table_columns(conns[0], table)]
+        for batch in iter_batches(conns, table):
+            yield "".join(json.dumps({"table": table,
+                                      "row": dict(zip(names, row))}) + "\n"
+                          for row in batch)
+
+def arrow_schema(columns):
+
+    """
+    Gets the Arrow schema for a table from its declared column types
+    """
+
+    load_pyarrow()
+    types = {"REAL": pa.float64(), "INTEGER": pa.int64()}
+    return pa.schema([(name, types.get(declared, pa.string()))
+                      for name, declared in columns])
+
+def to_arrow(value, arrow_type):
+
+    """
+    Converts a stored value to the type of its Arrow column. SQLite doesn't
+    enforce column types, so e.g. a BOOLEAN column may hold 1 or 'false'
+    """
+
+    if value is None:
+        return None
+    if arrow_type == pa.string():
+        return str(value)
+    if arrow_type == pa.float64():
+        return float(value)
+    return int(value)
+
+def export_parquet(conns, table, target):
+
+    """
+    Writes a table to a Parquet file (a path or a binary file object),
+    one row group per batch
+    """
+
+    load_pyarrow()
+    columns = table_columns(conns[0], table)
+    schema = arrow_schema(columns)
+    with pq.ParquetWriter(target, schema) as writer:
+        for batch in iter_batches(conns, table):
+            arrays = [pa.array([to_arrow(row[i], field.type) for row in batch],
+                               type=field.type)
+                      for i, field in enumerate(schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+def read_csv(stream):
+
+    """
+    Yields the rows of a CSV file object as dicts, reading empty fields
+    as NULL
+    """
+
+    for row in csv.DictReader(stream):
+        yield {name: value if value != "" else None
+               for name, value in row.items()}
+
+def read_ndjson(stream):
+
+    """
+    Yields (table, row) pairs from an NDJSON file object, raising
+    ValueError for a line that isn't a {"table": ..., "row": {...}} object
+    """
+
+    for number, line in enumerate(stream, 1):
+        if line.strip():
+            record = json.loads(line)
+            if not isinstance(record, dict) or "table" not in record or \
+                    not isinstance(record.get("row"), dict):
+                raise ValueError(f"line {number} must be an object with a "
+                                 "table and a row object")
+            yield record["table"], record["row"]
+
+def read_parquet(source):
+
+    """
+    Yields the rows of a Parquet file (a path or a binary file object)
+    as dicts, a batch at a time
+    """
+
+    load_pyarrow()
+    for batch in pq.ParquetFile(source).iter_batches(batch_size=BATCH_SIZE):
+        yield from batch.to_pylist()
+
+class CatalogueImporter:
+
+    """
+    Loads rows into one or more databases (one per shard) in a single
+    transaction each, inserting BATCH_SIZE rows at a time with executemany.
+    Indexes are dropped before loading and rebuilt once at the end, which
+    is much faster than updating them for every row, and foreign keys are
+    checked when the transaction commits. Selections give their event by
+    name, which is looked up as they are inserted, so an event must come
+    before its selections (as it does in an export). Values are converted
+    with the same parsers as the API, and a value that isn't valid fails
+    the import.
+
+    connect(shard) opens a connection to a shard, and route(table, row)
+    gets the shard a row belongs in
+    """
+
+    def __init__(self, connect, shards, route):
+        self.route = route
+        self.conns = {shard: connect(shard) for shard in shards}
+        self.indexes = {}
+        self.pending = {}
+        self.counts = dict.fromkeys(TABLES, 0)
+        first = next(iter(self.conns.values()))
+        self.columns = {table: {name for name, _ in table_columns(first, table)}
+                        for table in TABLES}
+
+        for shard, conn in self.conns.items():
+            conn.execute("BEGIN")
+            conn.execute("PRAGMA defer_foreign_keys = ON")
+            # only indexes created with CREATE INDEX have sql, the ones
+            # backing primary keys can't be dropped
+            indexes = conn.execute("""SELECT name, sql FROM sqlite_master
+                                      WHERE type = 'index'
+                                      AND sql IS NOT NULL""").fetchall()
+            self.indexes[shard] = [sql for _, sql in indexes]
+            for name, _ in indexes:
+                conn.execute(f"DROP INDEX {name}")
+
+    def add(self, table, row):
+
+        """
+        Queues a row to be inserted into a table, inserting the queued rows
+        once there is a full batch
+        """
+
+        if not isinstance(table, str) or table not in TABLES:
+            raise ValueError(f"unknown table: {table}")
+        if not isinstance(row, dict):
+            raise ValueError(f"rows must be objects, not {row!r}")
+        # column names end up in the INSERT, so only known ones are allowed
+        unknown = set(row) - self.columns[table]
+        if unknown:
+            raise ValueError(f"unknown columns for {table}: "
+                             f"{', '.join(sorted(unknown))}")
+        key = (self.route(table, row), table, tuple(row))
+        batch = self.pending.setdefault(key, [])
+        batch.append(tuple(self.parse(table, name, value)
+                           for name, value in row.items()))
+        self.counts[table] += 1
+        if len(batch) >= BATCH_SIZE:
+            self._flush(key)
+
+    @staticmethod
+    def parse(table, name, value):
+
+        """
+        Converts a value to the form it is stored in, raising ValueError if
+        it isn't valid for its column. NULLs are kept as they are
+        """
+
+        parser = PARSERS.get((table, name))
+        if parser is None or value is None:
+            return value
+        try:
+            return parser(str(value))
+        except ValueError as e:
+            raise ValueError(f"invalid {name} for {table}: {value!r} "
+                             f"({e})") from None
+
+    def _flush(self, key):
+        shard, table, names = key
+        # rows queued for earlier tables go in first, so the events that
+        # selections refer to by name can be found
+        for other in list(self.pending):
+            if other in self.pending and other[0] == shard and \
+                    TABLES.index(other[1]) < TABLES.index(table):
+                self._flush(other)
+
+        columns = []
+        values = []
+        for name in names:
+            if (table, name) in NAME_REFERENCES:
+                column, referenced = NAME_REFERENCES[(table, name)]
+                columns.append(column)
+                values.append(f"(SELECT id FROM {referenced} WHERE name = ?)")
+            else:
+                # scaled columns are already converted by their parser
+                columns.append(SCALED_COLUMNS.get((table, name), name))
+                values.append("?")
+        rows = self.pending.pop(key)
+        self.conns[shard].executemany(
+            f"""INSERT INTO {table} ({", ".join(columns)})
+                VALUES ({", ".join(values)})""", rows)
+
+    def finish(self):
+
+        """
+        Inserts any remaining rows, rebuilds the indexes and commits.
+        Returns the number of rows imported into each table
+        """
+
+        for key in sorted(self.pending, key=lambda key: TABLES.index(key[1])):
+            if key in self.pending:
+                self._flush(key)
+        for shard, conn in self.conns.items():
+            for sql in self.indexes[shard]:
+                conn.execute(sql)
+            conn.commit()
+        for conn in self.conns.values():
+            conn.close()
+        return self.counts
+
+    def abort(self):
+
+        """
+        Rolls back everything imported so far
+        """
+
+        for conn in self.conns.values():
+            conn.rollback()
+            conn.close()
+
+def import_records(importer, records):
+
+    """
+    Imports (table, row) pairs with the given importer, rolling everything
+    back if any row fails. Returns the number of rows imported per table
+    """
+
+    try:
+        for table, row in records:
+            importer.add(table, row)
+        return importer.finish()
+    except Exception:
+        importer.abort()
+        raise
+
+def table_records(table, rows):
+
+    """
+    Pairs each row of a single table's file with its table name
+    """
+
+    for row in rows:
+        yield table, row
+
+def main(argv=None):
+
+    """
+    Runs the import and export commands against the app's database(s)
+    """
+
+    # imported here, as the app imports this module for its own endpoints
+    import app # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("format", choices=FORMATS)
+    parser.add_argument("path", help="NDJSON file, or directory for CSV "
+                                     "and Parquet (one file per table)")
+    args = parser.parse_args(argv)
+
+    file_format = args.format
+    if file_format == "parquet" and not HAVE_PYARROW:
+        print("pyarrow is not installed, using csv instead", file=sys.stderr)
+        file_format = "csv"
+
+    if args.command == "export":
+        conns = [app.get_db_connection(shard) for shard in app.all_shards()]
+        if file_format == "ndjson":
+            with open(args.path, "w", encoding="utf-8") as f:
+                f.writelines(export_ndjson(conns))
+        else:
+            os.makedirs(args.path, exist_ok=True)
+            for table in TABLES:
+                path = os.path.join(args.path, f"{table}.{file_format}")
+                if file_format == "parquet":
+                    export_parquet(conns, table, path)
+                else:
+                    with open(path, "w", encoding="utf-8", newline="") as f:
+                        f.writelines(export_csv(conns, table))
+        for conn in conns:
+            conn.close()
+        return
+
+    app.init_db()
+    importer = app.catalogue_importer()
+    if file_format == "ndjson":
+        with open(args.path, encoding="utf-8") as f:
+            counts = import_records(importer, read_ndjson(f))
+    else:
+        def records():
+            for table in TABLES:
+                path = os.path.join(args.path, f"{table}.{file_format}")
+                if not os.path.exists(path):
+                    continue
+                if file_format == "parquet":
+                    yield from table_records(table, read_parquet(path))
+                else:
+                    with open(path, encoding="utf-8", newline="") as f:
+                        yield from table_records(table, read_csv(f))
+        counts = import_records(importer, records())
+    print(", ".join(f"{count} {table}" for table, count in counts.items()))
+
+if __name__ == "__main__":
+    main()
@@ -12,37 +12,52 @@
     nodes. In the worst case (a vertical line tree), all but one of the nodes
     could be parents, i.e. n - 1, which is O(n)
 """
-def find_internal_nodes_num(tree):
+
+import os
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# the counting functions live in tree_analytics, so they can be imported
+# (this file's name isn't a valid module name)
+from tree_analytics import (find_internal_nodes_num,
+                            find_internal_nodes_num_numpy,
+                            find_internal_nodes_num_parallel,
+                            find_internal_nodes_num_python,
+                            find_internal_nodes_num_stream, random_tree)
+
+def benchmark(sizes=(10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7)):
 
     """
-    Finds the total number of internal nodes in the given tree
-    i.e. those with at least one child
+    Compares the time taken by the pure Python and NumPy versions on
+    random trees of increasing size, timing the NumPy version on both a
+    list (including the conversion to an array) and an array
+    """
 
-    Time complexity: O(n) - iterates through tree once, adding all parent nodes
-    to set (i.e. any value in the list that is also an index in the range of
-    the list's length, excluding dummy values like -1 to indicate no parent).
-    In any case, all n nodes in the tree will need to be checked, which is O(n)
-    
-    Space complexity: O(n) - creates a set of parent nodes, which is used to
-    calculate the number of internal nodes, as all parent nodes are internal
-    nodes. In the worst case (a vertical line tree), all but one of the nodes
-    could be parents, i.e. n - 1, which is O(n)
-"""
+    print(f"{'nodes':>10} {'python':>10} {'numpy list':>11} "
+          f"{'numpy array':>12} {'speedup':>8}")
+    for n in sizes:
+        parents = random_tree(n)
+        tree = parents.tolist()
+
+        start = time.perf_counter()
+        expected = find_internal_nodes_num_python(tree)
+        python_time = time.perf_counter() - start
 
-    internal_nodes = set() #set to ensure no double-counting of nodes
+        start = time.perf_counter()
+        assert find_internal_nodes_num_numpy(tree) == expected
+        list_time = time.perf_counter() - start
 
-    # for each node i in the tree, its parent is tree[i], all parent nodes
-    # are automatically internal nodes as they have at least one child
-    for i in range(len(tree)):
-        # check if parent is in the range of indexes of the tree
-        # i.e. exclude -1 or other dummy values to show root has no parent
-        # and exclude nodes that are already counted as internal nodes
-        if tree[i] in range(len(tree)):
-            internal_nodes.add(tree[i])
+        start = time.perf_counter()
+        assert find_internal_nodes_num_numpy(parents) == expected
+        array_time = time.perf_counter() - start
 
-    # return the amount of internal nodes in the set, i.e. the number of
-    # distinct values in the list, excluding the dummy value -1
-    return len(internal_nodes)
+        print(f"{n:>10} {python_time:>9.4f}s {list_time:>10.4f}s "
+              f"{array_time:>11.4f}s {python_time / array_time:>7.1f}x")
 
 # sample tree provided in question
 my_tree = [4, 4, 1, 5, -1, 4, 5]
@@ -63,9 +78,79 @@ big_tree = [-1, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 2, 2, 2, 2,
             4, 5, 5, 5, 5, 5, 5, 5, 6, 6, 6, 6, 6, 6, 6, 6, 6, 12, 9, 8,
             7, 11, 10, 7, 12, 8, 5, 1, 3, 4, 5, 2]
 
-# testing that the method calculates the number of internal nodes correctly
-assert find_internal_nodes_num(my_tree) == 3
-assert find_internal_nodes_num(empty_tree) == 0
-assert find_internal_nodes_num(root_only) == 0
-assert find_internal_nodes_num(straight_line_tree) == 6
-assert find_internal_nodes_num(big_tree) == 13
+def benchmark_parallel(n=10 ** 8, chunk_counts=(1, 2, 4, 8, 16, 32)):
+
+    """
+    Measures how the parallel version scales with the number of chunks on
+    a random tree of n nodes stored in a memory-mapped int32 file, using
+    up to one worker per CPU
+    """
+
+    parents = random_tree(n).astype(np.int32)
+    expected = find_internal_nodes_num_numpy(parents)
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "benchmark_tree.bin")
+    parents.tofile(path)
+    del parents
+
+    cpus = os.cpu_count() or 1
+    print(f"{n} nodes, {cpus} CPUs")
+    print(f"{'chunks':>6} {'workers':>7} {'time':>9} {'speedup':>8}")
+    try:
+        baseline = None
+        for chunks in chunk_counts:
+            workers = min(chunks, cpus)
+            start = time.perf_counter()
+            assert find_internal_nodes_num_parallel(
+                path, workers=workers, chunks=chunks) == expected
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f"{chunks:>6} {workers:>7} {elapsed:>8.3f}s "
+                  f"{baseline / elapsed:>7.2f}x")
+    finally:
+        os.remove(path)
+
+if __name__ == "__main__":
+    # testing that the method calculates the number of internal nodes
+    # correctly
+    assert find_internal_nodes_num(my_tree) == 3
+    assert find_internal_nodes_num(empty_tree) == 0
+    assert find_internal_nodes_num(root_only) == 0
+    assert find_internal_nodes_num(straight_line_tree) == 6
+    assert find_internal_nodes_num(big_tree) == 13
+
+    # the NumPy version must give the same results, for lists and arrays
+    if np is not None:
+        for sample_tree in [my_tree, empty_tree, root_only,
+                            straight_line_tree, big_tree]:
+            assert find_internal_nodes_num_numpy(sample_tree) == \
+                find_internal_nodes_num_python(sample_tree)
+            assert find_internal_nodes_num_numpy(np.array(sample_tree)) == \
+                find_internal_nodes_num_python(sample_tree)
+
+    # so must the streaming version, even when the chunks are tiny
+    for sample_tree in [my_tree, empty_tree, root_only, straight_line_tree,
+                        big_tree]:
+        assert find_internal_nodes_num_stream(sample_tree, chunk_size=3) == \
+            find_internal_nodes_num_python(sample_tree)
+        assert find_internal_nodes_num_stream(
+            iter(sample_tree), len(sample_tree), chunk_size=3) == \
+            find_internal_nodes_num_python(sample_tree)
+
+    # the parallel version must give the same results, for files and arrays
+    if np is not None:
+        for sample_tree in [my_tree, empty_tree, root_only,
+                            straight_line_tree, big_tree]:
+            assert find_internal_nodes_num_parallel(
+                sample_tree, workers=2, chunks=3) == \
+                find_internal_nodes_num_python(sample_tree)
+
+    # run with --benchmark to compare the speed of each version, or with
+    # --benchmark-parallel to see how the parallel version scales
+    if "--benchmark" in sys.argv or "--benchmark-parallel" in sys.argv:
+        if np is None:
+            print("NumPy is not installed, so there is nothing to compare")
+        elif "--benchmark" in sys.argv:
+            benchmark()
+        else:
+            benchmark_parallel()
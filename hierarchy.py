@@ -0,0 +1,124 @@
+"""
+The catalogue as a tree: every sport, event and selection is a node, with
+events under their sport and selections under their event. The tree is
+kept as a compact integer parent array (the format used by
+tree_analytics), so stats about the whole catalogue are worked out in one
+linear pass over it, rather than with an aggregate query per question
+"""
+
+import numpy as np
+from tree_analytics import ParentArrayTree
+
+# in tree order, each kind of node is a child of the one before
+KINDS = ["sports", "events", "selections"]
+
+def is_active(value):
+
+    """
+    Reads a stored active flag, which may be a number or, for rows created
+    before it was converted, the text true or false
+    """
+
+    if isinstance(value, str):
+        return value.lower() in ["true", "1"]
+    return bool(value)
+
+def count_summary(counts):
+
+    """
+    Gets the smallest, largest and mean of a list of counts
+    """
+
+    if len(counts) == 0:
+        return {"min": 0, "max": 0, "mean": 0.0}
+    return {"min": int(counts.min()), "max": int(counts.max()),
+            "mean": float(counts.mean())}
+
+class Hierarchy:
+
+    """
+    Builds the parent array from the rows of each table, given as
+    (name, parent name, active) tuples, where the parent of a sport is
+    ignored. Node ids are given out in table order, so sports come first,
+    then events, then selections, and ranges gives the ids of each kind
+    as [start, end). names maps ids to names and ids maps names back, per
+    kind, as names are only unique within a table. A row whose parent
+    can't be found becomes a root
+    """
+
+    def __init__(self, sports, events, selections):
+        self.names = []
+        self.ranges = {}
+        self.ids = {}
+        parents = []
+        active = []
+        parent_ids = {}
+        for kind, rows in zip(KINDS, [sports, events, selections]):
+            start = len(self.names)
+            ids = {}
+            for name, parent, row_active in rows:
+                ids[name] = len(self.names)
+                self.names.append(name)
+                parents.append(parent_ids.get(parent, -1))
+                active.append(is_active(row_active))
+            self.ranges[kind] = (start, len(self.names))
+            self.ids[kind] = ids
+            parent_ids = ids
+
+        self.parents = np.array(parents, dtype=np.int32)
+        self.active = np.array(active, dtype=bool)
+        self.tree = ParentArrayTree(self.parents)
+
+    def stats(self):
+
+        """
+        Gets stats about the hierarchy:
+        nodes: the number of sports, events and selections
+        internal_nodes: sports with events plus events with selections
+        active_internal_nodes: the active sports and events with at least
+                               one active child
+        leaves: nodes with no children
+        leaves_per_event: the min, max and mean selections per event
+        events_per_sport: the min, max and mean events per sport
+        empty_events, empty_sports: the names of events with no selections
+                                    and sports with no events
+        """
+
+        tree = self.tree
+        child_counts = tree.child_counts
+        # the same bincount of parents as the child counts, restricted to
+        # active children
+        active_children = np.bincount(
+            tree.parents[self.active & (tree.parents >= 0)],
+            minlength=len(tree))
+
+        sports = slice(*self.ranges["sports"])
+        events = slice(*self.ranges["events"])
+
+        def empty(kind):
+            start, end = self.ranges[kind]
+            return [self.names[start + i]
+                    for i in np.flatnonzero(child_counts[start:end] == 0)]
+
+        return {
+            "nodes": {kind: end - start
+                      for kind, (start, end) in self.ranges.items()},
+            "internal_nodes": tree.internal_count,
+            "active_internal_nodes": int(np.count_nonzero(
+                self.active & (active_children > 0))),
+            "leaves": len(tree.leaves),
+            "leaves_per_event": count_summary(child_counts[events]),
+            "events_per_sport": count_summary(child_counts[sports]),
+            "empty_events": empty("events"),
+            "empty_sports": empty("sports"),
+        }
+
+    def to_dict(self):
+
+        """
+        Gets the parent array and the id ranges of each kind of node, along
+        with every node's name, for a JSON response
+        """
+
+        return {"parents": self.parents.tolist(), "names": self.names,
+                "ranges": self.ranges}
@@ -0,0 +1,127 @@
+"""
+The lifecycle of an event, Pending -> Started -> Ended, with Cancelled
+reachable from Pending or Started. Works out every column that changes as
+a result of a status change in memory, so each change can be written with
+a single UPDATE on the event plus one targeted update on its sport
+"""
+
+import json
+
+STATUSES = ["Pending", "Started", "Ended", "Cancelled"]
+
+# the statuses each status can move on to
+EVENT_TRANSITIONS = {
+    "Pending": {"Started", "Cancelled"},
+    "Started": {"Ended", "Cancelled"},
+    "Ended": set(),
+    "Cancelled": set(),
+}
+
+# deactivates a sport if it no longer has any active events
+DEACTIVATE_SPORTS = """UPDATE sports SET active = 0
+                        WHERE name IN (SELECT value FROM json_each(?))
+                        AND NOT EXISTS (SELECT 1 FROM events
+                                        WHERE events.sport = sports.name
+                                        AND events.active)"""
+
+class InvalidTransition(ValueError):
+
+    """
+    Raised when an event is asked to move to a status it can't reach from
+    its current status, e.g. Ended -> Started
+    """
+
+def normalize_status(status):
+
+    """
+    Gets the stored form of a status given in any case, e.g. "started"
+    becomes "Started". Raises ValueError for an unknown status
+    """
+
+    normalized = status.capitalize()
+    if normalized not in STATUSES:
+        raise ValueError(f"invalid status: {status}")
+    return normalized
+
+def status_changes(new_status, now):
+
+    """
+    Gets the columns to set on an event that moves to the given status:
+    starting an event sets its actual start to now and its type to Inplay,
+    as play has begun, and ending or cancelling it makes it inactive, as
+    it is no longer taking place
+    """
+
+    changes = {"status": new_status}
+    if new_status == "Started":
+        changes["actual_start"] = now
+        changes["type"] = "Inplay"
+    elif new_status in ["Ended", "Cancelled"]:
+        changes["active"] = 0
+    return changes
+
+def transition(current_status, new_status, now):
+
+    """
+    Checks that an event can move from its current status to the new one
+    and gets the columns to set as a result. Setting the status it already
+    has is allowed, and changes nothing. Raises InvalidTransition if the
+    move isn't allowed
+    """
+
+    current_status = normalize_status(current_status)
+    new_status = normalize_status(new_status)
+    if new_status == current_status:
+        return {}
+    if new_status not in EVENT_TRANSITIONS[current_status]:
+        raise InvalidTransition(
+            f"can't change status from {current_status} to {new_status}")
+    return status_changes(new_status, now)
+
+def deactivate_sports(cur, sports):
+
+    """
+    Sets each of the given sports to inactive if it has no active events
+    left, in a single statement
+    """
+
+    if sports:
+        cur.execute(DEACTIVATE_SPORTS, (json_list(sports),))
+
+def transition_events(cur, new_status, now, condition="1", params=()):
+
+    """
+    Moves every event matching the given SQL condition that is allowed to
+    make the transition to the new status, with one UPDATE for all of the
+    events plus, if they became inactive, one update for their sports.
+    Events that can't make the transition are left alone.
+
+    Returns the names of the events that were changed
+    """
+
+    new_status = normalize_status(new_status)
+    from_statuses = [status for status in STATUSES
+                     if new_status in EVENT_TRANSITIONS[status]]
+    changes = status_changes(new_status, now)
+
+    assignments = ", ".join(f"{column} = ?" for column in changes)
+    cur.execute(f"""UPDATE events SET {assignments}
+                    WHERE status IN (SELECT value FROM json_each(?))
+                    AND ({condition})
+                    RETURNING name, sport""",
+                [*changes.values(), json_list(from_statuses), *params])
+    changed = cur.fetchall()
+
+    if "active" in changes:
+        deactivate_sports(cur, sorted({sport for _, sport in changed}))
+    return [name for name, _ in changed]
+
+def json_list(values):
+
+    """
+    Encodes a list of strings as JSON, so it can be bound as a single
+    parameter and expanded with json_each(), rather than building a
+    placeholder for every value
+    """
+
+    return json.dumps(list(values))
@@ -0,0 +1,248 @@
+"""
+Declarative parsing of query parameters. Each route describes the
+parameters it accepts as a Schema of typed fields, built once when the app
+is imported, and each request's parameters are checked and converted in a
+single pass. Unknown or invalid parameters are rejected with a 400 error
+before the route opens a database connection
+"""
+
+import functools
+import math
+import re
+from datetime import datetime, timedelta, timezone
+from decimal import ROUND_HALF_UP, Decimal
+from flask import jsonify, request
+
+# the usual form of timestamps given to the API, e.g. 2030-06-17 18:00:00,
+# optionally with a T separator, fractional seconds and a UTC offset
+# (e.g. +02:00, +0200 or Z), which can be parsed without dateutil
+ISO_TIMESTAMP = re.compile(r"(\d{4})-(\d\d)-(\d\d)[ T](\d\d):(\d\d)"
+                           r"(?::(\d\d)(?:\.(\d{1,6})\d*)?)?"
+                           r"\s*(?:(Z)|([+-])(\d\d):?(\d\d))?$")
+
+FLAGS = {"true": True, "1": True, "false": False, "0": False}
+
+class InvalidParameter(ValueError):
+
+    """
+    Raised when a request has a parameter that is unknown or can't be
+    parsed, or is missing a required one
+    """
+
+def text(value):
+
+    """
+    Accepts any string as it is
+    """
+
+    return value
+
+def flag(value):
+
+    """
+    Parses an active flag, given as true, false, 1 or 0 in any case
+    """
+
+    try:
+        return FLAGS[value.lower()]
+    except KeyError:
+        raise ValueError("must be either true or false") from None
+
+def integer(value):
+
+    """
+    Parses a whole number
+    """
+
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError("must be a whole number") from None
+
+def number(value):
+
+    """
+    Parses a finite number
+    """
+
+    try:
+        parsed = float(value)
+    except ValueError:
+        raise ValueError("must be a number") from None
+    if not math.isfinite(parsed):
+        raise ValueError("must be a number")
+    return parsed
+
+def number_between(minimum, maximum):
+
+    """
+    Gets a parser that accepts a finite number from minimum to maximum
+    """
+
+    message = f"must be a number from {minimum:g} to {maximum:g}"
+
+    def parse_number(value):
+        parsed = number(value)
+        if not minimum <= parsed <= maximum:
+            raise ValueError(message)
+        return parsed
+    return parse_number
+
+def cents(value):
+
+    """
+    Parses a price to a whole number of cents, rounding half a cent up.
+    The string is read as a Decimal, so e.g. 2.675 is exactly 268 cents
+    rather than whatever its nearest float rounds to
+    """
+
+    number(value)
+    return int((Decimal(value) * 100).quantize(Decimal(1), ROUND_HALF_UP))
+
+def choice(*options):
+
+    """
+    Gets a parser that accepts one of the given options in any case, and
+    returns it as written in options
+    """
+
+    lookup = {option.lower(): option for option in options}
+    message = f"must be one of {', '.join(options)}"
+
+    def parse_choice(value):
+        try:
+            return lookup[value.lower()]
+        except KeyError:
+            raise ValueError(message) from None
+    return parse_choice
+
+def field_list(*options):
+
+    """
+    Gets a parser that accepts a comma separated list of some of the given
+    options (e.g. the fields a search returns), and returns them in the
+    order given without repeats. Hyphens may be used for underscores
+    """
+
+    allowed = set(options)
+    message = f"must be some of {', '.join(options)}"
+
+    def parse_fields(value):
+        fields = [field.strip().replace("-", "_") for field in value.split(",")]
+        if not all(field in allowed for field in fields):
+            raise ValueError(message)
+        return list(dict.fromkeys(fields))
+    return parse_fields
+
+def parse_datetime(value, naive_tz=None):
+
+    """
+    Parses a date and time (which may include an offset for its timezone)
+    to an aware datetime in UTC. Times without an offset are taken to be
+    in naive_tz, or the server's local time if it isn't given. ISO 8601
+    timestamps are parsed directly, and anything else falls back to
+    dateutil, which accepts many more forms but is much slower
+    """
+
+    match = ISO_TIMESTAMP.match(value)
+    if match is None:
+        # only imported when needed, as most timestamps never get here
+        from dateutil.parser import parse # pylint: disable=import-outside-toplevel
+        try:
+            parsed = parse(value)
+        except (ValueError, OverflowError):
+            raise ValueError("must be a date and time") from None
+        if parsed.tzinfo is None and naive_tz is not None:
+            parsed = parsed.replace(tzinfo=naive_tz)
+        return parsed.astimezone(timezone.utc)
+
+    (year, month, day, hour, minute, second, fraction, utc, sign, hours,
+     minutes) = match.groups()
+    try:
+        parsed = datetime(int(year), int(month), int(day), int(hour),
+                          int(minute), int(second or 0),
+                          int((fraction or "0").ljust(6, "0")))
+    except ValueError:
+        raise ValueError("must be a date and time") from None
+    if utc:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    elif sign:
+        offset = timedelta(hours=int(hours), minutes=int(minutes))
+        parsed = parsed.replace(
+            tzinfo=timezone(offset if sign == "+" else -offset))
+    elif naive_tz is not None:
+        parsed = parsed.replace(tzinfo=naive_tz)
+    return parsed.astimezone(timezone.utc)
+
+class Field:
+
+    """
+    A query parameter, parsed with the given function, which gets the
+    string from the request and returns its typed value, raising ValueError
+    with a message if the string isn't valid
+    """
+
+    def __init__(self, parser=text, required=False):
+        self.parser = parser
+        self.required = required
+
+class Schema:
+
+    """
+    The query parameters a route accepts, given as a dict of parameter
+    names (as they appear in the URL, e.g. scheduled-start) to Fields
+    """
+
+    def __init__(self, fields):
+        self.fields = dict(fields)
+        self.required = [name for name, field in self.fields.items()
+                         if field.required]
+
+    def __contains__(self, name):
+        return name in self.fields
+
+    def parse(self, args):
+
+        """
+        Checks and converts every parameter in args (a dict of strings,
+        such as request.args) and returns a dict of their typed values, in
+        the order they were given. Raises InvalidParameter, describing every
+        problem found, if any parameter is unknown, invalid or missing
+        """
+
+        values = {}
+        problems = []
+        for name, value in args.items():
+            field = self.fields.get(name)
+            if field is None:
+                problems.append(f"unknown parameter: {name}")
+                continue
+            try:
+                values[name] = field.parser(value)
+            except ValueError as e:
+                problems.append(f"{name} {e}")
+        for name in self.required:
+            if not args.get(name):
+                problems.append(f"{name} is required")
+        if problems:
+            raise InvalidParameter("; ".join(problems))
+        return values
+
+def accepts(schema):
+
+    """
+    Decorates a route so that its query parameters are parsed with the
+    given schema and passed to it as a dict in the args argument, or a
+    400 error is returned if they are invalid
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                parsed = schema.parse(request.args)
+            except InvalidParameter as e:
+                return jsonify({'error': str(e)}), 400
+            return view(*args, args=parsed, **kwargs)
+        return wrapper
+    return decorator
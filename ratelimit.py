@@ -0,0 +1,213 @@
+"""
+Rate limiting and admission control, so that one busy client can't take
+all of the workers. Each client gets a token bucket for each route, so a
+poller hammering one search doesn't slow its own (or anyone else's) price
+updates, and the most expensive queries (searches with no filters, which
+read a whole table) share a small concurrency budget, waiting briefly for
+a slot before they are turned away. Both keep counters of what they
+allowed and refused
+"""
+
+import math
+import threading
+import time
+
+class Overloaded(Exception):
+
+    """
+    Raised when a request is refused, with the HTTP status to refuse it
+    with and the number of seconds the client should wait before trying
+    again
+    """
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+class TokenBucket:
+
+    """
+    Allows rate requests a second on average, with bursts of up to burst
+    requests at once. Starts full
+    """
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+
+        """
+        Adds the tokens earned since the last update, up to burst
+        """
+
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+
+        """
+        Takes a token if there is one, and returns 0, otherwise returns the
+        number of seconds until there will be one
+        """
+
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class RateLimiter:
+
+    """
+    A token bucket for each key (e.g. a client and route). Once there are
+    more than max_keys buckets, the ones that have filled up again are
+    dropped, as a full bucket is the same as a new one
+    """
+
+    def __init__(self, rate, burst, max_keys=10000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self.allowed = 0
+        self.limited = 0
+
+    def check(self, key):
+
+        """
+        Takes a token from the key's bucket, raising Overloaded if it is
+        empty
+        """
+
+        with self._lock:
+            now = self.clock()
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._forget_full(now)
+                bucket = self._buckets[key] = TokenBucket(self.rate,
+                                                          self.burst, now)
+            wait = bucket.take(now)
+            if wait:
+                self.limited += 1
+            else:
+                self.allowed += 1
+        if wait:
+            raise Overloaded("too many requests", 429, wait)
+
+    def _forget_full(self, now):
+        for key, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self._buckets[key]
+
+    def stats(self):
+
+        """
+        Gets the counters for the limiter
+        """
+
+        with self._lock:
+            return {"allowed": self.allowed, "limited": self.limited,
+                    "keys": len(self._buckets)}
+
+class AdmissionControl:
+
+    """
+    Lets at most limit callers run at once. Up to queue more wait for a
+    slot, for at most timeout seconds each, and any others are turned away
+    straight away
+    """
+
+    def __init__(self, limit, queue, timeout):
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self._slots = threading.Semaphore(limit)
+        self._lock = threading.Lock()
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+    def acquire(self):
+
+        """
+        Takes a slot once there is one free, or raises Overloaded if the
+        queue is full or no slot frees up in time. Every slot taken must be
+        given back with release()
+        """
+
+        with self._lock:
+            # take a free slot without queueing, if there is one
+            admitted = self._slots.acquire(blocking=False)
+            if not admitted:
+                if self.waiting >= self.queue:
+                    self.rejected += 1
+                    raise Overloaded("too many full searches running", 503,
+                                     self.timeout)
+                self.waiting += 1
+                self.queued += 1
+        if not admitted:
+            admitted = self._slots.acquire(timeout=self.timeout)
+            with self._lock:
+                self.waiting -= 1
+                if not admitted:
+                    self.rejected += 1
+            if not admitted:
+                raise Overloaded("too many full searches running", 503,
+                                 self.timeout)
+
+        with self._lock:
+            self.running += 1
+            self.admitted += 1
+
+    def release(self):
+
+        """
+        Gives back a slot taken with acquire()
+        """
+
+        with self._lock:
+            self.running -= 1
+        self._slots.release()
+
+    def run(self, fn):
+
+        """
+        Runs fn() once there is a slot free and returns its result, or
+        raises Overloaded if the queue is full or no slot frees up in time
+        """
+
+        self.acquire()
+        try:
+            return fn()
+        finally:
+            self.release()
+
+    def stats(self):
+
+        """
+        Gets the counters for the admission control
+        """
+
+        with self._lock:
+            return {"limit": self.limit, "running": self.running,
+                    "waiting": self.waiting, "admitted": self.admitted,
+                    "queued": self.queued, "rejected": self.rejected}
+
+def retry_after_header(seconds):
+
+    """
+    Formats a wait for the Retry-After header, as whole seconds rounded up
+    """
+
+    return str(max(1, math.ceil(seconds)))
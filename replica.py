@@ -0,0 +1,124 @@
+"""
+Read replicas for search traffic. A background thread periodically takes a
+consistent snapshot of each database file using SQLite's online backup API
+and publishes it as one or more read-only copies, which searches can read
+from without competing with writes on the primary file
+"""
+
+import itertools
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+def replica_path(path, copy):
+
+    """
+    Gets the file for the given copy of a database's replica,
+    e.g. app.replica0.db for app.db
+    """
+
+    root, ext = os.path.splitext(path)
+    return f"{root}.replica{copy}{ext}"
+
+class SnapshotPublisher:
+
+    """
+    Publishes snapshots of the given database files every interval
+    seconds, to the given number of read-only copies of each. Each copy is
+    written to a temporary file and then renamed over the old one, so readers
+    always see a complete snapshot, and connections that are already open
+    keep reading the snapshot they started with
+    """
+
+    def __init__(self, paths, interval, copies=1):
+        self.paths = list(paths)
+        self.interval = interval
+        self.copies = max(copies, 1)
+        self._published_at = {}
+        self._next_copy = itertools.count()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def publish(self):
+
+        """
+        Takes a snapshot of every database file and publishes it to all of
+        its replicas
+        """
+
+        for path in self.paths:
+            snapshot = replica_path(path, 0) + ".tmp"
+            # the snapshot holds the data as of the start of the copy, so
+            # its age is counted from then, not from when the copy finished
+            taken_at = time.time()
+            source = sqlite3.connect(path)
+            target = sqlite3.connect(snapshot)
+            # the backup API copies a consistent view of the database,
+            # even while other connections are writing to it
+            source.backup(target)
+            target.close()
+            source.close()
+
+            for copy in range(1, self.copies):
+                shutil.copyfile(snapshot, replica_path(path, copy) + ".tmp")
+                os.replace(replica_path(path, copy) + ".tmp",
+                           replica_path(path, copy))
+            os.replace(snapshot, replica_path(path, 0))
+
+            with self._lock:
+                self._published_at[path] = taken_at
+
+    def age(self):
+
+        """
+        Gets the age in seconds of the oldest published snapshot, or None
+        if a snapshot hasn't been published for every database yet
+        """
+
+        with self._lock:
+            if len(self._published_at) < len(self.paths):
+                return None
+            return time.time() - min(self._published_at.values())
+
+    def replica_for(self, path):
+
+        """
+        Gets a replica of the given database file to read from, spreading
+        reads across the copies in turn
+        """
+
+        return replica_path(path, next(self._next_copy) % self.copies)
+
+    def start(self):
+
+        """
+        Publishes the first snapshot, then keeps publishing new ones every
+        interval seconds on a background thread until stopped
+        """
+
+        self.publish()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+
+        """
+        Stops publishing snapshots
+        """
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.publish()
+            except (sqlite3.Error, OSError) as e:
+                # keep serving the last snapshot, it will be used until it
+                # is older than the staleness bound. Copying and renaming
+                # the files can fail too, e.g. when the disk is full
+                print(f"error publishing replica snapshot: {e}")
@@ -0,0 +1,194 @@
+"""
+Rollup tables summarizing the catalogue for dashboards: the number of
+events and active events for each sport, and for each event the number of
+selections and active selections, its lowest, highest and total price and
+how many of its selections have each outcome. They are kept up to date by
+triggers, so every write (including cascades, bulk status changes and
+catalogue imports) updates the rollups of just the rows it touches, in the
+same transaction, and a summary costs one row per sport and per event
+rather than a scan of every selection
+"""
+
+OUTCOMES = ["Win", "Lose", "Void", "Unsettled"]
+
+TABLES = ["""CREATE TABLE IF NOT EXISTS sport_summary (
+                sport TEXT PRIMARY KEY,
+                events INTEGER NOT NULL DEFAULT 0,
+                active_events INTEGER NOT NULL DEFAULT 0
+            );""",
+          f"""CREATE TABLE IF NOT EXISTS event_summary (
+                event_id INTEGER PRIMARY KEY,
+                selections INTEGER NOT NULL DEFAULT 0,
+                active_selections INTEGER NOT NULL DEFAULT 0,
+                priced_selections INTEGER NOT NULL DEFAULT 0,
+                total_price_cents INTEGER NOT NULL DEFAULT 0,
+                min_price_cents INTEGER,
+                max_price_cents INTEGER,
+                {", ".join(f"{outcome.lower()} INTEGER NOT NULL DEFAULT 0"
+                           for outcome in OUTCOMES)}
+            );"""]
+
+# adds an event (given as NEW or OLD, with sign 1 or -1 to take it away)
+# to its sport's counts
+COUNT_EVENT = """INSERT INTO sport_summary (sport, events, active_events)
+                 VALUES ({row}.sport, {sign}, {sign} * ({row}.active IS TRUE))
+                 ON CONFLICT (sport) DO UPDATE
+                 SET events = events + excluded.events,
+                     active_events = active_events + excluded.active_events;"""
+
+# a sport is left out of sport_summary once it has no events
+FORGET_SPORT = """DELETE FROM sport_summary
+                  WHERE sport = OLD.sport AND events = 0;"""
+
+# counts a selection's outcome (adding it with op + or taking it away with -)
+OUTCOME_COUNTS = ", ".join(
+    f"{outcome.lower()} = {outcome.lower()} {{op}} "
+    f"({{row}}.outcome IS '{outcome}')" for outcome in OUTCOMES)
+
+# adds a selection to its event's counts and prices. The lowest and highest
+# prices can only move towards a new price
+ADD_SELECTION = f"""UPDATE event_summary SET
+                    selections = selections + 1,
+                    active_selections = active_selections
+                                        + (NEW.active IS TRUE),
+                    priced_selections = priced_selections
+                                        + (NEW.price_cents IS NOT NULL),
+                    total_price_cents = total_price_cents
+                                        + COALESCE(NEW.price_cents, 0),
+                    min_price_cents = MIN(COALESCE(min_price_cents,
+                                                   NEW.price_cents),
+                                          COALESCE(NEW.price_cents,
+                                                   min_price_cents)),
+                    max_price_cents = MAX(COALESCE(max_price_cents,
+                                                   NEW.price_cents),
+                                          COALESCE(NEW.price_cents,
+                                                   max_price_cents)),
+                    {OUTCOME_COUNTS.format(op="+", row="NEW")}
+                    WHERE event_id = NEW.event_id;"""
+
+# takes a selection away from its event's counts and prices. The selection
+# has already gone, so if it had the lowest or highest price, that is found
+# again from the event's remaining selections
+REMOVE_SELECTION = f"""UPDATE event_summary SET
+                    selections = selections - 1,
+                    active_selections = active_selections
+                                        - (OLD.active IS TRUE),
+                    priced_selections = priced_selections
+                                        - (OLD.price_cents IS NOT NULL),
+                    total_price_cents = total_price_cents
+                                        - COALESCE(OLD.price_cents, 0),
+                    min_price_cents = CASE
+                        WHEN OLD.price_cents = min_price_cents THEN
+                            (SELECT MIN(price_cents) FROM selections
+                             WHERE event_id = OLD.event_id)
+                        ELSE min_price_cents END,
+                    max_price_cents = CASE
+                        WHEN OLD.price_cents = max_price_cents THEN
+                            (SELECT MAX(price_cents) FROM selections
+                             WHERE event_id = OLD.event_id)
+                        ELSE max_price_cents END,
+                    {OUTCOME_COUNTS.format(op="-", row="OLD")}
+                    WHERE event_id = OLD.event_id;"""
+
+TRIGGERS = {
+    "events_summary_insert": f"""AFTER INSERT ON events BEGIN
+        {COUNT_EVENT.format(row="NEW", sign=1)}
+        INSERT INTO event_summary (event_id) VALUES (NEW.id);
+    END""",
+    "events_summary_delete": f"""AFTER DELETE ON events BEGIN
+        {COUNT_EVENT.format(row="OLD", sign=-1)}
+        {FORGET_SPORT}
+        DELETE FROM event_summary WHERE event_id = OLD.id;
+    END""",
+    "events_summary_update": f"""AFTER UPDATE OF sport, active ON events BEGIN
+        {COUNT_EVENT.format(row="OLD", sign=-1)}
+        {COUNT_EVENT.format(row="NEW", sign=1)}
+        {FORGET_SPORT}
+    END""",
+    "selections_summary_insert": f"""AFTER INSERT ON selections BEGIN
+        {ADD_SELECTION}
+    END""",
+    "selections_summary_delete": f"""AFTER DELETE ON selections BEGIN
+        {REMOVE_SELECTION}
+    END""",
+    "selections_summary_update": f"""AFTER UPDATE OF event_id, price_cents,
+                                     active, outcome ON selections BEGIN
+        {REMOVE_SELECTION}
+        {ADD_SELECTION}
+    END""",
+}
+
+# the outcome counts for each event, as columns of event_summary
+OUTCOME_COLUMNS = ", ".join(outcome.lower() for outcome in OUTCOMES)
+
+def create(cursor):
+
+    """
+    Creates the rollup tables and the triggers that maintain them, and
+    fills the tables from scratch if they didn't exist yet (i.e. for a
+    database created before them)
+    """
+
+    existing = cursor.execute("""SELECT 1 FROM sqlite_master
+                                 WHERE type = 'table'
+                                 AND name = 'event_summary'""").fetchone()
+    for sql in TABLES:
+        cursor.execute(sql)
+    for name, body in TRIGGERS.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    if existing is None:
+        rebuild(cursor)
+
+def rebuild(cursor):
+
+    """
+    Recomputes every rollup from the events and selections tables, with
+    one aggregate query for each
+    """
+
+    cursor.execute("DELETE FROM sport_summary")
+    cursor.execute("""INSERT INTO sport_summary (sport, events, active_events)
+                      SELECT sport, COUNT(*), SUM(active IS TRUE)
+                      FROM events GROUP BY sport""")
+    cursor.execute("DELETE FROM event_summary")
+    outcome_counts = ", ".join(
+        f"COALESCE(SUM(selections.outcome IS '{outcome}'), 0)"
+        for outcome in OUTCOMES)
+    cursor.execute(f"""INSERT INTO event_summary
+                      (event_id, selections, active_selections,
+                       priced_selections, total_price_cents, min_price_cents,
+                       max_price_cents, {OUTCOME_COLUMNS})
+                      SELECT events.id, COUNT(selections.id),
+                             COALESCE(SUM(selections.active IS TRUE), 0),
+                             COUNT(selections.price_cents),
+                             COALESCE(SUM(selections.price_cents), 0),
+                             MIN(selections.price_cents),
+                             MAX(selections.price_cents), {outcome_counts}
+                      FROM events LEFT JOIN selections
+                          ON selections.event_id = events.id
+                      GROUP BY events.id""")
+
+def event_summary(row):
+
+    """
+    Builds the summary of an event from a row of event_summary joined with
+    the event's name, sport, status and active status, with prices
+    converted back from cents
+    """
+
+    priced = row['priced_selections']
+    return {
+        "name": row['name'],
+        "sport": row['sport'],
+        "status": row['status'],
+        "active": row['active'],
+        "selections": row['selections'],
+        "active_selections": row['active_selections'],
+        "min_price": None if row['min_price_cents'] is None
+                     else row['min_price_cents'] / 100,
+        "max_price": None if row['max_price_cents'] is None
+                     else row['max_price_cents'] / 100,
+        "avg_price": round(row['total_price_cents'] / priced / 100, 2)
+                     if priced else None,
+        "outcomes": {outcome: row[outcome.lower()] for outcome in OUTCOMES},
+    }
@@ -0,0 +1,74 @@
+"""
+An in-memory schedule of events ordered by scheduled start, kept sorted so
+that questions like "which events start in the next N hours" can be
+answered with a binary search instead of scanning every event
+"""
+
+import threading
+from bisect import bisect_left, bisect_right
+
+class EventSchedule:
+
+    """
+    Keeps (scheduled_start, name) pairs in a sorted list. Start times must
+    be in the normalized UTC format used by the database
+    (YYYY-MM-DD HH:MM:SS), so that string order matches time order.
+
+    Lookups are O(log n + k) for k matching events, adds and removes are
+    O(log n) to find the position (plus the list shift)
+    """
+
+    def __init__(self, rows=()):
+        self._lock = threading.Lock()
+        # parallel lists, _times holds just the start times so it can be
+        # bisected directly, _entries holds the matching (start, name) pairs
+        self._entries = sorted((start, name) for name, start in rows
+                               if start is not None)
+        self._times = [start for start, _ in self._entries]
+        self._starts = {name: start for start, name in self._entries}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, name, scheduled_start):
+
+        """
+        Adds an event to the schedule, or moves it if it is already
+        scheduled at a different time
+        """
+
+        with self._lock:
+            self._remove(name)
+            if scheduled_start is not None:
+                i = bisect_left(self._entries, (scheduled_start, name))
+                self._entries.insert(i, (scheduled_start, name))
+                self._times.insert(i, scheduled_start)
+                self._starts[name] = scheduled_start
+
+    def remove(self, name):
+
+        """
+        Removes an event from the schedule, if it is scheduled
+        """
+
+        with self._lock:
+            self._remove(name)
+
+    def _remove(self, name):
+        start = self._starts.pop(name, None)
+        if start is not None:
+            i = bisect_left(self._entries, (start, name))
+            del self._entries[i]
+            del self._times[i]
+
+    def between(self, start, end):
+
+        """
+        Returns (scheduled_start, name) pairs for every event scheduled
+        between start and end inclusive, in start order
+        """
+
+        with self._lock:
+            lo = bisect_left(self._times, start)
+            hi = bisect_right(self._times, end)
+            return self._entries[lo:hi]
@@ -0,0 +1,141 @@
+"""
+Starts events automatically at their scheduled start, instead of waiting
+for a client to set their status to Started. A background thread keeps a
+heap of upcoming start times and sleeps until the earliest one is due,
+then starts every event that is due in one batch
+"""
+
+import heapq
+import threading
+import time
+from datetime import datetime, timezone
+
+class AutoStarter:
+
+    """
+    Sleeps until the next scheduled start, then calls start_due(now) to
+    start every event due by then in one go. Events kicking off at the same
+    time (e.g. every match at 15:00) are started by a single batch.
+
+    load_due(until) should return the scheduled starts (as UTC datetimes)
+    of every pending event due by the given time. It is used to reload the
+    heap every resync_interval seconds, which picks up events created or
+    rescheduled elsewhere. Events created by this process can be added
+    straight away with notify(). A batch that fails is tried again after
+    retry_delay seconds
+    """
+
+    def __init__(self, load_due, start_due, resync_interval=60,
+                 retry_delay=1):
+        self._load_due = load_due
+        self._start_due = start_due
+        self.resync_interval = resync_interval
+        self.retry_delay = retry_delay
+        self._heap = []
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def resync(self):
+
+        """
+        Reloads the heap with the pending events due to start before the
+        next resync
+        """
+
+        until = datetime.now(timezone.utc).timestamp() + self.resync_interval
+        starts = self._load_due(datetime.fromtimestamp(until, timezone.utc))
+        with self._cond:
+            # a sorted list is already a valid heap
+            self._heap = sorted(starts)
+            self._cond.notify()
+
+    def notify(self, scheduled_start):
+
+        """
+        Adds an event's scheduled start to the heap, waking the thread if
+        it is now the earliest
+        """
+
+        with self._cond:
+            heapq.heappush(self._heap, scheduled_start)
+            self._cond.notify()
+
+    def run_due(self):
+
+        """
+        Starts every event that is due now, in one batch, and returns the
+        names of the events that were started. If the batch fails, the
+        start times taken off the heap are put back, so the events are
+        tried again at the next wake up
+        """
+
+        now = datetime.now(timezone.utc)
+        with self._cond:
+            if not self._heap or self._heap[0] > now:
+                return []
+            due = []
+            while self._heap and self._heap[0] <= now:
+                due.append(heapq.heappop(self._heap))
+        try:
+            return self._start_due(now)
+        except Exception:
+            with self._cond:
+                for scheduled_start in due:
+                    heapq.heappush(self._heap, scheduled_start)
+            raise
+
+    def start(self):
+
+        """
+        Loads the heap and starts the background thread
+        """
+
+        self.resync()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+
+        """
+        Stops the background thread
+        """
+
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _seconds_until_next(self):
+        if not self._heap:
+            return self.resync_interval
+        wait = (self._heap[0] - datetime.now(timezone.utc)).total_seconds()
+        return min(max(wait, 0), self.resync_interval)
+
+    def _run(self):
+        last_resync = time.monotonic()
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                wait = self._seconds_until_next()
+                if wait > 0:
+                    self._cond.wait(wait)
+                if self._stopped:
+                    return
+            try:
+                if time.monotonic() - last_resync >= self.resync_interval:
+                    self.resync()
+                    last_resync = time.monotonic()
+                self.run_due()
+            except Exception as e:
+                # e.g. a locked database, or a stored start time that can't
+                # be parsed. The thread must keep going, or nothing would be
+                # started for the rest of the process's life. The events are
+                # still due, so wait a moment before trying again rather than
+                # retrying straight away
+                print(f"error starting scheduled events: {e}")
+                with self._cond:
+                    if not self._stopped:
+                        self._cond.wait(self.retry_delay)
@@ -0,0 +1,65 @@
+"""
+Request-level deduplication for identical concurrent work. When several
+threads ask for the same key at the same time, only the first one runs the
+function, and the others wait for it and share its result (or its error)
+"""
+
+import threading
+
+class _Call:
+
+    """
+    An in-flight call for a single key, holding the result or error once
+    the leading thread has finished running the function
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+
+    """
+    Collapses concurrent calls with the same key into one execution.
+    Calls are only shared while they are in flight, nothing is cached
+    after the leading call returns, so later calls always see fresh data
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+
+        """
+        Runs fn() for the given key, unless a call for the same key is
+        already running, in which case waits for that call and returns
+        its result (or raises its error). The key must be hashable
+        """
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            # forget the call before waking the waiters, so any request
+            # arriving from now on runs a fresh query
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
@@ -0,0 +1,135 @@
+"""
+Benchmarks how long a worker takes to start: importing the app module in a
+fresh interpreter, and initializing a database that is new and one that is
+already at the current schema version. Writes the results as JSON lines
+(one object per measurement) so they can be kept and compared between runs
+to catch regressions, and lists any of the slow optional modules (pyarrow,
+NumPy, dateutil and slugify) that were imported with the app, as they
+should only be imported on first use.
+
+Usage:
+    python startup_benchmark.py [--repeat 5] [--output results.jsonl]
+
+A summary table is printed to stderr as it runs
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+# modules that are slow to import and are only needed by some requests
+LAZY_MODULES = ["pyarrow", "numpy", "dateutil", "slugify"]
+
+# run in a fresh interpreter, so nothing is imported already
+IMPORT_SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+import app
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds,
+                  "lazy_modules_loaded": [name for name in {LAZY_MODULES!r}
+                                          if name in sys.modules]}}))
+"""
+
+def measure_import(repeat):
+
+    """
+    Imports the app in repeat fresh interpreters. Returns the best time in
+    seconds and the slow optional modules it imported
+    """
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    loaded = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT],
+                                cwd=here, check=True, capture_output=True,
+                                text=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        best = result["seconds"] if best is None \
+            else min(best, result["seconds"])
+        loaded = result["lazy_modules_loaded"]
+    return best, loaded
+
+def measure_init(repeat):
+
+    """
+    Initializes a new database repeat times, and one that is already up to
+    date repeat times. Returns the best time in seconds for each
+    """
+
+    import app # pylint: disable=import-outside-toplevel
+
+    new = current = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(repeat):
+            path = os.path.join(tmp, f"app{i}.db")
+            start = time.perf_counter()
+            app.init_database(path)
+            elapsed = time.perf_counter() - start
+            new = elapsed if new is None else min(new, elapsed)
+
+            start = time.perf_counter()
+            app.init_database(path)
+            elapsed = time.perf_counter() - start
+            current = elapsed if current is None else min(current, elapsed)
+    return new, current
+
+def run(repeat=5):
+
+    """
+    Yields a result record (a dict) for each measurement: importing the
+    app, and initializing a new and an up to date database
+    """
+
+    environment = {
+        "python_version": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "run_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    seconds, loaded = measure_import(repeat)
+    yield {"measurement": "import", "seconds": seconds,
+           "lazy_modules_loaded": loaded, **environment}
+    new, current = measure_init(repeat)
+    yield {"measurement": "init_new_database", "seconds": new, **environment}
+    yield {"measurement": "init_current_database", "seconds": current,
+           **environment}
+
+def main(argv=None):
+
+    """
+    Runs the benchmarks from the command line
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="runs to take the best time from")
+    parser.add_argument("--output", help="file to append the JSON lines "
+                                         "to, instead of stdout")
+    args = parser.parse_args(argv)
+
+    output = open(args.output, "a", encoding="utf-8") if args.output \
+        else sys.stdout
+    print(f"{'measurement':>22} {'time':>10}", file=sys.stderr)
+    try:
+        for record in run(args.repeat):
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            print(f"{record['measurement']:>22} "
+                  f"{record['seconds'] * 1000:>8.2f}ms", file=sys.stderr)
+            if record.get("lazy_modules_loaded"):
+                print(f"{'':>22} also imported "
+                      f"{', '.join(record['lazy_modules_loaded'])}",
+                      file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+if __name__ == "__main__":
+    main()
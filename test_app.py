@@ -1,12 +1,15 @@
 """
 Unit tests for the CRUD REST API, covering create, read, update and delete
-functionality for all three tables.
+functionality for all three tables. Each test runs against its own fresh
+database through Flask's test client (see apptest.py), so no server needs to
+be running, and tests can run in any order or in parallel.
 
 Create tests include:
 Testing with the correct parameters
 Testing with all parameters, including those that have a default value
 Testing with no parameters
 Testing with missing parameters
+Testing that active flags are stored as booleans
 
 Read tests include:
 Testing with no parameters (i.e. find all)
@@ -17,6 +20,12 @@ Testing with a search that returns no results
 Testing the name regexes match correctly
 Testing the min-events/min-selections parameters work correctly
 Testing the min-price/max-price parameters for selections work correctly
+Testing that prices are stored in exact cents and price bands use the index
+Testing that the fields parameter returns only the given fields, and
+rejects fields that don't exist
+Testing that events and sports included with a search are each given once,
+and that the results only have the fields asked for
+Testing that the upcoming events reject windows too far ahead to work out
 
 Update tests include:
 Testing with no parameters
@@ -28,6 +37,10 @@ Testing that setting an event's status to Started will set the actual start
 and set its type to Inplay
 Testing that updating an event's status to Ended or Cancelled will set
 it to inactive
+Testing that of two concurrent status changes from the same status, only
+the first is written
+Testing that the upcoming events follow reschedules and renames, and
+ignore updates to events that don't exist
 
 Delete tests include:
 Testing with an existing record
@@ -36,21 +49,78 @@ another table referring to it)
 Testing with an invalid record (there's nothing to delete, as that value
 isn't in the database)
 Testing with an empty value
+
+Summary tests include:
+Testing the counts, prices and outcomes for every sport and event
+Testing that the summary follows updates, including their cascades
+Testing narrowing the summary to one sport
+
+Batch tests include:
+Testing that writes are committed together and searches see them
+Testing that a failed write rolls back the whole batch and skips the
+writes after it
+Testing that invalid batches are rejected
+Testing that a batch's searches see its writes when replicas are enabled
+
+Limit tests include:
+Testing that a client is limited on one route but not on others
+Testing that searches with no filters (or only ones matching everything),
+the hierarchy, the summary and exports are turned away once the full scans'
+budget is used up, while filtered searches still run
+Testing that an export holds its full scan slot until it has been sent
+
+Archive tests include:
+Testing that a finished event and its selections are moved to the archive,
+and are only found by searches with archived=true
+Testing that an event with unsettled selections isn't archived
+Testing that a retention period too long to work out is rejected
+
+Replica tests include:
+Testing that searches are served from a fresh replica snapshot, with its
+age in the X-Snapshot-Age header
+Testing that searches read the primary database once the snapshot is stale
+
+Sharding tests include:
+Testing that each sport's events and selections are stored in its shard
+Testing that searches combine the results from every shard, and only query
+one shard when narrowed to a sport
+Testing that events and selections are updated and deleted in their shard
+Testing that a batch commits or rolls back its writes in every shard
+Testing that event and selection names stay unique across shards, when
+created, renamed and imported
+Testing that sports, events and selections can't be moved to another shard
+
+Migration tests include:
+Testing that a database with events and selections keyed by name is
+converted to integer keys, keeping every row and the links between them
+Testing that prices stored as REAL are converted to cents
+Testing that statuses, types and outcomes stored in another case are
+capitalized, so searches and the summary match them
+Testing that a database already at the schema version is left as it is
 """
 
+import json
+import os
 import sqlite3
+import tempfile
 import unittest
-import requests
+from datetime import datetime, timedelta, timezone
+from unittest import mock
 import app
+from ratelimit import AdmissionControl, RateLimiter
+from replica import SnapshotPublisher
+from apptest import AppTestCase, EVENTS, SPORTS, from_now
 
-class TestCases(unittest.TestCase):
+class TestCreateSport(AppTestCase):
 
     """
-    A test cases class to hold all the unit tests for the CRUD REST API
+    Tests for creating sports, starting from an empty database
     """
 
-    def test_create_sport_with_required_params(self):#
-    
+    records = []
+
+    def test_create_sport_with_required_params(self):
+
         """
         Tests making a post request to create a new sport with the
         required query parameters (i.e. name), ensuring the correct
@@ -59,12 +129,9 @@ class TestCases(unittest.TestCase):
         """
 
         params = {"name": "golf"}
-        url = "http://127.0.0.1:5000/sports?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.post(url, timeout=60)
+        response = self.client.post("/sports", query_string=params)
         self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.query("SELECT name FROM sports"), [("golf",)])
 
     def test_create_sport_with_all_params(self):
 
@@ -76,65 +143,142 @@ class TestCases(unittest.TestCase):
         """
 
         params = {"name": "football", "slug": "football", "active": "1"}
-        url = "http://127.0.0.1:5000/sports?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.post(url, timeout=60)
+        response = self.client.post("/sports", query_string=params)
         self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.query("SELECT name, slug FROM sports"),
+                         [("football", "football")])
+
+    def test_create_sport_active_flag(self):
+
+        """
+        Tests that the active flag is stored as a boolean, whichever way it
+        is written, and that anything else is rejected
+        """
+
+        for name, active in [("golf", "TRUE"), ("tennis", "0")]:
+            response = self.client.post("/sports", query_string={
+                "name": name, "active": active})
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(sorted(self.query("SELECT name, active FROM sports")),
+                         [("golf", 1), ("tennis", 0)])
+        response = self.client.post("/sports", query_string={
+            "name": "darts", "active": "yes"})
+        self.assertEqual(response.status_code, 400)
 
     def test_create_sport_empty(self):
-        url = "http://127.0.0.1:5000/sports"
-        response = requests.post(url, timeout=60)
+        response = self.client.post("/sports")
         self.assertEqual(response.status_code, 400)
 
     def test_create_sport_missing_required_params(self):
         params = {'active': 'False'}
-        url = "http://127.0.0.1:5000/sports?"
-        for key, value in params.items():
-            url += key + "=" + value + " &"
-        url = url[:-1] # remove final &
-        response = requests.post(url, timeout=60)
+        response = self.client.post("/sports", query_string=params)
+        self.assertEqual(response.status_code, 400)
+
+class TestCreateEvent(AppTestCase):
+
+    """
+    Tests for creating events, starting from a database with sports
+    """
+
+    records = SPORTS
+
+    def test_create_event_with_required_params(self):
+        params = {"name": "Man Utd vs Chelsea", "sport": "football",
+                  "scheduled-start": "2024-06-16 15:00:00 +00:00"}
+        response = self.client.post("/events", query_string=params)
+        self.assertEqual(response.status_code, 201)
+
+    def test_create_event_with_all_params(self):
+        params = {"name": "Arsenal vs Liverpool", "sport": "football",
+                  "slug": "arsenal-vs-liverpool", "active": "1",
+                  "scheduled-start": "2024-06-17 15:00:00 +00:00"}
+        response = self.client.post("/events", query_string=params)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.query("SELECT name, scheduled_start FROM events"),
+                         [("Arsenal vs Liverpool", "2024-06-17 15:00:00")])
+
+    def test_create_event_empty(self):
+        response = self.client.post("/events")
+        self.assertEqual(response.status_code, 400)
+
+    def test_create_event_missing_required_params(self):
+        params = {'active': 'False'}
+        response = self.client.post("/events", query_string=params)
         self.assertEqual(response.status_code, 400)
 
+class TestCreateSelection(AppTestCase):
+
+    """
+    Tests for creating selections, starting from a database with sports and
+    events
+    """
+
+    records = SPORTS + EVENTS
+
+    def test_create_selection_with_required_params(self):
+        params = {"name": "Man Utd", "event": "Man Utd vs Chelsea", "price":"3.00"}
+        response = self.client.post("/selections", query_string=params)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.query("SELECT name, event FROM selection_rows"),
+                         [("Man Utd", "Man Utd vs Chelsea")])
+
+    def test_create_selection_with_all_params(self):
+        params = {"name": "Chelsea", "event": "Man Utd vs Chelsea", "price":"3.00",
+                  "active": "1"}
+        response = self.client.post("/selections", query_string=params)
+        self.assertEqual(response.status_code, 201)
+
+    def test_create_selection_empty(self):
+        response = self.client.post("/selections")
+        self.assertEqual(response.status_code, 400)
+
+    def test_create_selection_missing_required_params(self):
+        params = {'active': '1'}
+        response = self.client.post("/selections", query_string=params)
+        self.assertEqual(response.status_code, 400)
+
+class TestSports(AppTestCase):
+
+    """
+    Tests for searching, updating and deleting sports
+    """
+
     def test_search_sports_no_params(self):
-        url = "http://127.0.0.1:5000/sports"
-        response = requests.get(url, timeout=60)
+        response = self.client.get("/sports")
         self.assertEqual(response.status_code, 200)
-        
+
+    def test_search_sports_fields(self):
+        params = {"fields": "name,active", "active": "true"}
+        response = self.client.get("/sports", query_string=params)
+        self.assertEqual(response.get_json(),
+                         [{"name": "football", "active": 1}])
+
+    def test_search_sports_unknown_field(self):
+        params = {"fields": "name,colour"}
+        response = self.client.get("/sports", query_string=params)
+        self.assertEqual(response.status_code, 400)
+
     def test_search_sports_one_param(self):
         params = {"name": "football"}
-        url = "http://127.0.0.1:5000/sports?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
+        response = self.client.get("/sports", query_string=params)
         self.assertEqual(response.status_code, 200)
-        json_entries = response.json()
+        json_entries = response.get_json()
         for entry in json_entries:
             self.assertEqual(entry["name"], "football")
 
     def test_search_sports_name_match(self):
         params = {"name-start": "foot"}
-        url = "http://127.0.0.1:5000/sports?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
+        response = self.client.get("/sports", query_string=params)
         self.assertEqual(response.status_code, 200)
-        json_entries = response.json()
+        json_entries = response.get_json()
         for entry in json_entries:
             self.assertTrue(entry["name"].startswith("foot"))
 
     def test_search_sports_multiple_params(self):
         params = {"name": "football", "slug": "football", "active": "0"}
-        url = "http://127.0.0.1:5000/sports?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
+        response = self.client.get("/sports", query_string=params)
         self.assertEqual(response.status_code, 200)
-        json_entries = response.json()
+        json_entries = response.get_json()
         for entry in json_entries:
             self.assertEqual(entry["name"], "football")
             self.assertEqual(entry["slug"], "football")
@@ -142,65 +286,25 @@ class TestCases(unittest.TestCase):
 
     def test_search_sports_min_events(self):
         params = {"min-events": "1"}
-        url = "http://127.0.0.1:5000/sports?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
+        response = self.client.get("/sports", query_string=params)
         self.assertEqual(response.status_code, 200)
-        json_entries = response.json()
+        json_entries = response.get_json()
         self.assertEqual(len(json_entries), 1)
-     
+
     def test_search_sports_invalid_param(self):
         params = {"invalid": "test"}
-        url = "http://127.0.0.1:5000/sports?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
-        self.assertEqual(response.status_code, 404)
- 
+        response = self.client.get("/sports", query_string=params)
+        self.assertEqual(response.status_code, 400)
+
     def test_search_sports_no_match(self):
         params = {"name": "nonexistent"} # there's no entry for this in sports
-        url = "http://127.0.0.1:5000/sports?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
+        response = self.client.get("/sports", query_string=params)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.json()), 0)
+        self.assertEqual(len(response.get_json()), 0)
 
     def test_update_sport_no_params(self):
-        url = "http://127.0.0.1:5000/sports/football"
-        response = requests.put(url, timeout=60)
+        response = self.client.put("/sports/football")
         self.assertEqual(response.status_code, 400)
-  
-    def test_update_sport_one_param(self):
-        params = {'slug': 'soccer'}
-        url = "http://127.0.0.1:5000/sports/football"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.put(url, timeout=60)
-        self.assertEqual(response.status_code, 200)
-
-    def test_update_sport_multiple_params(self):
-        params = {'name': 'Football', 'active': '1'}
-        url = "http://127.0.0.1:5000/sports/football"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.put(url, timeout=60)
-        self.assertEqual(response.status_code, 200)
-
-    def test_update_sport_invalid_params(self):
-        params = {'test': 'nonexistent'}
-        url = "http://127.0.0.1:5000/sports/football"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.put(url, timeout=60)
-        self.assertEqual(response.status_code, 500)
 
     def test_update_sport_one_param(self):
         pass
@@ -212,93 +316,73 @@ class TestCases(unittest.TestCase):
         pass
 
     def test_delete_sport_existing(self):
-        url = "http://127.0.0.1:5000/events/golf"
-        response = requests.delete(url, timeout=60)
+        response = self.client.delete("/events/golf")
         self.assertEqual(response.status_code, 204)
 
+    def test_delete_sport_dependent(self):
+        response = self.client.delete("/sports/football")
+        self.assertEqual(response.status_code, 500)
+        self.assertIn("error", response.get_json())
+
     def test_delete_sport_nonexistent(self):
-        url = "http://127.0.0.1:5000/sports/doesnt-exist"
-        response = requests.delete(url, timeout=60)
+        response = self.client.delete("/sports/doesnt-exist")
         self.assertEqual(response.status_code, 204)
 
     def test_delete_sport_empty(self):
-        url = "http://127.0.0.1:5000/sports/"
-        response = requests.delete(url, timeout=60)
+        response = self.client.delete("/sports/")
         self.assertEqual(response.status_code, 404)
 
-    def test_create_event_with_required_params(self):
-        params = {"name": "Man Utd vs Chelsea", "sport": "football",
-                  "scheduled-start": "2024-06-16 15:00:00 +00:00"}
-        url = "http://127.0.0.1:5000/events?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.post(url, timeout=60)
-        self.assertEqual(response.status_code, 201)
+class TestEvents(AppTestCase):
 
-    def test_create_event_with_all_params(self):
-        params = {"name": "Arsenal vs Liverpool", "sport": "football",
-                  "slug": "arsenal-vs-liverpool", "active": "1",
-                  "scheduled-start": "2024-06-17 15:00:00 +00:00"}
-        url = "http://127.0.0.1:5000/events?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.post(url, timeout=60)
-        self.assertEqual(response.status_code, 201)
-
-    def test_create_event_empty(self):
-        url = "http://127.0.0.1:5000/events"
-        response = requests.post(url, timeout=60)
-        self.assertEqual(response.status_code, 400)
+    """
+    Tests for searching, updating and deleting events
+    """
 
-    def test_create_event_missing_required_params(self):
-        params = {'active': 'False'}
-        url = "http://127.0.0.1:5000/events?"
-        for key, value in params.items():
-            url += key + "=" + value + " &"
-        url = url[:-1] # remove final &
-        response = requests.post(url, timeout=60)
-        self.assertEqual(response.status_code, 400)
-    
     def test_search_events_no_params(self):
-        url = "http://127.0.0.1:5000/events"
-        response = requests.get(url, timeout=60)
+        response = self.client.get("/events")
         self.assertEqual(response.status_code, 200)
-        
+
+    def test_search_events_include_sport(self):
+
+        """
+        Tests that including sports gives the events' one sport once, along
+        with the events, and that min-selections can be combined with
+        another filter
+        """
+
+        params = {"include": "sport", "fields": "name",
+                  "min-selections": "1", "name-start": "Man"}
+        response = self.client.get("/events", query_string=params)
+        self.assertEqual(response.get_json(), {
+            "events": [{"name": "Man Utd vs Chelsea"}],
+            "sports": [{"name": "football", "slug": "football", "active": 1}]})
+        # the link to the sport is only given when it is asked for
+        params["fields"] = "name,sport"
+        response = self.client.get("/events", query_string=params)
+        self.assertEqual(response.get_json()["events"],
+                         [{"name": "Man Utd vs Chelsea", "sport": "football"}])
+
     def test_search_events_one_param(self):
         params = {"name": "Man Utd vs Chelsea"}
-        url = "http://127.0.0.1:5000/sports?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
+        response = self.client.get("/sports", query_string=params)
         self.assertEqual(response.status_code, 200)
-        json_entries = response.json()
+        json_entries = response.get_json()
         for entry in json_entries:
             self.assertEqual(entry["name"], "Man Utd vs Chelsea")
 
     def test_search_events_name_match(self):
         params = {"name-end": "Chelsea"}
-        url = "http://127.0.0.1:5000/events?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
+        response = self.client.get("/events", query_string=params)
         self.assertEqual(response.status_code, 200)
-        json_entries = response.json()
+        json_entries = response.get_json()
         for entry in json_entries:
             self.assertTrue(entry["name"].endswith("Chelsea"))
 
     def test_search_events_multiple_params(self):
         params = {"name": "Man Utd vs Chelsea", "slug": "man-utd-vs-chelsea", "status": "Pending"}
-        url = "http://127.0.0.1:5000/events?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
+        response = self.client.get("/events", query_string=params)
         self.assertEqual(response.status_code, 200)
-        json_entries = response.json()
+        json_entries = response.get_json()
         for entry in json_entries:
             self.assertEqual(entry["name"], "Man Utd vs Chelsea")
             self.assertEqual(entry["slug"], "man-utd-vs-chelsea")
@@ -306,321 +390,931 @@ class TestCases(unittest.TestCase):
 
     def test_search_events_min_selections(self):
         params = {"min-selections": "1"}
-        url = "http://127.0.0.1:5000/events?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
+        response = self.client.get("/events", query_string=params)
         self.assertEqual(response.status_code, 200)
-        json_entries = response.json()
+        json_entries = response.get_json()
         self.assertEqual(len(json_entries), 1)
 
     def test_search_events_timeframe(self):
-        params = {"timeframe": "2024-06-17 18:00:00 +02:00"}
-        url = "http://127.0.0.1:5000/events?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
-        self.assertEqual(response.status_code, 200)
-        json_entries = response.json()
+        # both events start within the next three days, given here in
+        # another timezone
+        end = datetime.now(timezone.utc) + timedelta(days=3)
+        end = end.astimezone(timezone(timedelta(hours=2)))
+        params = {"timeframe": end.strftime("%Y-%m-%d %H:%M:%S %z")}
+        response = self.client.get("/events", query_string=params)
+        self.assertEqual(response.status_code, 200)
+        json_entries = response.get_json()
         self.assertEqual(len(json_entries), 2)
-     
+
+    def test_search_events_upcoming(self):
+        params = {"hours": "1000000"}
+        response = self.client.get("/events/upcoming", query_string=params)
+        self.assertEqual(response.status_code, 200)
+        starts = [entry["scheduled_start"] for entry in response.get_json()]
+        self.assertEqual(starts, sorted(starts))
+
+    def test_upcoming_hours_bounded(self):
+        for hours in ["1e9", "-1e9"]:
+            response = self.client.get("/events/upcoming",
+                                       query_string={"hours": hours})
+            self.assertEqual(response.status_code, 400)
+
+    def test_upcoming_follows_updates(self):
+        def upcoming():
+            response = self.client.get("/events/upcoming",
+                                       query_string={"hours": "1000000"})
+            return [entry["name"] for entry in response.get_json()]
+
+        self.assertEqual(upcoming(), ["Man Utd vs Chelsea",
+                                      "Arsenal vs Liverpool"])
+        self.client.put("/events/Nope", query_string={
+            "scheduled-start": from_now(hours=1)})
+        self.client.put("/events/Arsenal vs Liverpool", query_string={
+            "scheduled-start": from_now(hours=1)})
+        self.client.put("/events/Man Utd vs Chelsea", query_string={
+            "name": "Man Utd vs Chelsea (R)"})
+        self.assertEqual(upcoming(), ["Arsenal vs Liverpool",
+                                      "Man Utd vs Chelsea (R)"])
+
     def test_search_events_invalid_param(self):
         params = {"invalid": "test"}
-        url = "http://127.0.0.1:5000/events?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
-        self.assertEqual(response.status_code, 500)
- 
+        response = self.client.get("/events", query_string=params)
+        self.assertEqual(response.status_code, 400)
+
     def test_search_events_no_match(self):
         params = {"name": "nonexistent"} # there's no entry for this in events
-        url = "http://127.0.0.1:5000/events?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
-        self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.json()), 0)
-        
+        response = self.client.get("/events", query_string=params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()), 0)
+
+    def test_update_event_no_params(self):
+        response = self.client.put("/events/Man Utd vs Chelsea")
+        self.assertEqual(response.status_code, 400)
+
+    def test_update_event_one_param(self):
+        params = {'slug': 'manchester-v-chelsea'}
+        response = self.client.put("/events/Man Utd vs Chelsea",
+                                   query_string=params)
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_event_multiple_params(self):
+        params = {'slug': 'utd-v-chelsea', 'active': '1'}
+        response = self.client.put("/events/Man Utd vs Chelsea",
+                                   query_string=params)
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_event_invalid_params(self):
+        params = {'price': 'nonexistent'}
+        response = self.client.put("/events/Man Utd vs Chelsea",
+                                   query_string=params)
+        self.assertEqual(response.status_code, 400)
+
+    def test_update_event_invalid_transition(self):
+        params = {'status': 'ended'} # a pending event can't end before it starts
+        response = self.client.put("/events/Man Utd vs Chelsea",
+                                   query_string=params)
+        self.assertEqual(response.status_code, 409)
+
+    def test_concurrent_transitions(self):
+        transition = app.lifecycle.transition
+        responses = []
+
+        def cancel_first(current, status, now):
+            # another request cancels the event after this one has read
+            # its status as Pending
+            if status == "Started":
+                responses.append(self.client.put(
+                    "/events/Man Utd vs Chelsea",
+                    query_string={"status": "cancelled"}))
+            return transition(current, status, now)
+
+        with mock.patch.object(app.lifecycle, "transition", cancel_first):
+            response = self.client.put("/events/Man Utd vs Chelsea",
+                                       query_string={"status": "started"})
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertEqual(response.status_code, 409)
+        event = self.client.get("/events", query_string={
+            "name": "Man Utd vs Chelsea", "fields": "status,actual_start"})
+        self.assertEqual(event.get_json(), [{"status": "Cancelled",
+                                             "actual_start": None}])
+
+    def test_delete_event_existing(self):
+        response = self.client.delete("/events/Arsenal vs Liverpool")
+        self.assertEqual(response.status_code, 204)
+
+    def test_delete_event_dependent(self):
+        response = self.client.delete("/events/Man Utd vs Chelsea")
+        self.assertEqual(response.status_code, 500)
+
+    def test_delete_event_nonexistent(self):
+        response = self.client.delete("/events/doesnt-exist")
+        self.assertEqual(response.status_code, 204)
+
+    def test_delete_event_empty(self):
+        response = self.client.delete("/events/")
+        self.assertEqual(response.status_code, 404)
+
+class TestSelections(AppTestCase):
+
+    """
+    Tests for searching, updating and deleting selections
+    """
+
     def test_search_selections_no_params(self):
-        url = "http://127.0.0.1:5000/selections"
-        response = requests.get(url, timeout=60)
+        response = self.client.get("/selections")
         self.assertEqual(response.status_code, 200)
-    
+
+    def test_search_selections_fields(self):
+
+        """
+        Tests that selections can be narrowed to some fields, with or
+        without their event, and still searched by event
+        """
+
+        params = {"fields": "name,price", "event": "Man Utd vs Chelsea",
+                  "active": "1"}
+        response = self.client.get("/selections", query_string=params)
+        self.assertEqual(response.get_json(), [{"name": "Chelsea",
+                                                "price": 3.0}])
+        params = {"fields": "event,name,event", "name": "Man Utd"}
+        response = self.client.get("/selections", query_string=params)
+        self.assertEqual(response.get_json(),
+                         [{"name": "Man Utd", "event": "Man Utd vs Chelsea"}])
+
+    def test_search_selections_include(self):
+
+        """
+        Tests that including events and sports gives each selection's event
+        and sport once, however many selections share them, and that the
+        selections only have the fields asked for
+        """
+
+        params = {"include": "event,sport", "fields": "name"}
+        response = self.client.get("/selections", query_string=params)
+        result = response.get_json()
+        self.assertEqual(sorted(result["selections"], key=lambda s: s["name"]),
+                         [{"name": "Chelsea"}, {"name": "Man Utd"}])
+        self.assertEqual([(event["name"], event["sport"])
+                          for event in result["events"]],
+                         [("Man Utd vs Chelsea", "football")])
+        self.assertEqual([sport["name"] for sport in result["sports"]],
+                         ["football"])
+
+        response = self.client.get("/selections",
+                                   query_string={"include": "team"})
+        self.assertEqual(response.status_code, 400)
+
     def test_search_selections_one_param(self):
         params = {"name": "Man U"}
-        url = "http://127.0.0.1:5000/selections?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
+        response = self.client.get("/selections", query_string=params)
         self.assertEqual(response.status_code, 200)
-        json_entries = response.json()
+        json_entries = response.get_json()
         for entry in json_entries:
             self.assertEqual(entry["name"], "Man U")
 
     def test_search_selections_name_match(self):
         params = {"name-contains": "Man"}
-        url = "http://127.0.0.1:5000/selections?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
+        response = self.client.get("/selections", query_string=params)
         self.assertEqual(response.status_code, 200)
-        json_entries = response.json()
+        json_entries = response.get_json()
         for entry in json_entries:
             self.assertTrue("Man" in entry["name"])
 
     def test_search_selections_multiple_params(self):
         params = {"name": "Man Utd vs Chelsea", "price": "3.00"}
-        url = "http://127.0.0.1:5000/selections?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
+        response = self.client.get("/selections", query_string=params)
         self.assertEqual(response.status_code, 200)
-        json_entries = response.json()
+        json_entries = response.get_json()
         for entry in json_entries:
             self.assertEqual(entry["name"], "Man Utd vs Chelsea")
             self.assertEqual(entry["price"], "3.00")
 
     def test_search_selections_min_price(self):
         params = {"min-price": "2.00"}
-        url = "http://127.0.0.1:5000/selections?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
+        response = self.client.get("/selections", query_string=params)
         self.assertEqual(response.status_code, 200)
-        json_entries = response.json()
+        json_entries = response.get_json()
         self.assertEqual(len(json_entries), 2)
- 
+
     def test_search_selections_max_price(self):
         params = {"max-price": "4.00"}
-        url = "http://127.0.0.1:5000/selections?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
+        response = self.client.get("/selections", query_string=params)
         self.assertEqual(response.status_code, 200)
-        json_entries = response.json()
+        json_entries = response.get_json()
         self.assertEqual(len(json_entries), 2)
-     
+
     def test_search_selections_invalid_param(self):
         params = {"invalid": "test"}
-        url = "http://127.0.0.1:5000/selections?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
-        self.assertEqual(response.status_code, 500)
- 
+        response = self.client.get("/selections", query_string=params)
+        self.assertEqual(response.status_code, 400)
+
     def test_search_selections_no_match(self):
         params = {"name": "nonexistent"} # there's no entry for this in events
-        url = "http://127.0.0.1:5000/selections?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.get(url, timeout=60)
-        self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(response.json()), 0)
-    
-    def test_update_event_no_params(self):
-        url = """http://127.0.0.1:5000/events/Man Utd vs Chelsea"""
-        response = requests.put(url, timeout=60)
+        response = self.client.get("/selections", query_string=params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()), 0)
+
+    def test_update_selection_no_params(self):
+        response = self.client.put("/selections/Chelsea")
         self.assertEqual(response.status_code, 400)
 
-    def test_update_event_one_param(self):
-        params = {'slug': 'manchester-v-chelsea'}
-        url = """http://127.0.0.1:5000/events/Man Utd vs Chelsea?"""
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.put(url, timeout=60)
+    def test_update_selection_one_param(self):
+        params = {'price': '3.50'}
+        response = self.client.put("/selections/Chelsea", query_string=params)
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.query("""SELECT price_cents FROM selections
+                                       WHERE name = 'Chelsea'"""), [(350,)])
 
-    def test_update_event_multiple_params(self):
-        params = {'slug': 'utd-v-chelsea', 'active': '1'}
-        url = """http://127.0.0.1:5000/events/Man Utd vs Chelsea?"""
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.put(url, timeout=60)
+    def test_update_selection_multiple_params(self):
+        params = {'price': '4.50', 'active': '1'}
+        response = self.client.put("/selections/Chelsea", query_string=params)
         self.assertEqual(response.status_code, 200)
 
-    def test_update_event_invalid_params(self):
-        params = {'price': 'nonexistent'}
-        url = """http://127.0.0.1:5000/events/Man Utd vs Chelsea?"""
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.put(url, timeout=60)
-        self.assertEqual(response.status_code, 500)
+    def test_update_selection_invalid_params(self):
+        params = {'test': 'nonexistent'}
+        response = self.client.put("/selections/Chelsea", query_string=params)
+        self.assertEqual(response.status_code, 400)
 
-    def test_delete_event_existing(self):
-        url = """http://127.0.0.1:5000/events/Arsenal vs Liverpool"""
-        response = requests.delete(url, timeout=60)
+    def test_delete_selection_existing(self):
+        response = self.client.delete("/selections/test")
         self.assertEqual(response.status_code, 204)
 
-    def test_delete_event_nonexistent(self):
-        url = "http://127.0.0.1:5000/events/doesnt-exist"
-        response = requests.delete(url, timeout=60)
+    def test_delete_selection_nonexistent(self):
+        response = self.client.delete("/selections/doesnt-exist")
         self.assertEqual(response.status_code, 204)
- 
-    def test_delete_event_empty(self):
-        url = "http://127.0.0.1:5000/events/"
-        response = requests.delete(url, timeout=60)
+
+    def test_delete_selection_empty(self):
+        response = self.client.delete("/events/")
         self.assertEqual(response.status_code, 404)
 
-    def test_create_selection_with_required_params(self):
-        params = {"name": "Man Utd", "event": "Man Utd vs Chelsea", "price":"3.00"}
-        url = "http://127.0.0.1:5000/selections?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.post(url, timeout=60)
-        self.assertEqual(response.status_code, 201)
+    def test_price_band_in_cents(self):
 
-    def test_create_selection_with_all_params(self):
-        params = {"name": "Chelsea", "event": "Man Utd vs Chelsea", "price":"3.00",
-                  "active": "1"}
-        url = "http://127.0.0.1:5000/selections?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.post(url, timeout=60)
+        """
+        Tests that a price is stored as exact cents, that a price band
+        matches it on both ends and is returned as a decimal, and that the
+        band is searched with the price index
+        """
+
+        params = {"name": "Draw", "event": "Man Utd vs Chelsea",
+                  "price": "2.675"}
+        response = self.client.post("/selections", query_string=params)
         self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.query("""SELECT price_cents FROM selections
+                                       WHERE name = 'Draw'"""), [(268,)])
 
-    def test_create_selection_empty(self):
-        url = "http://127.0.0.1:5000/selections"
-        response = requests.post(url, timeout=60)
-        self.assertEqual(response.status_code, 500)
+        params = {"min-price": "2.68", "max-price": "2.68"}
+        response = self.client.get("/selections", query_string=params)
+        self.assertEqual([(entry["name"], entry["price"])
+                          for entry in response.get_json()],
+                         [("Draw", 2.68)])
 
-    def test_create_selection_missing_required_params(self):
-        params = {'active': '1'}
-        url = "http://127.0.0.1:5000/selections?"
-        for key, value in params.items():
-            url += key + "=" + value + " &"
-        url = url[:-1] # remove final &
-        response = requests.post(url, timeout=60)
-        self.assertEqual(response.status_code, 500)
+        plan = self.query(f"""EXPLAIN QUERY PLAN
+                              SELECT {app.SELECTION_COLUMNS}
+                              FROM {app.SELECTIONS_JOIN}
+                              WHERE selections.price_cents >= ?
+                              AND selections.price_cents <= ?""",
+                          (250, 300))
+        self.assertTrue(any("selections_price_cents" in row[-1]
+                            for row in plan))
 
-    def test_update_selection_no_params(self):
-        url = "http://127.0.0.1:5000/selections/Chelsea"
-        response = requests.put(url, timeout=60)
-        self.assertEqual(response.status_code, 400)
-        
-    def test_update_selection_one_param(self):
-        params = {'price': '3.50'}
-        url = "http://127.0.0.1:5000/selections/Chelsea?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.put(url, timeout=60)
+class TestSummary(AppTestCase):
+
+    """
+    Tests for the summary of sports and events read from the rollups
+    """
+
+    def get_summary(self, **params):
+        response = self.client.get("/summary", query_string=params)
         self.assertEqual(response.status_code, 200)
+        summary = response.get_json()
+        return ({sport["name"]: sport for sport in summary["sports"]},
+                {event["name"]: event for event in summary["events"]})
 
-    def test_update_selection_multiple_params(self):
-        params = {'price': '4.50', 'active': '1'}
-        url = "http://127.0.0.1:5000/selections/Chelsea?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.put(url, timeout=60)
+    def test_summary(self):
+        sports, events = self.get_summary()
+        self.assertEqual(
+            (sports["football"]["events"], sports["football"]["active_events"]),
+            (2, 1))
+        self.assertEqual(
+            (sports["golf"]["events"], sports["golf"]["active_events"]), (0, 0))
+        event = events["Man Utd vs Chelsea"]
+        self.assertEqual((event["selections"], event["active_selections"]),
+                         (2, 1))
+        self.assertEqual((event["min_price"], event["max_price"],
+                          event["avg_price"]), (3.0, 3.0, 3.0))
+        self.assertEqual(event["outcomes"], {"Win": 0, "Lose": 0, "Void": 0,
+                                             "Unsettled": 2})
+        empty = events["Arsenal vs Liverpool"]
+        self.assertEqual((empty["selections"], empty["min_price"],
+                          empty["avg_price"]), (0, None, None))
+
+    def test_summary_follows_updates(self):
+
+        """
+        Tests that settling the last active selection of an event updates
+        its counts, and that the cascade deactivating the event updates its
+        sport's counts
+        """
+
+        self.client.put("/events/Man Utd vs Chelsea",
+                        query_string={"active": "true"})
+        self.client.put("/selections/Chelsea",
+                        query_string={"outcome": "win", "price": "5.50"})
+        sports, events = self.get_summary()
+        event = events["Man Utd vs Chelsea"]
+        self.assertEqual((event["active"], event["active_selections"]), (0, 0))
+        self.assertEqual(event["outcomes"]["Win"], 1)
+        self.assertEqual((event["max_price"], event["avg_price"]), (5.5, 4.25))
+        self.assertEqual(sports["football"]["active_events"], 1)
+
+    def test_summary_for_sport(self):
+        sports, events = self.get_summary(sport="golf")
+        self.assertEqual((list(sports), events), (["golf"], {}))
+
+class TestBatch(AppTestCase):
+
+    """
+    Tests for running many requests in one batch
+    """
+
+    def batch(self, requests):
+        response = self.client.post("/batch", json=requests)
         self.assertEqual(response.status_code, 200)
+        return response.get_json()
 
-    def test_update_selection_invalid_params(self):
-        params = {'test': 'nonexistent'}
-        url = "http://127.0.0.1:5000/selections/Chelsea?"
-        for key, value in params.items():
-            url += key + "=" + value + "&"
-        url = url[:-1] # remove final &
-        response = requests.put(url, timeout=60)
-        self.assertEqual(response.status_code, 500)
+    def test_batch(self):
+        result = self.batch([
+            {"method": "GET", "path": "/selections",
+             "params": {"name": "Arsenal", "fields": "name"}},
+            {"method": "POST", "path": "/events",
+             "params": {"name": "Arsenal vs Spurs", "sport": "football",
+                        "scheduled-start": from_now(days=3)}},
+            {"method": "POST", "path": "/selections",
+             "params": {"name": "Arsenal", "event": "Arsenal vs Spurs",
+                        "price": 2.5, "active": True}},
+            {"method": "PUT", "path": "/selections/Chelsea",
+             "params": {"price": "3.50"}}])
+        self.assertTrue(result["committed"])
+        self.assertEqual([r["status"] for r in result["results"]],
+                         [200, 201, 201, 200])
+        self.assertEqual(result["results"][0]["body"], [{"name": "Arsenal"}])
+        self.assertEqual(
+            sorted(self.query("SELECT name, price_cents FROM selections")),
+            [("Arsenal", 250), ("Chelsea", 350), ("Man Utd", 300)])
 
-    def test_delete_selection_existing(self):
-        url = "http://127.0.0.1:5000/selections/test"
-        response = requests.delete(url, timeout=60)
-        self.assertEqual(response.status_code, 204)
+    def test_searches_read_primary_with_replicas(self):
+        app.replica_publisher = SnapshotPublisher(app.database_paths(), 60)
+        app.replica_publisher.publish()
+        with mock.patch.object(app, "REPLICA_MAX_STALENESS", 60):
+            result = self.batch([
+                {"method": "PUT", "path": "/selections/Chelsea",
+                 "params": {"price": "3.50"}},
+                {"method": "GET", "path": "/selections",
+                 "params": {"name": "Chelsea", "fields": "name,price"}}])
+            # outside of a batch, searches still read the snapshot
+            response = self.client.get("/selections", query_string={
+                "name": "Chelsea", "fields": "price"})
+        self.assertEqual(result["results"][1]["body"],
+                         [{"name": "Chelsea", "price": 3.5}])
+        self.assertEqual(response.get_json(), [{"price": 3.0}])
 
-    def test_delete_selection_nonexistent(self):
-        url = "http://127.0.0.1:5000/selections/doesnt-exist"
-        response = requests.delete(url, timeout=60)
+    def test_failed_write_rolls_back(self):
+        result = self.batch([
+            {"method": "PUT", "path": "/selections/Chelsea",
+             "params": {"price": "3.50"}},
+            {"method": "POST", "path": "/selections",
+             "params": {"name": "Spurs", "event": "Spurs vs Arsenal",
+                        "price": 2.0, "active": True}},
+            {"method": "POST", "path": "/sports", "params": {"name": "tennis"}},
+            {"method": "GET", "path": "/sports", "params": {"name": "tennis"}}])
+        self.assertFalse(result["committed"])
+        self.assertEqual([r["status"] for r in result["results"]],
+                         [200, 500, 424, 200])
+        self.assertEqual(result["results"][3]["body"], [])
+        self.assertEqual(sorted(self.query("SELECT name FROM sports")),
+                         [("football",), ("golf",)])
+        self.assertEqual(self.query("""SELECT price_cents FROM selections
+                                       WHERE name = 'Chelsea'"""), [(300,)])
+
+    def test_failed_delete_rolls_back(self):
+
+        """
+        Tests that a delete refused by a foreign key fails the batch, so the
+        sport created before it isn't kept
+        """
+
+        result = self.batch([
+            {"method": "POST", "path": "/sports", "params": {"name": "tennis"}},
+            {"method": "DELETE", "path": "/sports/football"}])
+        self.assertFalse(result["committed"])
+        self.assertEqual([r["status"] for r in result["results"]], [201, 500])
+        self.assertEqual(sorted(self.query("SELECT name FROM sports")),
+                         [("football",), ("golf",)])
+
+    def test_invalid_batch(self):
+        for body in [{}, [], [{"path": "/summary"}],
+                     [{"method": "PATCH", "path": "/sports"}],
+                     [{"path": "/sports", "params": ["name"]}],
+                     [{"path": "/sports"}] * (app.BATCH_LIMIT + 1)]:
+            response = self.client.post("/batch", json=body)
+            self.assertEqual(response.status_code, 400)
+
+class TestLimits(AppTestCase):
+
+    """
+    Tests for the rate limiting and the full scans' budget
+    """
+
+    def test_rate_limit(self):
+        app.rate_limiter = RateLimiter(0.001, 2)
+        for _ in range(2):
+            response = self.client.get("/sports")
+            self.assertEqual(response.status_code, 200)
+        response = self.client.get("/sports")
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(int(response.headers['Retry-After']) > 0)
+        response = self.client.put("/selections/Chelsea",
+                                   query_string={"price": "3.50"})
+        self.assertEqual(response.status_code, 200)
+        limits = self.client.get("/limits").get_json()
+        self.assertEqual((limits["rate_limit"]["allowed"],
+                          limits["rate_limit"]["limited"]), (4, 1))
+
+    def test_full_scan_budget(self):
+        app.full_scans = AdmissionControl(0, 0, 0)
+        paths = ["/sports", "/events", "/selections?fields=name",
+                 "/sports?name-contains=", "/events?min-selections=0",
+                 "/hierarchy", "/hierarchy/stats", "/summary", "/export"]
+        for path in paths:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 503, path)
+        for path in ["/selections?name=Chelsea", "/sports?name-contains=foot",
+                     "/summary?sport=football"]:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200, path)
+        self.assertEqual(
+            self.client.get("/limits").get_json()["full_scans"]["rejected"],
+            len(paths))
+
+    def test_export_releases_slot(self):
+        app.full_scans = AdmissionControl(1, 0, 0)
+        for _ in range(2):
+            with self.client.get("/export") as response:
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(app.full_scans.stats()["running"], 1)
+                response.get_data()
+            self.assertEqual(app.full_scans.stats()["running"], 0)
+
+class TestArchive(AppTestCase):
+
+    """
+    Tests for archiving finished events and searching the archive
+    """
+
+    def finish_event(self):
+        for status in ["Started", "Ended"]:
+            self.client.put("/events/Man Utd vs Chelsea",
+                            query_string={"status": status})
+
+    def archive(self):
+        # counting back from a day ahead, so events that have only just
+        # finished are archived
+        response = self.client.post("/archive",
+                                    query_string={"retention-days": "-1"})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()["events"]
+
+    def test_retention_days_bounded(self):
+        response = self.client.post("/archive",
+                                    query_string={"retention-days": "1e9"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_archive(self):
+        self.finish_event()
+        self.client.put("/selections/Man Utd", query_string={"outcome": "win"})
+        self.client.put("/selections/Chelsea", query_string={"outcome": "lose"})
+        self.assertEqual(self.archive(), ["Man Utd vs Chelsea"])
+
+        events = self.client.get("/events", query_string={"fields": "name"})
+        self.assertEqual(events.get_json(), [{"name": "Arsenal vs Liverpool"}])
+        self.assertEqual(self.client.get("/selections").get_json(), [])
+        events = self.client.get("/events", query_string={
+            "archived": "true", "min-selections": "0",
+            "fields": "name,status"})
+        self.assertEqual(events.get_json(),
+                         [{"name": "Man Utd vs Chelsea", "status": "Ended"}])
+        selections = self.client.get("/selections", query_string={
+            "archived": "true", "event": "Man Utd vs Chelsea",
+            "fields": "name,outcome", "include": "sport"}).get_json()
+        self.assertEqual(sorted(selections["selections"],
+                                key=lambda s: s["name"]),
+                         [{"name": "Chelsea", "outcome": "Lose"},
+                          {"name": "Man Utd", "outcome": "Win"}])
+        self.assertEqual([e["name"] for e in selections["events"]],
+                         ["Man Utd vs Chelsea"])
+        self.assertEqual([s["name"] for s in selections["sports"]],
+                         ["football"])
+
+        # the name is free to use again
+        response = self.client.post("/selections", query_string={
+            "name": "Chelsea", "event": "Arsenal vs Liverpool",
+            "price": "2.0"})
+        self.assertEqual(response.status_code, 201)
+
+    def test_unsettled_not_archived(self):
+        self.finish_event()
+        self.client.put("/selections/Man Utd", query_string={"outcome": "win"})
+        self.assertEqual(self.archive(), [])
+        self.assertEqual(len(self.query("SELECT * FROM events")), 2)
+
+class TestReplicas(AppTestCase):
+
+    """
+    Tests for serving searches from read replica snapshots
+    """
+
+    def setUp(self):
+        super().setUp()
+        staleness = mock.patch.object(app, "REPLICA_MAX_STALENESS", 60)
+        staleness.start()
+        self.addCleanup(staleness.stop)
+        app.replica_publisher = SnapshotPublisher(app.database_paths(), 60)
+        app.replica_publisher.publish()
+        # written after the snapshot, so only the primary has it
+        self.client.post("/sports", query_string={"name": "tennis"})
+
+    def sport_names(self):
+
+        """
+        Searches for every sport, returning their names and the snapshot
+        age given with them
+        """
+
+        response = self.client.get("/sports", query_string={"fields": "name"})
+        self.assertEqual(response.status_code, 200)
+        return (sorted(sport["name"] for sport in response.get_json()),
+                float(response.headers["X-Snapshot-Age"]))
+
+    def test_search_served_from_replica(self):
+        names, age = self.sport_names()
+        self.assertEqual(names, ["football", "golf"])
+        self.assertTrue(0 <= age < 60)
+
+    def test_stale_snapshot_falls_back_to_primary(self):
+        with mock.patch.object(app, "REPLICA_MAX_STALENESS", 0):
+            names, age = self.sport_names()
+        self.assertEqual(names, ["football", "golf", "tennis"])
+        self.assertEqual(age, 0)
+
+class TestSharding(AppTestCase):
+
+    """
+    Tests for storage split across shards. With 4 shards, football (and
+    hockey) are in shard 2 and golf is in shard 1
+    """
+
+    shard_count = 4
+
+    def shard_query(self, shard, sql):
+        conn = app.get_db_connection(shard)
+        rows = [tuple(row) for row in conn.execute(sql)]
+        conn.close()
+        return rows
+
+    def create_event(self, name, sport):
+        return self.client.post("/events", query_string={
+            "name": name, "sport": sport,
+            "scheduled-start": from_now(days=3)})
+
+    def names(self, path, **params):
+        response = self.client.get(path, query_string=params)
+        return sorted(row["name"] for row in response.get_json())
+
+    def test_records_in_sport_shard(self):
+        self.assertEqual(self.create_event("The Open", "golf").status_code,
+                         201)
+        self.assertEqual(self.shard_query(1, "SELECT name FROM events"),
+                         [("The Open",)])
+        self.assertEqual(
+            sorted(self.shard_query(2, "SELECT name FROM events")),
+            [("Arsenal vs Liverpool",), ("Man Utd vs Chelsea",)])
+        self.assertEqual(self.shard_query(0, "SELECT name FROM events"), [])
+        response = self.client.get("/events", query_string={
+            "sport": "golf", "fields": "name"})
+        self.assertEqual(response.get_json(), [{"name": "The Open"}])
+
+    def test_searches_fan_out(self):
+
+        """
+        Tests that searches combine the results from every shard, and that
+        a search for one sport's events only queries that sport's shard
+        """
+
+        self.create_event("The Open", "golf")
+        self.client.post("/selections", query_string={
+            "name": "Woods", "event": "The Open", "price": "2.0"})
+        self.assertEqual(self.names("/sports"), ["football", "golf"])
+        self.assertEqual(self.names("/events"), [
+            "Arsenal vs Liverpool", "Man Utd vs Chelsea", "The Open"])
+        self.assertEqual(self.names("/selections"),
+                         ["Chelsea", "Man Utd", "Woods"])
+
+        with mock.patch.object(app, "get_db_connection",
+                               wraps=app.get_db_connection) as connect:
+            self.assertEqual(self.names("/events", sport="golf"),
+                             ["The Open"])
+        self.assertEqual([call.args[0] for call in connect.call_args_list],
+                         [1])
+
+    def test_writes_find_shard(self):
+
+        """
+        Tests that events and selections are updated and deleted in the
+        shard that holds them, which is found by name
+        """
+
+        self.create_event("The Open", "golf")
+        self.client.post("/selections", query_string={
+            "name": "Woods", "event": "The Open", "price": "2.0"})
+        response = self.client.put("/selections/Woods", query_string={
+            "price": "2.5"})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get("/selections", query_string={
+            "name": "Woods"})
+        self.assertEqual(response.get_json()[0]["price"], 2.5)
+
+        response = self.client.delete("/selections/Woods")
+        self.assertEqual(response.status_code, 204)
+        response = self.client.delete("/events/The Open")
         self.assertEqual(response.status_code, 204)
+        response = self.client.delete("/events/Arsenal vs Liverpool")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.shard_query(1, "SELECT name FROM events"), [])
+        self.assertEqual(self.shard_query(2, "SELECT name FROM events"),
+                         [("Man Utd vs Chelsea",)])
+        self.assertEqual(self.names("/selections"), ["Chelsea", "Man Utd"])
 
-    def test_delete_selection_empty(self):
-        url = "http://127.0.0.1:5000/events/"
-        response = requests.delete(url, timeout=60)
-        self.assertEqual(response.status_code, 404)
+    def test_batch_across_shards(self):
+
+        """
+        Tests that a batch writing to two shards commits the writes to both,
+        and that a failed write rolls back the writes to every shard
+        """
+
+        response = self.client.post("/batch", json=[
+            {"method": "POST", "path": "/events",
+             "params": {"name": "The Open", "sport": "golf",
+                        "scheduled-start": from_now(days=3)}},
+            {"method": "PUT", "path": "/selections/Chelsea",
+             "params": {"price": "3.50"}}])
+        self.assertTrue(response.get_json()["committed"])
+        response = self.client.post("/batch", json=[
+            {"method": "POST", "path": "/events",
+             "params": {"name": "The Masters", "sport": "golf",
+                        "scheduled-start": from_now(days=3)}},
+            {"method": "PUT", "path": "/selections/Chelsea",
+             "params": {"price": "4.00"}},
+            {"method": "POST", "path": "/selections",
+             "params": {"name": "Spurs", "event": "Spurs vs Arsenal",
+                        "price": 2.0}}])
+        self.assertFalse(response.get_json()["committed"])
+
+        self.assertEqual(self.shard_query(1, "SELECT name FROM events"),
+                         [("The Open",)])
+        response = self.client.get("/selections", query_string={
+            "name": "Chelsea"})
+        self.assertEqual(response.get_json()[0]["price"], 3.5)
+
+    def test_names_unique_across_shards(self):
+        response = self.create_event("Man Utd vs Chelsea", "golf")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.create_event("The Open", "golf").status_code,
+                         201)
+        response = self.client.post("/selections", query_string={
+            "name": "Chelsea", "event": "The Open", "price": "2.0"})
+        self.assertEqual(response.status_code, 409)
+        response = self.client.get("/events", query_string={
+            "name": "Man Utd vs Chelsea"})
+        self.assertEqual(len(response.get_json()), 1)
+
+        response = self.client.put("/events/The Open", query_string={
+            "name": "Arsenal vs Liverpool"})
+        self.assertEqual(response.status_code, 409)
+        response = self.client.put("/events/The Open", query_string={
+            "name": "The Masters"})
+        self.assertEqual(response.status_code, 200)
+        self.client.post("/selections", query_string={
+            "name": "Woods", "event": "The Masters", "price": "2.0"})
+        response = self.client.put("/selections/Woods", query_string={
+            "name": "Man Utd"})
+        self.assertEqual(response.status_code, 409)
+
+    def test_import_names_unique_across_shards(self):
+        def import_lines(*records):
+            body = "".join(json.dumps({"table": table, "row": row}) + "\n"
+                           for table, row in records)
+            return self.client.post("/import", data=body)
+
+        open_event = ("events", {"name": "The Open", "sport": "golf",
+                                 "scheduled_start": from_now(days=3)})
+        response = import_lines(open_event, ("events", {
+            "name": "Man Utd vs Chelsea", "sport": "golf",
+            "scheduled_start": from_now(days=3)}))
+        self.assertEqual(response.status_code, 400)
+        response = import_lines(open_event, ("selections", {
+            "name": "Chelsea", "event": "The Open", "price": 2.0}))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.shard_query(1, "SELECT name FROM events"), [])
+
+        response = import_lines(open_event, ("selections", {
+            "name": "Woods", "event": "The Open", "price": 2.0}))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.shard_query(1, "SELECT name FROM events"),
+                         [("The Open",)])
+
+    def test_no_moves_between_shards(self):
+        response = self.client.put("/sports/golf", query_string={
+            "name": "tennis"})
+        self.assertEqual(response.status_code, 409)
+        response = self.client.put("/events/Man Utd vs Chelsea",
+                                   query_string={"sport": "golf"})
+        self.assertEqual(response.status_code, 409)
+        self.create_event("The Open", "golf")
+        response = self.client.put("/selections/Chelsea", query_string={
+            "event": "The Open"})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(
+            sorted(self.query("SELECT name FROM sports")),
+            [("football",), ("golf",)])
+
+class TestIntegerKeyMigration(unittest.TestCase):
+
+    """
+    Tests converting a database created before events and selections had
+    integer keys
+    """
+
+    def test_migrate_name_keyed_database(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "app.db")
+            conn = sqlite3.connect(path)
+            conn.executescript("""
+                CREATE TABLE sports (name TEXT PRIMARY KEY, slug TEXT,
+                                     active BOOLEAN);
+                CREATE TABLE events (name TEXT PRIMARY KEY, slug TEXT,
+                                     active BOOLEAN, type TEXT, sport TEXT,
+                                     status TEXT, scheduled_start TEXT,
+                                     actual_start TEXT,
+                                     FOREIGN KEY (sport)
+                                        REFERENCES sports (name));
+                CREATE TABLE selections (name TEXT PRIMARY KEY, event TEXT,
+                                         price REAL, active BOOLEAN,
+                                         outcome TEXT,
+                                         FOREIGN KEY (event)
+                                            REFERENCES events (name));
+                INSERT INTO sports VALUES ('football', 'football', 1);
+                INSERT INTO events VALUES ('B vs C', 'b-vs-c', 1, 'Preplay',
+                    'football', 'Pending', '2030-01-01 10:00:00', NULL);
+                INSERT INTO events VALUES ('A vs D', 'a-vs-d', 1, 'Preplay',
+                    'football', 'Pending', '2030-01-02 10:00:00', NULL);
+                INSERT INTO selections VALUES ('A', 'A vs D', 2.5, 1,
+                                               'Unsettled');
+                INSERT INTO selections VALUES ('B', 'B vs C', 1.005, 1,
+                                               'Unsettled');
+            """)
+            conn.close()
+
+            # running it again must leave the converted database alone
+            app.init_database(path)
+            app.init_database(path)
+
+            conn = sqlite3.connect(path)
+            self.assertEqual(
+                conn.execute("SELECT id, name FROM events ORDER BY id").fetchall(),
+                [(1, "B vs C"), (2, "A vs D")])
+            self.assertEqual(
+                conn.execute("""SELECT name, event_id FROM selections
+                                ORDER BY id""").fetchall(),
+                [("A", 2), ("B", 1)])
+            self.assertEqual(
+                conn.execute("""SELECT * FROM selection_rows
+                                ORDER BY name""").fetchall(),
+                [("A", "A vs D", 2.5, 1, "Unsettled"),
+                 ("B", "B vs C", 1.01, 1, "Unsettled")])
+            self.assertEqual(conn.execute("PRAGMA foreign_key_check").fetchall(),
+                             [])
+            conn.close()
+
+class TestCaseMigration(AppTestCase):
+
+    """
+    Tests capitalizing the statuses, types and outcomes stored by versions
+    that kept them as the client sent them
+    """
+
+    def test_legacy_case_normalized(self):
+        for path in app.database_paths():
+            conn = sqlite3.connect(path)
+            conn.execute("""UPDATE events SET type = 'inplay',
+                                              status = 'started'
+                            WHERE name = 'Man Utd vs Chelsea'""")
+            conn.execute("""UPDATE selections SET outcome = 'win'
+                            WHERE name = 'Chelsea'""")
+            conn.execute("PRAGMA user_version = 2")
+            conn.commit()
+            conn.close()
+        app.init_db()
+
+        selections = self.client.get("/selections", query_string={
+            "outcome": "win", "fields": "name,outcome"}).get_json()
+        self.assertEqual(selections, [{"name": "Chelsea", "outcome": "Win"}])
+        events = self.client.get("/events", query_string={
+            "type": "inplay", "fields": "name,type,status"}).get_json()
+        self.assertEqual(events, [{"name": "Man Utd vs Chelsea",
+                                   "type": "Inplay", "status": "Started"}])
+        summary = self.client.get("/summary").get_json()
+        outcomes = {event["name"]: event["outcomes"]
+                    for event in summary["events"]}
+        self.assertEqual(outcomes["Man Utd vs Chelsea"],
+                         {"Win": 1, "Lose": 0, "Void": 0, "Unsettled": 1})
+
+class TestSchemaVersion(unittest.TestCase):
+
+    """
+    Tests skipping the initialization of databases that are up to date
+    """
+
+    def test_current_database_skipped(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "app.db")
+            app.init_database(path)
+            conn = sqlite3.connect(path)
+            self.assertEqual(
+                conn.execute("PRAGMA user_version").fetchone()[0],
+                app.SCHEMA_VERSION)
+            conn.execute("DROP INDEX selections_price_cents")
+            conn.commit()
+
+            def has_index():
+                return conn.execute(
+                    """SELECT 1 FROM sqlite_master
+                       WHERE name = 'selections_price_cents'""").fetchone()
+
+            app.init_database(path)
+            self.assertIsNone(has_index())
+            conn.execute("PRAGMA user_version = 0")
+            conn.commit()
+            app.init_database(path)
+            self.assertIsNotNone(has_index())
+            conn.close()
+
+class TestPriceCentsMigration(unittest.TestCase):
+
+    """
+    Tests converting a database created before prices were stored in cents
+    """
+
+    def test_migrate_real_prices(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "app.db")
+            conn = sqlite3.connect(path)
+            conn.executescript(f"""
+                CREATE TABLE sports (name TEXT PRIMARY KEY, slug TEXT,
+                                     active BOOLEAN);
+                {app.EVENTS_TABLE.format(table="events")}
+                CREATE TABLE selections (id INTEGER PRIMARY KEY,
+                                         name TEXT NOT NULL UNIQUE,
+                                         event_id INTEGER NOT NULL,
+                                         price REAL, active BOOLEAN,
+                                         outcome TEXT);
+                CREATE VIEW selection_rows AS
+                    SELECT selections.name, events.name AS event,
+                           selections.price, selections.active,
+                           selections.outcome
+                    FROM selections JOIN events
+                        ON events.id = selections.event_id;
+                INSERT INTO sports VALUES ('football', 'football', 1);
+                INSERT INTO events (name, sport) VALUES ('A vs B', 'football');
+                INSERT INTO selections (name, event_id, price, active, outcome)
+                    VALUES ('A', 1, 2.67, 1, 'Unsettled'),
+                           ('B', 1, 1.1, 1, 'Unsettled'),
+                           ('C', 1, 1.005, 1, 'Unsettled');
+            """)
+            conn.close()
+
+            app.init_database(path)
+            app.init_database(path)
+
+            conn = sqlite3.connect(path)
+            self.assertEqual(
+                conn.execute("""SELECT name, price_cents FROM selections
+                                ORDER BY id""").fetchall(),
+                [("A", 267), ("B", 110), ("C", 101)])
+            self.assertEqual(
+                conn.execute("""SELECT name, price FROM selection_rows
+                                ORDER BY name""").fetchall(),
+                [("A", 2.67), ("B", 1.1), ("C", 1.01)])
+            conn.close()
 
 if __name__ == "__main__":
-    DATABASE = "app.db"
-    conn = sqlite3.connect(DATABASE)
-    conn.execute("PRAGMA foreign_keys = ON") # ensure foreign keys are enabled
-    cursor = conn.cursor()
-    
-    # make sure to drop tables and recreate them so tests will be consistent
-    cursor.execute("DROP TABLE IF EXISTS selections")
-    cursor.execute("DROP TABLE IF EXISTS events")
-    cursor.execute("DROP TABLE IF EXISTS sports")
-    
-    app.init_db()
-
-    tests = TestCases()
-    tests.test_create_sport_with_required_params()
-    tests.test_create_sport_with_all_params()
-    tests.test_create_sport_empty()
-    tests.test_create_sport_missing_required_params()
-    tests.test_create_event_with_required_params()
-    tests.test_create_event_with_all_params()
-    tests.test_create_event_empty()
-    tests.test_create_event_missing_required_params()
-    tests.test_create_selection_with_required_params()
-    tests.test_create_selection_with_all_params()
-    tests.test_create_selection_empty()
-    tests.test_create_selection_missing_required_params()
-    tests.test_search_sports_no_params()
-    tests.test_search_sports_one_param()
-    tests.test_search_sports_min_events()
-    tests.test_search_sports_multiple_params()
-    tests.test_search_sports_name_match()
-    tests.test_search_sports_no_match()
-    tests.test_search_events_no_params()
-    tests.test_search_events_one_param()
-    tests.test_search_events_timeframe()
-    tests.test_search_events_multiple_params()
-    tests.test_search_events_min_selections()
-    tests.test_search_events_invalid_param()
-    tests.test_search_events_name_match()
-    tests.test_search_selections_no_match()
-    tests.test_search_selections_no_params()
-    tests.test_search_selections_one_param()
-    tests.test_search_selections_multiple_params()
-    tests.test_search_selections_min_price()
-    tests.test_search_selections_max_price()
-    tests.test_search_selections_invalid_param()
-    tests.test_search_selections_name_match()
-    tests.test_search_selections_no_match()
-    tests.test_update_sport_no_params()
-    tests.test_update_sport_one_param()
-    tests.test_update_sport_multiple_params()
-    tests.test_update_sport_invalid_params()
-    tests.test_update_event_no_params()
-    tests.test_update_event_one_param()
-    tests.test_update_event_multiple_params()
-    tests.test_update_event_invalid_params()
-    tests.test_update_selection_no_params()
-    tests.test_update_selection_one_param()
-    tests.test_update_selection_multiple_params()
-    tests.test_update_selection_invalid_params()
-    tests.test_delete_sport_existing()
-    tests.test_delete_sport_nonexistent()
-    tests.test_delete_sport_empty()
-    tests.test_delete_event_existing()
-    tests.test_delete_event_nonexistent()
-    tests.test_delete_event_empty()
-    tests.test_delete_selection_existing()
-    tests.test_delete_selection_nonexistent()
-    tests.test_delete_selection_empty()
\ No newline at end of file
+    unittest.main()
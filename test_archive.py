@@ -0,0 +1,99 @@
+"""
+Unit tests for archiving finished events
+
+Tests include:
+Testing that only finished events older than the cutoff are archived, with
+all of their selections
+Testing that an ended event isn't archived while any selection is unsettled
+Testing that names and ids used again after archiving are archived as new
+records
+"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+import app
+import archive
+
+class TestArchive(unittest.TestCase):
+
+    """
+    A test cases class to hold all the unit tests for archiving
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, "app.db")
+        app.init_database(path)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("INSERT INTO sports VALUES ('football', 'football', 1)")
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp.cleanup()
+
+    def add_event(self, name, status, start, outcomes=()):
+        event_id = self.conn.execute(
+            """INSERT INTO events (name, sport, active, status, scheduled_start)
+               VALUES (?, 'football', 0, ?, ?)""",
+            (name, status, start)).lastrowid
+        self.conn.executemany(
+            """INSERT INTO selections (name, event_id, price_cents, active,
+                                       outcome)
+               VALUES (?, ?, 200, 0, ?)""",
+            [(f"{name} {i}", event_id, outcome)
+             for i, outcome in enumerate(outcomes)])
+        self.conn.commit()
+        return event_id
+
+    def archived(self):
+        return self.conn.execute(
+            """SELECT archived_events.name, archived_selections.name,
+                      archived_selections.outcome
+               FROM archived_events LEFT JOIN archived_selections
+                   ON archived_selections.event_id = archived_events.id
+               ORDER BY archived_events.id, archived_selections.id""").fetchall()
+
+    def test_finished_events_archived(self):
+        self.add_event("old", "Ended", "2020-01-01 10:00:00", ["Win", "Lose"])
+        self.add_event("cancelled", "Cancelled", "2020-01-02 10:00:00",
+                       ["Unsettled"])
+        self.add_event("recent", "Ended", "2020-03-01 10:00:00", ["Void"])
+        self.add_event("pending", "Pending", "2020-01-01 10:00:00")
+
+        names = archive.archive(self.conn, "2020-02-01 00:00:00")
+        self.assertEqual(names, ["old", "cancelled"])
+        self.assertEqual(self.archived(),
+                         [("old", "old 0", "Win"), ("old", "old 1", "Lose"),
+                          ("cancelled", "cancelled 0", "Unsettled")])
+        self.assertEqual(
+            self.conn.execute("SELECT name FROM events ORDER BY id").fetchall(),
+            [("recent",), ("pending",)])
+        self.assertEqual(
+            self.conn.execute("SELECT name FROM selections").fetchall(),
+            [("recent 0",)])
+
+    def test_unsettled_event_kept(self):
+        self.add_event("old", "Ended", "2020-01-01 10:00:00",
+                       ["Win", "Unsettled"])
+        self.add_event("null", "Ended", "2020-01-01 10:00:00", [None])
+        self.assertEqual(archive.archive(self.conn, "2020-02-01 00:00:00"), [])
+        self.assertEqual(self.archived(), [])
+
+    def test_names_and_ids_used_again(self):
+        first = self.add_event("final", "Ended", "2020-01-01 10:00:00", ["Win"])
+        archive.archive(self.conn, "2020-02-01 00:00:00")
+        # the id of the last event is handed out again once it has gone
+        second = self.add_event("final", "Ended", "2021-01-01 10:00:00",
+                                ["Lose"])
+        self.assertEqual(first, second)
+        archive.archive(self.conn, "2021-02-01 00:00:00")
+        self.assertEqual(self.archived(), [("final", "final 0", "Win"),
+                                           ("final", "final 0", "Lose")])
+        self.assertEqual(self.conn.execute("PRAGMA foreign_key_check").fetchall(),
+                         [])
+
+if __name__ == "__main__":
+    unittest.main()
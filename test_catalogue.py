@@ -0,0 +1,246 @@
+"""
+Unit tests for the bulk catalogue import and export
+
+Tests include:
+Testing that an NDJSON export can be imported into an empty database
+Testing that a CSV export can be imported into an empty database
+Testing that indexes are rebuilt after an import
+Testing that a failed import is rolled back completely
+Testing that selections are exported with their event's name, not its id
+Testing that queued events are inserted before the selections that need them
+Testing that imported values are stored in the same form as the API stores
+Testing that a row with an invalid value is rejected
+Testing that a line that isn't a record object is rejected
+Testing that prices are rounded to cents the same way as the API rounds them
+"""
+
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+import catalogue
+
+SCHEMA = ["""CREATE TABLE sports (name TEXT PRIMARY KEY, slug TEXT,
+                                  active BOOLEAN)""",
+          """CREATE TABLE events (id INTEGER PRIMARY KEY,
+                                  name TEXT NOT NULL UNIQUE, sport TEXT,
+                                  status TEXT, scheduled_start TEXT,
+                                  FOREIGN KEY (sport) REFERENCES sports (name))""",
+          """CREATE TABLE selections (id INTEGER PRIMARY KEY,
+                                      name TEXT NOT NULL UNIQUE,
+                                      event_id INTEGER NOT NULL,
+                                      price_cents INTEGER,
+                                      FOREIGN KEY (event_id) REFERENCES events (id))""",
+          """CREATE VIEW event_rows AS
+             SELECT name, sport, status, scheduled_start FROM events""",
+          """CREATE VIEW selection_rows AS
+             SELECT selections.name, events.name AS event,
+                    selections.price_cents / 100.0 AS price
+             FROM selections JOIN events ON events.id = selections.event_id""",
+          "CREATE INDEX events_scheduled_start ON events (scheduled_start)"]
+
+class TestCatalogue(unittest.TestCase):
+
+    """
+    A test cases class to hold all the unit tests for the catalogue import
+    and export
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = self.create_database("source.db")
+        self.source.execute("INSERT INTO sports VALUES ('football', 'football', 1)")
+        self.source.executemany(
+            "INSERT INTO events (name, sport, scheduled_start) "
+            "VALUES (?, 'football', ?)",
+                                [("Man Utd vs Chelsea", "2030-06-17 16:00:00"),
+                                 ("Arsenal vs Liverpool", None)])
+        self.source.executemany(
+            "INSERT INTO selections (name, event_id, price_cents) "
+            "VALUES (?, 1, ?)",
+            [("Man Utd", 300), ("Chelsea, London", 250)])
+        self.source.commit()
+
+    def tearDown(self):
+        self.source.close()
+        self.tmp.cleanup()
+
+    def create_database(self, name):
+
+        """
+        Creates an empty database with the test schema
+        """
+
+        conn = sqlite3.connect(os.path.join(self.tmp.name, name))
+        conn.execute("PRAGMA foreign_keys = ON")
+        for sql in SCHEMA:
+            conn.execute(sql)
+        conn.commit()
+        return conn
+
+    def importer(self, name):
+
+        """
+        Gets an importer for a single, unsharded database
+        """
+
+        def connect(_):
+            conn = sqlite3.connect(os.path.join(self.tmp.name, name))
+            conn.execute("PRAGMA foreign_keys = ON")
+            return conn
+
+        return catalogue.CatalogueImporter(connect, [None],
+                                           lambda table, row: None)
+
+    def dump(self, conn):
+
+        """
+        Gets every row of every table, with events and selections as they
+        are exported, for comparing databases
+        """
+
+        return {table: sorted(conn.execute(
+                    f"SELECT * FROM {catalogue.source(conn, table)}"
+                ).fetchall(), key=repr)
+                for table in catalogue.TABLES}
+
+    def test_ndjson_round_trip(self):
+        exported = "".join(catalogue.export_ndjson([self.source]))
+        target = self.create_database("target.db")
+        counts = catalogue.import_records(
+            self.importer("target.db"),
+            catalogue.read_ndjson(io.StringIO(exported)))
+        self.assertEqual(counts, {"sports": 1, "events": 2, "selections": 2})
+        self.assertEqual(self.dump(target), self.dump(self.source))
+        # the index dropped for the load is rebuilt afterwards
+        indexes = target.execute("""SELECT name FROM sqlite_master
+                                    WHERE sql LIKE 'CREATE INDEX%'""").fetchall()
+        self.assertEqual(indexes, [("events_scheduled_start",)])
+        target.close()
+
+    def test_csv_round_trip(self):
+        target = self.create_database("target.db")
+
+        def records():
+            for table in catalogue.TABLES:
+                exported = "".join(catalogue.export_csv([self.source], table))
+                yield from catalogue.table_records(
+                    table, catalogue.read_csv(io.StringIO(exported)))
+
+        catalogue.import_records(self.importer("target.db"), records())
+        self.assertEqual(self.dump(target), self.dump(self.source))
+        target.close()
+
+    def test_failed_import_rolled_back(self):
+        target = self.create_database("target.db")
+        records = [("sports", {"name": "golf", "slug": "golf", "active": 0}),
+                   ("events", {"name": "The Open", "sport": "tennis",
+                               "scheduled_start": None})]
+        with self.assertRaises(sqlite3.IntegrityError):
+            catalogue.import_records(self.importer("target.db"), records)
+        self.assertEqual(target.execute("SELECT * FROM sports").fetchall(), [])
+        target.close()
+
+    def test_unknown_column_rejected(self):
+        self.create_database("target.db").close()
+        records = [("sports", {"name": "golf", "colour": "green"})]
+        with self.assertRaises(ValueError):
+            catalogue.import_records(self.importer("target.db"), records)
+
+    def test_malformed_lines_rejected(self):
+        self.create_database("target.db").close()
+        for line in ['[1, 2]', '"x"', '{"table": "sports"}',
+                     '{"table": "sports", "row": [1]}']:
+            with self.assertRaises(ValueError):
+                catalogue.import_records(
+                    self.importer("target.db"),
+                    catalogue.read_ndjson(io.StringIO(line + "\n")))
+        with self.assertRaises(ValueError):
+            catalogue.import_records(self.importer("target.db"),
+                                     [("sports", ["golf"])])
+
+    def test_selections_exported_by_event_name(self):
+        exported = "".join(catalogue.export_ndjson([self.source]))
+        selection = json.loads(exported.splitlines()[-1])
+        self.assertEqual(selection, {"table": "selections",
+                                     "row": {"name": "Chelsea, London",
+                                             "event": "Man Utd vs Chelsea",
+                                             "price": 2.5}})
+
+    def test_queued_events_inserted_first(self):
+        target = self.create_database("target.db")
+        records = [("sports", {"name": "golf", "slug": "golf", "active": 1}),
+                   ("events", {"name": "The Open", "sport": "golf",
+                               "scheduled_start": None}),
+                   ("selections", {"name": "Rory", "event": "The Open",
+                                   "price": 4.0}),
+                   ("selections", {"name": "Tiger", "event": "The Open",
+                                   "price": 5.0})]
+        # the selections fill a batch while the event is still queued
+        with mock.patch.object(catalogue, "BATCH_SIZE", 2):
+            catalogue.import_records(self.importer("target.db"), records)
+        self.assertEqual(target.execute("""SELECT * FROM selection_rows
+                                           ORDER BY name""").fetchall(),
+                         [("Rory", "The Open", 4.0),
+                          ("Tiger", "The Open", 5.0)])
+        target.close()
+
+    def test_values_normalized(self):
+        target = self.create_database("target.db")
+        records = [("sports", {"name": "golf", "slug": "golf",
+                               "active": "true"}),
+                   ("events", {"name": "The Open", "sport": "golf",
+                               "status": "pending",
+                               "scheduled_start": "2030-07-16T09:30:00+02:00"}),
+                   ("selections", {"name": "Rory", "event": "The Open",
+                                   "price": "2.675"})]
+        catalogue.import_records(self.importer("target.db"), records)
+        self.assertEqual(target.execute("SELECT * FROM sports").fetchall(),
+                         [("golf", "golf", 1)])
+        self.assertEqual(target.execute("SELECT * FROM event_rows").fetchall(),
+                         [("The Open", "golf", "Pending",
+                           "2030-07-16 07:30:00")])
+        self.assertEqual(target.execute("""SELECT price_cents
+                                           FROM selections""").fetchall(),
+                         [(268,)])
+        target.close()
+
+    def test_invalid_value_rejected(self):
+        target = self.create_database("target.db")
+        records = [("sports", {"name": "golf", "slug": "golf", "active": 1}),
+                   ("events", {"name": "The Open", "sport": "golf",
+                               "status": "postponed",
+                               "scheduled_start": None})]
+        with self.assertRaisesRegex(ValueError, "invalid status for events"):
+            catalogue.import_records(self.importer("target.db"), records)
+        self.assertEqual(target.execute("SELECT * FROM sports").fetchall(), [])
+        target.close()
+
+    def test_prices_rounded_half_up(self):
+        target = self.create_database("target.db")
+        exported = json.dumps({"table": "selections",
+                               "row": {"name": "Rory", "event": "The Open",
+                                       "price": 1.005}})
+        records = [("sports", {"name": "golf", "slug": "golf", "active": 1}),
+                   ("events", {"name": "The Open", "sport": "golf",
+                               "scheduled_start": None}),
+                   *catalogue.read_ndjson(io.StringIO(exported))]
+        catalogue.import_records(self.importer("target.db"), records)
+        # rounding the float 1.005 * 100 in SQL would give 100
+        self.assertEqual(target.execute("""SELECT price_cents
+                                           FROM selections""").fetchall(),
+                         [(101,)])
+        target.close()
+
+    def test_unknown_event_rejected(self):
+        self.create_database("target.db").close()
+        records = [("selections", {"name": "Rory", "event": "The Open",
+                                   "price": 4.0})]
+        with self.assertRaises(sqlite3.IntegrityError):
+            catalogue.import_records(self.importer("target.db"), records)
+
+if __name__ == "__main__":
+    unittest.main()
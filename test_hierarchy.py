@@ -0,0 +1,87 @@
+"""
+Unit tests for the catalogue hierarchy
+
+Tests include:
+Testing that the parent array and name mappings follow the table order
+Testing the stats of a small catalogue, including empty events and sports
+Testing that legacy text active flags are read correctly
+Testing an empty catalogue
+"""
+
+import unittest
+from hierarchy import Hierarchy
+
+SPORTS = [("football", None, 1), ("golf", None, 0)]
+EVENTS = [("Man Utd vs Chelsea", "football", 1),
+          ("Arsenal vs Liverpool", "football", "false")]
+SELECTIONS = [("Man Utd", "Man Utd vs Chelsea", 1),
+              ("Chelsea", "Man Utd vs Chelsea", 0),
+              ("Draw", "Man Utd vs Chelsea", "true")]
+
+class TestHierarchy(unittest.TestCase):
+
+    """
+    A test cases class to hold all the unit tests for Hierarchy
+    """
+
+    def test_parent_array(self):
+
+        """
+        Tests that sports come first, then events, then selections, each
+        pointing at the id of its parent
+        """
+
+        tree = Hierarchy(SPORTS, EVENTS, SELECTIONS)
+        self.assertEqual(tree.parents.tolist(), [-1, -1, 0, 0, 2, 2, 2])
+        self.assertEqual(tree.ranges, {"sports": (0, 2), "events": (2, 4),
+                                       "selections": (4, 7)})
+        self.assertEqual(tree.ids["events"]["Arsenal vs Liverpool"], 3)
+        self.assertEqual(tree.names[4], "Man Utd")
+        self.assertEqual(tree.active.tolist(),
+                         [True, False, True, False, True, False, True])
+
+    def test_stats(self):
+
+        """
+        Tests the stats of a small catalogue
+        """
+
+        stats = Hierarchy(SPORTS, EVENTS, SELECTIONS).stats()
+        self.assertEqual(stats["nodes"], {"sports": 2, "events": 2,
+                                          "selections": 3})
+        self.assertEqual(stats["internal_nodes"], 2)
+        self.assertEqual(stats["active_internal_nodes"], 2)
+        self.assertEqual(stats["leaves"], 5)
+        self.assertEqual(stats["leaves_per_event"],
+                         {"min": 0, "max": 3, "mean": 1.5})
+        self.assertEqual(stats["events_per_sport"],
+                         {"min": 0, "max": 2, "mean": 1.0})
+        self.assertEqual(stats["empty_events"], ["Arsenal vs Liverpool"])
+        self.assertEqual(stats["empty_sports"], ["golf"])
+
+    def test_inactive_children(self):
+
+        """
+        Tests that an active node only counts as an active internal node
+        when one of its children is active
+        """
+
+        stats = Hierarchy(SPORTS, EVENTS[1:], []).stats()
+        self.assertEqual(stats["internal_nodes"], 1)
+        self.assertEqual(stats["active_internal_nodes"], 0)
+
+    def test_empty(self):
+
+        """
+        Tests that an empty catalogue has no nodes
+        """
+
+        tree = Hierarchy([], [], [])
+        stats = tree.stats()
+        self.assertEqual(stats["internal_nodes"], 0)
+        self.assertEqual(stats["leaves_per_event"],
+                         {"min": 0, "max": 0, "mean": 0.0})
+        self.assertEqual(tree.to_dict()["parents"], [])
+
+if __name__ == "__main__":
+    unittest.main()
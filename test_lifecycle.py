@@ -0,0 +1,90 @@
+"""
+Unit tests for the event lifecycle
+
+Tests include:
+Testing the allowed and disallowed status transitions
+Testing the columns changed by each transition
+Testing that bulk transitions only change events allowed to make them
+Testing that bulk transitions deactivate sports with no active events left
+"""
+
+import sqlite3
+import unittest
+import lifecycle
+
+NOW = "2030-01-01 12:00:00"
+
+class TestLifecycle(unittest.TestCase):
+
+    """
+    A test cases class to hold all the unit tests for the event lifecycle
+    """
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("""CREATE TABLE sports (name TEXT PRIMARY KEY,
+                                                  active BOOLEAN)""")
+        self.conn.execute("""CREATE TABLE events (name TEXT PRIMARY KEY,
+                                active BOOLEAN, type TEXT, sport TEXT,
+                                status TEXT, scheduled_start TEXT,
+                                actual_start TEXT)""")
+        self.conn.executemany("INSERT INTO sports VALUES (?, 1)",
+                              [("football",), ("golf",)])
+        self.conn.executemany(
+            "INSERT INTO events VALUES (?, 1, 'Preplay', ?, ?, ?, NULL)", [
+                ("Man Utd vs Chelsea", "football", "Pending",
+                 "2030-01-01 11:00:00"),
+                ("Arsenal vs Liverpool", "football", "Ended",
+                 "2030-01-01 10:00:00"),
+                ("The Open", "golf", "Pending", "2030-01-01 11:30:00"),
+                ("The Masters", "golf", "Pending", "2030-02-01 11:30:00"),
+            ])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_allowed_transitions(self):
+        self.assertEqual(lifecycle.transition("Pending", "started", NOW),
+                         {"status": "Started", "actual_start": NOW,
+                          "type": "Inplay"})
+        self.assertEqual(lifecycle.transition("started", "Ended", NOW),
+                         {"status": "Ended", "active": 0})
+        self.assertEqual(lifecycle.transition("Pending", "cancelled", NOW),
+                         {"status": "Cancelled", "active": 0})
+
+    def test_same_status_changes_nothing(self):
+        self.assertEqual(lifecycle.transition("Started", "started", NOW), {})
+
+    def test_disallowed_transitions(self):
+        for current, new in [("Ended", "Started"), ("Cancelled", "Pending"),
+                             ("Started", "Pending"), ("Pending", "Ended")]:
+            with self.assertRaises(lifecycle.InvalidTransition):
+                lifecycle.transition(current, new, NOW)
+
+    def test_invalid_status(self):
+        with self.assertRaises(ValueError):
+            lifecycle.normalize_status("postponed")
+
+    def test_bulk_start_due_events(self):
+        cur = self.conn.cursor()
+        started = lifecycle.transition_events(cur, "Started", NOW,
+                                              "scheduled_start <= ?", (NOW,))
+        self.assertEqual(sorted(started), ["Man Utd vs Chelsea", "The Open"])
+        rows = cur.execute("""SELECT status, type, actual_start FROM events
+                              WHERE name = 'The Open'""").fetchall()
+        self.assertEqual(rows, [("Started", "Inplay", NOW)])
+        # the ended event is left alone, as it can't be started again
+        rows = cur.execute("""SELECT status FROM events
+                              WHERE name = 'Arsenal vs Liverpool'""").fetchall()
+        self.assertEqual(rows, [("Ended",)])
+
+    def test_bulk_cancel_deactivates_sports(self):
+        cur = self.conn.cursor()
+        cancelled = lifecycle.transition_events(cur, "Cancelled", NOW,
+                                                "sport = ?", ("golf",))
+        self.assertEqual(sorted(cancelled), ["The Masters", "The Open"])
+        active = dict(cur.execute("SELECT name, active FROM sports"))
+        self.assertEqual(active, {"football": 1, "golf": 0})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+Unit tests for parsing query parameters
+
+Tests include:
+Testing that each parser converts valid values and rejects invalid ones
+Testing that a list of fields is checked and has repeats removed
+Testing that ISO 8601 timestamps, with and without offsets, are parsed to
+UTC in the same way as dateutil, and that other forms fall back to it
+Testing that a schema returns typed values in the order given
+Testing that a schema reports unknown, invalid and missing parameters
+together
+"""
+
+import unittest
+from datetime import datetime, timezone
+from dateutil.parser import parse
+from params import (Field, InvalidParameter, Schema, cents, choice,
+                    field_list, flag, integer, number, number_between,
+                    parse_datetime)
+
+class TestParsers(unittest.TestCase):
+
+    """
+    A test cases class to hold the unit tests for each parser
+    """
+
+    def test_flag(self):
+        for value, expected in [("true", True), ("TRUE", True), ("1", True),
+                                ("false", False), ("False", False),
+                                ("0", False)]:
+            self.assertIs(flag(value), expected)
+        for value in ["yes", "", "2"]:
+            with self.assertRaises(ValueError):
+                flag(value)
+
+    def test_numbers(self):
+        self.assertEqual(integer("3"), 3)
+        self.assertEqual(number("2.5"), 2.5)
+        self.assertEqual(cents("2.499"), 250)
+        self.assertEqual(cents("2.675"), 268)
+        self.assertEqual(cents("3"), 300)
+        hours = number_between(0, 48)
+        self.assertEqual(hours("48"), 48)
+        for parser, value in [(integer, "3.5"), (number, "abc"),
+                              (number, "nan"), (cents, "inf"),
+                              (hours, "-1"), (hours, "1e9")]:
+            with self.assertRaises(ValueError):
+                parser(value)
+
+    def test_choice(self):
+        parse_outcome = choice("Win", "Lose")
+        self.assertEqual(parse_outcome("win"), "Win")
+        self.assertEqual(parse_outcome("LOSE"), "Lose")
+        with self.assertRaises(ValueError):
+            parse_outcome("draw")
+
+    def test_field_list(self):
+        parse_fields = field_list("name", "price", "scheduled_start")
+        self.assertEqual(parse_fields("price,name, price"), ["price", "name"])
+        self.assertEqual(parse_fields("scheduled-start"), ["scheduled_start"])
+        for value in ["", "name,", "name,colour"]:
+            with self.assertRaises(ValueError):
+                parse_fields(value)
+
+    def test_iso_timestamps_match_dateutil(self):
+
+        """
+        Tests that timestamps parsed without dateutil give the same time as
+        dateutil does
+        """
+
+        for value in ["2030-06-17 18:00:00", "2030-06-17T18:00",
+                      "2030-06-17 18:00:00+02:00", "2030-06-17T18:00:00Z",
+                      "2030-06-17 18:00:00.250-0530",
+                      "2030-12-31 23:59:59 +01:00"]:
+            self.assertEqual(parse_datetime(value),
+                             parse(value).astimezone(timezone.utc))
+
+    def test_other_timestamps_fall_back(self):
+        self.assertEqual(parse_datetime("17 June 2030 18:00 +00:00"),
+                         datetime(2030, 6, 17, 18, tzinfo=timezone.utc))
+        for value in ["tomorrow", "2030-02-30 18:00:00"]:
+            with self.assertRaises(ValueError):
+                parse_datetime(value)
+
+class TestSchema(unittest.TestCase):
+
+    """
+    A test cases class to hold the unit tests for Schema
+    """
+
+    schema = Schema({"name": Field(required=True), "active": Field(flag),
+                     "min-events": Field(integer)})
+
+    def test_typed_values(self):
+        values = self.schema.parse({"min-events": "2", "name": "golf",
+                                    "active": "false"})
+        self.assertEqual(list(values.items()),
+                         [("min-events", 2), ("name", "golf"),
+                          ("active", False)])
+
+    def test_problems_reported_together(self):
+        with self.assertRaises(InvalidParameter) as raised:
+            self.schema.parse({"active": "maybe", "colour": "red"})
+        message = str(raised.exception)
+        for problem in ["active must be either true or false",
+                        "unknown parameter: colour", "name is required"]:
+            self.assertIn(problem, message)
+
+    def test_empty_required_value(self):
+        with self.assertRaises(InvalidParameter):
+            self.schema.parse({"name": ""})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+Unit tests for the rate limiter and the admission control for full scans
+
+Tests include:
+Testing that a client gets its burst and then a token at the given rate
+Testing that each key has a bucket of its own
+Testing that buckets which have filled up again are dropped once there are
+too many
+Testing that callers over the limit wait for a slot, and are turned away
+when the queue is full or no slot frees up in time
+"""
+
+import threading
+import unittest
+from ratelimit import AdmissionControl, Overloaded, RateLimiter
+
+class Clock:
+
+    """
+    A clock for the rate limiter that only moves when told to
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestRateLimiter(unittest.TestCase):
+
+    """
+    A test cases class to hold all the unit tests for RateLimiter
+    """
+
+    def setUp(self):
+        self.clock = Clock()
+        self.limiter = RateLimiter(2, 3, max_keys=2, clock=self.clock)
+
+    def test_burst_then_rate(self):
+        for _ in range(3):
+            self.limiter.check("a")
+        with self.assertRaises(Overloaded) as raised:
+            self.limiter.check("a")
+        self.assertEqual((raised.exception.status, raised.exception.retry_after),
+                         (429, 0.5))
+        self.clock.now = 0.5
+        self.limiter.check("a")
+        self.assertRaises(Overloaded, self.limiter.check, "a")
+        self.assertEqual(self.limiter.stats(),
+                         {"allowed": 4, "limited": 2, "keys": 1})
+
+    def test_keys_separate(self):
+        for _ in range(3):
+            self.limiter.check("a")
+        self.assertRaises(Overloaded, self.limiter.check, "a")
+        self.limiter.check("b")
+
+    def test_full_buckets_dropped(self):
+        self.limiter.check("a")
+        self.clock.now = 0.4
+        for _ in range(3):
+            self.limiter.check("b")
+        self.clock.now = 0.5
+        # a has filled up again, but b hasn't
+        self.limiter.check("c")
+        self.assertEqual(self.limiter.stats()["keys"], 2)
+        self.assertRaises(Overloaded, self.limiter.check, "b")
+
+class TestAdmissionControl(unittest.TestCase):
+
+    """
+    A test cases class to hold all the unit tests for AdmissionControl
+    """
+
+    def test_queue_and_reject(self):
+        control = AdmissionControl(1, 1, 5)
+        running = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def blocking():
+            running.set()
+            release.wait(5)
+            return "first"
+
+        first = threading.Thread(
+            target=lambda: results.append(control.run(blocking)))
+        first.start()
+        running.wait(5)
+        second = threading.Thread(
+            target=lambda: results.append(control.run(lambda: "second")))
+        second.start()
+        while control.stats()["waiting"] == 0:
+            threading.Event().wait(0.01)
+
+        # the one slot is taken and the queue is full
+        with self.assertRaises(Overloaded) as raised:
+            control.run(lambda: "third")
+        self.assertEqual(raised.exception.status, 503)
+
+        release.set()
+        first.join(5)
+        second.join(5)
+        self.assertEqual(results, ["first", "second"])
+        self.assertEqual(control.stats(),
+                         {"limit": 1, "running": 0, "waiting": 0,
+                          "admitted": 2, "queued": 1, "rejected": 1})
+
+    def test_wait_times_out(self):
+        control = AdmissionControl(0, 1, 0.05)
+        self.assertRaises(Overloaded, control.run, lambda: None)
+        self.assertEqual(control.stats()["rejected"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+"""
+Unit tests for the read replica snapshots used by searches
+
+Tests include:
+Testing that a published snapshot contains the data from the primary
+Testing that writes after a snapshot only appear in the next snapshot
+Testing that the snapshot age is reported once every database is published
+Testing that reads are spread across the copies
+Testing that a snapshot's age is counted from the start of its copy
+Testing that publishing carries on after a snapshot fails
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+import replica
+from replica import SnapshotPublisher, replica_path
+
+class TestSnapshotPublisher(unittest.TestCase):
+
+    """
+    A test cases class to hold all the unit tests for SnapshotPublisher
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "app.db")
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE sports (name TEXT PRIMARY KEY)")
+        conn.execute("INSERT INTO sports VALUES ('football')")
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read_sports(self, path):
+
+        """
+        Gets the names of every sport in the given database file
+        """
+
+        conn = sqlite3.connect(path)
+        names = [row[0] for row in conn.execute("SELECT name FROM sports")]
+        conn.close()
+        return names
+
+    def test_publish_snapshot(self):
+
+        """
+        Tests that publishing creates every copy of the replica, each
+        holding the data from the primary database
+        """
+
+        publisher = SnapshotPublisher([self.path], 60, copies=2)
+        self.assertIsNone(publisher.age())
+        publisher.publish()
+        for copy in range(2):
+            self.assertEqual(self.read_sports(replica_path(self.path, copy)),
+                             ["football"])
+        self.assertLess(publisher.age(), 60)
+
+    def test_writes_appear_in_next_snapshot(self):
+
+        """
+        Tests that a write to the primary isn't seen in the replica until
+        the next snapshot is published
+        """
+
+        publisher = SnapshotPublisher([self.path], 60)
+        publisher.publish()
+        conn = sqlite3.connect(self.path)
+        conn.execute("INSERT INTO sports VALUES ('golf')")
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.read_sports(replica_path(self.path, 0)),
+                         ["football"])
+        publisher.publish()
+        self.assertEqual(sorted(self.read_sports(replica_path(self.path, 0))),
+                         ["football", "golf"])
+
+    def test_reads_spread_across_copies(self):
+
+        """
+        Tests that replica_for hands out each copy in turn
+        """
+
+        publisher = SnapshotPublisher([self.path], 60, copies=3)
+        chosen = [publisher.replica_for(self.path) for _ in range(6)]
+        self.assertEqual(len(set(chosen)), 3)
+        self.assertEqual(chosen[:3], chosen[3:])
+
+    def test_age_counted_from_start_of_copy(self):
+
+        """
+        Tests that a snapshot that takes a while to copy is as old as the
+        data it holds, i.e. its age includes the time spent copying
+        """
+
+        clock = [100.0]
+        connect = sqlite3.connect
+
+        def slow_connect(path):
+            clock[0] += 10
+            return connect(path)
+
+        publisher = SnapshotPublisher([self.path], 60)
+        with mock.patch.object(replica.time, "time", lambda: clock[0]), \
+                mock.patch.object(replica.sqlite3, "connect", slow_connect):
+            publisher.publish()
+            self.assertEqual(publisher.age(), 20)
+
+    def test_publishing_continues_after_error(self):
+
+        """
+        Tests that the background thread logs a failed snapshot (e.g. a
+        full disk) and keeps publishing
+        """
+
+        publisher = SnapshotPublisher([self.path], 0.01)
+        published = threading.Event()
+        calls = []
+
+        def publish():
+            calls.append(None)
+            # the first snapshot is published by start(), and the next
+            # one, from the thread, fails
+            if len(calls) == 2:
+                raise OSError("No space left on device")
+            if len(calls) == 3:
+                published.set()
+
+        with mock.patch.object(publisher, "publish", publish), \
+                mock.patch("builtins.print"):
+            publisher.start()
+            try:
+                self.assertTrue(published.wait(5))
+            finally:
+                publisher.stop()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+"""
+Unit tests for the rollup tables
+
+Tests include:
+Testing that rollups built for an existing database match the data
+Testing that the rollups kept by the triggers match a rebuild from scratch
+after a long run of random inserts, updates and deletes
+Testing that the lowest and highest prices are found again when the
+selection with them is removed or repriced
+"""
+
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+import app
+import rollups
+
+def snapshot(conn):
+
+    """
+    Gets the full contents of both rollup tables
+    """
+
+    return (conn.execute("SELECT * FROM sport_summary ORDER BY sport").fetchall(),
+            conn.execute("SELECT * FROM event_summary ORDER BY event_id").fetchall())
+
+class TestRollups(unittest.TestCase):
+
+    """
+    A test cases class to hold all the unit tests for the rollup tables
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, "app.db")
+        app.init_database(path)
+        self.conn = sqlite3.connect(path)
+        self.conn.executemany("INSERT INTO sports VALUES (?, ?, 1)",
+                              [("football", "football"), ("golf", "golf")])
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp.cleanup()
+
+    def assert_matches_rebuild(self):
+
+        """
+        Checks the rollups against ones rebuilt from scratch
+        """
+
+        maintained = snapshot(self.conn)
+        self.conn.execute("SAVEPOINT rebuild")
+        rollups.rebuild(self.conn.cursor())
+        rebuilt = snapshot(self.conn)
+        self.conn.execute("ROLLBACK TO rebuild")
+        self.conn.execute("RELEASE rebuild")
+        self.assertEqual(maintained, rebuilt)
+
+    def add_event(self, name, sport="football", active=1):
+        return self.conn.execute(
+            "INSERT INTO events (name, sport, active) VALUES (?, ?, ?)",
+            (name, sport, active)).lastrowid
+
+    def add_selection(self, name, event_id, price_cents, active=1,
+                      outcome="Unsettled"):
+        self.conn.execute("""INSERT INTO selections
+                             (name, event_id, price_cents, active, outcome)
+                             VALUES (?, ?, ?, ?, ?)""",
+                          (name, event_id, price_cents, active, outcome))
+
+    def test_existing_database_rebuilt(self):
+
+        """
+        Tests that the rollups of a database created before them are built
+        when it is initialized
+        """
+
+        event = self.add_event("A vs B")
+        self.add_selection("A", event, 250)
+        self.add_selection("B", event, 300, active=0, outcome="Lose")
+        self.conn.execute("DROP TABLE event_summary")
+        self.conn.execute("DROP TABLE sport_summary")
+        self.conn.commit()
+
+        rollups.create(self.conn.cursor())
+        sports, events = snapshot(self.conn)
+        self.assertEqual(sports, [("football", 1, 1)])
+        self.assertEqual(events, [(event, 2, 1, 2, 550, 250, 300,
+                                   0, 1, 0, 1)])
+
+    def test_extreme_prices_found_again(self):
+
+        """
+        Tests that removing or repricing the selection with the lowest or
+        highest price finds the next one
+        """
+
+        event = self.add_event("A vs B")
+        for name, price in [("A", 100), ("B", 200), ("C", 300)]:
+            self.add_selection(name, event, price)
+        self.conn.execute("DELETE FROM selections WHERE name = 'A'")
+        self.conn.execute("""UPDATE selections SET price_cents = 150
+                             WHERE name = 'C'""")
+        self.assertEqual(self.conn.execute(
+            """SELECT min_price_cents, max_price_cents FROM event_summary
+               WHERE event_id = ?""", (event,)).fetchone(), (150, 200))
+        self.conn.execute("DELETE FROM selections")
+        self.assertEqual(self.conn.execute(
+            """SELECT selections, min_price_cents, max_price_cents
+               FROM event_summary WHERE event_id = ?""", (event,)).fetchone(),
+                         (0, None, None))
+
+    def test_random_changes_match_rebuild(self):
+
+        """
+        Tests that the rollups match a rebuild after every one of a long
+        run of random changes to events and selections
+        """
+
+        rng = random.Random(0)
+        events = []
+        selections = []
+        for step in range(400):
+            choice = rng.random()
+            if choice < 0.15 or not events:
+                events.append(self.add_event(
+                    f"event {step}", rng.choice(["football", "golf"]),
+                    rng.choice([0, 1])))
+            elif choice < 0.45:
+                name = f"selection {step}"
+                self.add_selection(name, rng.choice(events),
+                                   rng.choice([None, 150, 200, 250, 300]),
+                                   rng.choice([0, 1, None]),
+                                   rng.choice(rollups.OUTCOMES + [None]))
+                selections.append(name)
+            elif choice < 0.6 and selections:
+                self.conn.execute("DELETE FROM selections WHERE name = ?",
+                                  (selections.pop(rng.randrange(len(selections))),))
+            elif choice < 0.8 and selections:
+                column, value = rng.choice([
+                    ("price_cents", rng.choice([None, 100, 200, 350])),
+                    ("active", rng.choice([0, 1])),
+                    ("outcome", rng.choice(rollups.OUTCOMES)),
+                    ("event_id", rng.choice(events))])
+                self.conn.execute(f"UPDATE selections SET {column} = ? "
+                                  "WHERE name = ?",
+                                  (value, rng.choice(selections)))
+            elif choice < 0.95:
+                column, value = rng.choice([
+                    ("active", rng.choice([0, 1])),
+                    ("sport", rng.choice(["football", "golf"]))])
+                self.conn.execute(f"UPDATE events SET {column} = ? WHERE id = ?",
+                                  (value, rng.choice(events)))
+            else:
+                # only events with no selections can be deleted
+                event = rng.choice(events)
+                if not self.conn.execute(
+                        "SELECT 1 FROM selections WHERE event_id = ?",
+                        (event,)).fetchone():
+                    self.conn.execute("DELETE FROM events WHERE id = ?",
+                                      (event,))
+                    events.remove(event)
+            self.assert_matches_rebuild()
+
+if __name__ == "__main__":
+    unittest.main()
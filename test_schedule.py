@@ -0,0 +1,57 @@
+"""
+Unit tests for the in-memory schedule of events
+
+Tests include:
+Testing that events are found between two times, inclusive, in start order
+Testing that adding a scheduled event again moves it
+Testing that removing an event, scheduled or not, leaves the rest
+Testing that events without a scheduled start are left out
+"""
+
+import unittest
+from schedule import EventSchedule
+
+class TestEventSchedule(unittest.TestCase):
+
+    """
+    A test cases class to hold all the unit tests for EventSchedule
+    """
+
+    def setUp(self):
+        self.schedule = EventSchedule([
+            ("B", "2030-01-01 12:00:00"),
+            ("A", "2030-01-01 10:00:00"),
+            ("C", "2030-01-02 10:00:00"),
+            ("D", None),
+        ])
+
+    def test_between(self):
+        self.assertEqual(len(self.schedule), 3)
+        self.assertEqual(
+            self.schedule.between("2030-01-01 10:00:00", "2030-01-01 12:00:00"),
+            [("2030-01-01 10:00:00", "A"), ("2030-01-01 12:00:00", "B")])
+        self.assertEqual(
+            self.schedule.between("2030-01-03 00:00:00", "2030-01-04 00:00:00"),
+            [])
+
+    def test_add_moves(self):
+        self.schedule.add("A", "2030-01-03 10:00:00")
+        self.schedule.add("E", "2030-01-01 11:00:00")
+        self.assertEqual(
+            self.schedule.between("2030-01-01 00:00:00", "2030-12-31 00:00:00"),
+            [("2030-01-01 11:00:00", "E"), ("2030-01-01 12:00:00", "B"),
+             ("2030-01-02 10:00:00", "C"), ("2030-01-03 10:00:00", "A")])
+        # an event with no start is taken off the schedule
+        self.schedule.add("E", None)
+        self.assertEqual(len(self.schedule), 3)
+
+    def test_remove(self):
+        self.schedule.remove("B")
+        self.schedule.remove("D")
+        self.schedule.remove("missing")
+        self.assertEqual(
+            self.schedule.between("2030-01-01 00:00:00", "2030-12-31 00:00:00"),
+            [("2030-01-01 10:00:00", "A"), ("2030-01-02 10:00:00", "C")])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+Unit tests for the auto starter that starts events at their scheduled start
+
+Tests include:
+Testing that nothing is started before it is due
+Testing that overdue events are started in a single batch
+Testing that events added with notify are started once due
+Testing that events whose batch fails are tried again
+Testing that the background thread keeps going after any error
+"""
+
+import sqlite3
+import threading
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta, timezone
+from scheduler import AutoStarter
+
+class TestAutoStarter(unittest.TestCase):
+
+    """
+    A test cases class to hold all the unit tests for AutoStarter
+    """
+
+    def setUp(self):
+        self.now = datetime.now(timezone.utc)
+        self.batches = []
+        self.started = threading.Event()
+
+    def start_due(self, now):
+        self.batches.append(now)
+        self.started.set()
+        return []
+
+    def test_nothing_due(self):
+        starter = AutoStarter(lambda until: [self.now + timedelta(hours=1)],
+                              self.start_due)
+        starter.resync()
+        self.assertEqual(starter.run_due(), [])
+        self.assertEqual(self.batches, [])
+
+    def test_overdue_events_start_in_one_batch(self):
+        overdue = [self.now - timedelta(minutes=i) for i in range(1, 50)]
+        starter = AutoStarter(lambda until: overdue, self.start_due)
+        starter.resync()
+        starter.run_due()
+        self.assertEqual(len(self.batches), 1)
+        # nothing is left in the heap, so there's nothing more to start
+        starter.run_due()
+        self.assertEqual(len(self.batches), 1)
+
+    def test_failed_batch_retried(self):
+        overdue = [self.now - timedelta(minutes=1),
+                   self.now - timedelta(minutes=2)]
+        failures = [sqlite3.OperationalError("database is locked")]
+
+        def start_due(now):
+            if failures:
+                raise failures.pop()
+            return self.start_due(now)
+
+        starter = AutoStarter(lambda until: overdue, start_due)
+        starter.resync()
+        with self.assertRaises(sqlite3.OperationalError):
+            starter.run_due()
+        self.assertEqual(self.batches, [])
+        # the events are still due, so the next run starts them
+        starter.run_due()
+        self.assertEqual(len(self.batches), 1)
+        starter.run_due()
+        self.assertEqual(len(self.batches), 1)
+
+    def test_notify_starts_event_when_due(self):
+        starter = AutoStarter(lambda until: [], self.start_due,
+                              resync_interval=60)
+        starter.start()
+        try:
+            starter.notify(datetime.now(timezone.utc) + timedelta(seconds=0.2))
+            self.assertTrue(self.started.wait(5))
+        finally:
+            starter.stop()
+        self.assertEqual(len(self.batches), 1)
+
+    def test_thread_survives_errors(self):
+        errors = [ValueError("Invalid isoformat string: 'soon'")]
+
+        def start_due(now):
+            if errors:
+                raise errors.pop()
+            return self.start_due(now)
+
+        starter = AutoStarter(lambda until: [self.now], start_due,
+                              retry_delay=0.01)
+        with mock.patch("builtins.print"):
+            starter.start()
+            try:
+                self.assertTrue(self.started.wait(5))
+            finally:
+                starter.stop()
+        self.assertEqual(errors, [])
+
+if __name__ == "__main__":
+    unittest.main()
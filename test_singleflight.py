@@ -0,0 +1,137 @@
+"""
+Unit tests for the single-flight layer used to deduplicate concurrent
+identical searches
+
+Tests include:
+Testing that concurrent calls with the same key share one execution
+Testing that concurrent calls with different keys run separately, at
+the same time
+Testing that an error is shared with every waiting caller
+Testing that nothing is cached once the call has finished
+"""
+
+import threading
+import unittest
+from singleflight import SingleFlight
+
+class TestSingleFlight(unittest.TestCase):
+
+    """
+    A test cases class to hold all the unit tests for SingleFlight
+    """
+
+    def run_concurrently(self, flight, keys, fn):
+
+        """
+        Calls flight.do for each key on its own thread while fn is blocked,
+        then releases fn and returns the results (or errors) for each key
+        """
+
+        started = threading.Event()
+        release = threading.Event()
+        results = [None] * len(keys)
+
+        def blocking_fn():
+            started.set()
+            release.wait(5)
+            return fn()
+
+        def worker(i, key):
+            try:
+                results[i] = flight.do(key, blocking_fn)
+            except Exception as e: # pylint: disable=broad-except
+                results[i] = e
+
+        threads = [threading.Thread(target=worker, args=(i, key))
+                   for i, key in enumerate(keys)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        # give the followers time to join the in-flight call
+        threading.Event().wait(0.2)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_identical_calls_share_execution(self):
+
+        """
+        Tests that many concurrent calls with the same key only run the
+        function once and all receive its result
+        """
+
+        flight = SingleFlight()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            return ["football"]
+
+        results = self.run_concurrently(flight, ["sports"] * 10, fn)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [["football"]] * 10)
+
+    def test_different_keys_run_separately(self):
+
+        """
+        Tests that concurrent calls with different keys are not merged:
+        both functions run at the same time, each blocked until released,
+        and each caller gets its own result
+        """
+
+        flight = SingleFlight()
+        started = {"a": threading.Event(), "b": threading.Event()}
+        release = threading.Event()
+        results = {}
+
+        def worker(key, value):
+            def fn():
+                started[key].set()
+                release.wait(5)
+                return value
+            results[key] = flight.do(key, fn)
+
+        threads = [threading.Thread(target=worker, args=("a", 1)),
+                   threading.Thread(target=worker, args=("b", 2))]
+        for thread in threads:
+            thread.start()
+        # neither can finish until released, so both must be running at once
+        self.assertTrue(started["a"].wait(5))
+        self.assertTrue(started["b"].wait(5))
+        self.assertEqual(results, {})
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, {"a": 1, "b": 2})
+
+    def test_error_shared_with_waiters(self):
+
+        """
+        Tests that when the leading call raises, every waiting caller
+        receives the same error
+        """
+
+        flight = SingleFlight()
+
+        def fn():
+            raise ValueError("bad query")
+
+        results = self.run_concurrently(flight, ["events"] * 5, fn)
+        for result in results:
+            self.assertIsInstance(result, ValueError)
+
+    def test_no_caching_after_completion(self):
+
+        """
+        Tests that once a call has finished, the next call with the same
+        key runs the function again
+        """
+
+        flight = SingleFlight()
+        self.assertEqual(flight.do("selections", lambda: 1), 1)
+        self.assertEqual(flight.do("selections", lambda: 2), 2)
+
+if __name__ == "__main__":
+    unittest.main()
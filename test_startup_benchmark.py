@@ -0,0 +1,36 @@
+"""
+Unit tests for the startup benchmark
+
+Tests include:
+Testing that a benchmark run gives a record for each measurement
+Testing that importing the app doesn't import the slow optional modules
+"""
+
+import json
+import unittest
+from startup_benchmark import run
+
+class TestStartupBenchmark(unittest.TestCase):
+
+    """
+    A test cases class to hold all the unit tests for startup_benchmark
+    """
+
+    def test_run(self):
+
+        """
+        Tests that a run gives one JSON-serializable record for each
+        measurement, and that the app is imported without any of the slow
+        optional modules, which should only be imported on first use
+        """
+
+        records = list(run(repeat=1))
+        json.dumps(records)
+        self.assertEqual([r["measurement"] for r in records],
+                         ["import", "init_new_database",
+                          "init_current_database"])
+        self.assertTrue(all(r["seconds"] >= 0 for r in records))
+        self.assertEqual(records[0]["lazy_modules_loaded"], [])
+
+if __name__ == "__main__":
+    unittest.main()
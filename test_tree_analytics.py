@@ -0,0 +1,454 @@
+"""
+Unit tests for the tree analytics module
+
+Tests include:
+Testing that every way of counting internal nodes agrees on the sample trees
+Testing the NumPy count against the pure Python one around NUMPY_THRESHOLD,
+with out of range and negative parents, and with other integer types
+Testing the child index, roots, leaves and internal nodes of a tree
+Testing the depths, height and subtree sizes of a tree
+Testing that parents too big for int64 are treated as out of range
+Testing that an empty tree and a tree with a cycle are handled
+Testing the tall, thin and short, wide cases against a simple traversal,
+both level by level and node by node
+Testing the streaming count of a memory-mapped binary file
+Testing the parallel count with different numbers of workers and chunks,
+including chunks that don't split the tree evenly and an empty tree
+Testing that IncrementalTree's running count matches a recount after
+random changes, and that a failed or malformed batch of changes is rolled
+back
+"""
+
+import array
+import copy
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import tree_analytics
+from tree_analytics import (IncrementalTree, ParentArrayTree,
+                            find_internal_nodes_num,
+                            find_internal_nodes_num_numpy,
+                            find_internal_nodes_num_parallel,
+                            find_internal_nodes_num_python,
+                            find_internal_nodes_num_stream, random_tree)
+
+# sample tree provided in question
+MY_TREE = [4, 4, 1, 5, -1, 4, 5]
+
+SAMPLE_TREES = [MY_TREE, [], [-1], [-1, 0, 1, 2, 3, 4, 5],
+                [-1, 0, 0, 1, 1, 2, 2, 3, 3, 3, 6]]
+
+def iter_ancestors(tree, node):
+
+    """
+    Yields a node followed by each of its ancestors
+    """
+
+    while node != -1:
+        yield node
+        node = tree[node]
+
+def naive_subtree_sizes(tree):
+
+    """
+    Gets the size of each node's subtree by walking up from every node
+    """
+
+    sizes = [0] * len(tree)
+    for node in range(len(tree)):
+        for ancestor in iter_ancestors(tree, node):
+            sizes[ancestor] += 1
+    return sizes
+
+class TestTreeAnalytics(unittest.TestCase):
+
+    """
+    A test cases class to hold all the unit tests for tree_analytics
+    """
+
+    def test_internal_node_counts_agree(self):
+
+        """
+        Tests that every way of counting internal nodes gives the same
+        count, which also matches ParentArrayTree
+        """
+
+        for tree in SAMPLE_TREES:
+            expected = find_internal_nodes_num_python(tree)
+            self.assertEqual(find_internal_nodes_num(tree), expected)
+            self.assertEqual(find_internal_nodes_num_numpy(tree), expected)
+            self.assertEqual(find_internal_nodes_num_stream(tree,
+                                                            chunk_size=2),
+                             expected)
+            self.assertEqual(ParentArrayTree(tree).internal_count, expected)
+
+    def test_numpy_matches_python_around_threshold(self):
+
+        """
+        Tests that the NumPy count (and find_internal_nodes_num, which
+        switches to it at NUMPY_THRESHOLD) matches the pure Python count
+        for lists just under, at and over the threshold, with parents that
+        are negative or past the last node
+        """
+
+        rng = random.Random(0)
+        threshold = tree_analytics.NUMPY_THRESHOLD
+        for n in [threshold - 1, threshold, threshold + 1]:
+            tree = random_tree(n, n).tolist()
+            for i in rng.sample(range(n), n // 10):
+                tree[i] = rng.choice([-1, -2, -n, n, n + 1, 10 ** 12])
+            expected = find_internal_nodes_num_python(tree)
+            self.assertEqual(find_internal_nodes_num_numpy(tree), expected)
+            self.assertEqual(find_internal_nodes_num(tree), expected)
+            self.assertEqual(find_internal_nodes_num_numpy(np.array(tree)),
+                             expected)
+
+    def test_numpy_integer_types(self):
+
+        """
+        Tests the NumPy count of arrays and buffers of integer types other
+        than int64, signed and unsigned, including ones too small to hold
+        every node index
+        """
+
+        # -1 and 127 are out of range for both trees, as is 255 unsigned
+        signed = [4, 4, 1, 5, -1, 4, 5, 7, 127, -100, 0]
+        unsigned = [4, 4, 1, 5, 255, 4, 5, 7, 127, 200, 0]
+        cases = [(np.array(signed, dtype=dtype), signed)
+                 for dtype in [np.int8, np.int16, np.int32]] + \
+                [(np.array(unsigned, dtype=dtype), unsigned)
+                 for dtype in [np.uint8, np.uint16, np.uint32, np.uint64]] + \
+                [(array.array(typecode, signed), signed)
+                 for typecode in ["b", "i", "q"]]
+        # a tree bigger than its type's range, so every value can be a node
+        big = np.tile(np.array([5, -1, 120, 127], dtype=np.int8), 100)
+        cases.append((big, big.tolist()))
+        for parents, tree in cases:
+            self.assertEqual(find_internal_nodes_num_numpy(parents),
+                             find_internal_nodes_num_python(tree),
+                             getattr(parents, "dtype", parents))
+            self.assertEqual(find_internal_nodes_num(parents),
+                             find_internal_nodes_num_python(tree))
+
+    def test_children(self):
+
+        """
+        Tests the children, roots, leaves and internal nodes of the sample
+        tree
+        """
+
+        tree = ParentArrayTree(MY_TREE)
+        self.assertEqual(len(tree), 7)
+        self.assertEqual([tree.children(node).tolist() for node in range(7)],
+                         [[], [2], [], [], [0, 1, 5], [3, 6], []])
+        self.assertEqual(tree.child_counts.tolist(), [0, 1, 0, 0, 3, 2, 0])
+        self.assertEqual(tree.roots.tolist(), [4])
+        self.assertEqual(tree.leaves.tolist(), [0, 2, 3, 6])
+        self.assertEqual(tree.internal_nodes.tolist(), [1, 4, 5])
+
+    def test_depths_and_sizes(self):
+
+        """
+        Tests the depths, height and subtree sizes of the sample tree
+        """
+
+        tree = ParentArrayTree(MY_TREE)
+        self.assertEqual(tree.depths.tolist(), [1, 1, 2, 2, 0, 1, 2])
+        self.assertEqual(tree.height, 2)
+        self.assertEqual(tree.subtree_sizes.tolist(), [1, 2, 1, 1, 7, 3, 1])
+
+    def test_out_of_range_parents_are_roots(self):
+
+        """
+        Tests that any parent that isn't a node index marks a root, in the
+        same way as -1
+        """
+
+        tree = ParentArrayTree([-5, 0, 7])
+        self.assertEqual(tree.roots.tolist(), [0, 2])
+        self.assertEqual(tree.parents.tolist(), [-1, 0, -1])
+
+    def test_huge_parents(self):
+
+        """
+        Tests that parents too big for int64 are treated as out of range by
+        the streaming count and ParentArrayTree, as they are by the other
+        counts, rather than overflowing
+        """
+
+        for tree in [[2 ** 70, 0, -1], [2 ** 63, 0, -1], [0, -2 ** 64, 1]]:
+            expected = find_internal_nodes_num_python(tree)
+            self.assertEqual(find_internal_nodes_num(tree), expected)
+            self.assertEqual(find_internal_nodes_num_stream(tree), expected)
+            self.assertEqual(find_internal_nodes_num_stream(tree,
+                                                            chunk_size=1),
+                             expected)
+            self.assertEqual(ParentArrayTree(tree).internal_count, expected)
+        self.assertEqual(ParentArrayTree([2 ** 70, 0, -1]).parents.tolist(),
+                         [-1, 0, -1])
+
+    def test_empty_tree(self):
+
+        """
+        Tests that an empty tree has no nodes and a height of -1
+        """
+
+        tree = ParentArrayTree([])
+        self.assertEqual(tree.internal_count, 0)
+        self.assertEqual(tree.height, -1)
+        self.assertEqual(tree.subtree_sizes.tolist(), [])
+
+    def test_cycle(self):
+
+        """
+        Tests that asking for the depths of a tree with a cycle raises
+        ValueError
+        """
+
+        with self.assertRaises(ValueError):
+            _ = ParentArrayTree([-1, 2, 1]).depths
+
+    def test_shapes_match_naive(self):
+
+        """
+        Tests that the depths, breadth-first order and subtree sizes of a
+        straight line, a star, a broom, a forest and random trees match a
+        simple traversal, with the search and the sizes worked out level by
+        level, node by node, and switching from one to the other
+        """
+
+        line = list(range(-1, 199))
+        star = [-1] + [0] * 199
+        # a wide level of 300 children, then a long line under the last one
+        broom = [-1] + [0] * 300 + list(range(300, 500))
+        # several roots, given out of order
+        forest = [5, -1, 1, -1, 3, -1, 0, 6]
+        shapes = [line, star, broom, forest] + \
+            [random_tree(n, seed).tolist()
+             for n, seed in [(500, 0), (500, 1), (500, 2), (5000, 3)]]
+        # the defaults, only level by level, and only node by node
+        modes = [{"MIN_NODES_PER_LEVEL": tree_analytics.MIN_NODES_PER_LEVEL},
+                 {"MIN_NODES_PER_LEVEL": 0},
+                 {"MIN_NODES_PER_LEVEL": 10 ** 9, "MIN_VECTORIZED_LEVELS": 0}]
+        for parents in shapes:
+            sizes = naive_subtree_sizes(parents)
+            depths = [len(list(iter_ancestors(parents, node))) - 1
+                      for node in range(len(parents))]
+            for mode in modes:
+                with mock.patch.multiple(tree_analytics, **mode):
+                    tree = ParentArrayTree(np.array(parents))
+                    self.assertEqual(tree.subtree_sizes.tolist(), sizes)
+                    self.assertEqual(tree.depths.tolist(), depths)
+                    # every node comes after its parent, level by level
+                    order = tree.bfs_order.tolist()
+                    self.assertEqual(sorted(order), list(range(len(parents))))
+                    position = {node: i for i, node in enumerate(order)}
+                    self.assertTrue(all(position[tree.parents[node]]
+                                        < position[node]
+                                        for node in order
+                                        if tree.parents[node] >= 0))
+                    self.assertEqual([depths[node] for node in order],
+                                     sorted(depths))
+
+    def test_stream_memory_mapped_file(self):
+
+        """
+        Tests that the streaming count memory-maps a binary file of int32
+        or int64 parent indexes and reads it a chunk at a time, including
+        a last chunk that is only partly full and an empty file
+        """
+
+        tree = random_tree(1000, 3)
+        expected = find_internal_nodes_num_python(tree.tolist())
+        with tempfile.TemporaryDirectory() as tmp:
+            for dtype, itemsize in [(np.int32, 4), (np.int64, 8)]:
+                path = os.path.join(tmp, f"tree{itemsize}.bin")
+                tree.astype(dtype).tofile(path)
+                with mock.patch.object(tree_analytics.np, "memmap",
+                                       wraps=np.memmap) as memmap:
+                    count = find_internal_nodes_num_stream(
+                        path, chunk_size=64, itemsize=itemsize)
+                self.assertEqual(count, expected)
+                memmap.assert_called_once_with(path, dtype=dtype, mode="r")
+
+            path = os.path.join(tmp, "empty.bin")
+            open(path, "wb").close()
+            self.assertEqual(find_internal_nodes_num_stream(path), 0)
+
+    def test_parallel_workers_and_chunks(self):
+
+        """
+        Tests that the parallel count matches the pure Python one for any
+        number of workers and chunks, including more chunks than nodes and
+        chunk boundaries that fall in the middle of a byte of the bitmap
+        """
+
+        trees = [MY_TREE, random_tree(1001, 1).tolist(),
+                 [-1] + [0] * 99, list(range(-1, 99))]
+        for tree in trees:
+            expected = find_internal_nodes_num_python(tree)
+            for workers, chunks in [(1, None), (2, None), (4, None),
+                                    (2, 3), (3, 7), (2, len(tree) + 5)]:
+                self.assertEqual(find_internal_nodes_num_parallel(
+                    tree, workers=workers, chunks=chunks), expected,
+                    (len(tree), workers, chunks))
+
+    def test_parallel_file(self):
+
+        """
+        Tests the parallel count of int32 and int64 binary files, which
+        each worker memory-maps
+        """
+
+        tree = random_tree(777, 2)
+        expected = find_internal_nodes_num_python(tree.tolist())
+        with tempfile.TemporaryDirectory() as tmp:
+            for dtype, itemsize in [(np.int32, 4), (np.int64, 8)]:
+                path = os.path.join(tmp, f"tree{itemsize}.bin")
+                tree.astype(dtype).tofile(path)
+                self.assertEqual(find_internal_nodes_num_parallel(
+                    path, workers=3, chunks=5, itemsize=itemsize), expected)
+
+    def test_parallel_empty_tree(self):
+
+        """
+        Tests that an empty tree, given as a list or an empty file, has no
+        internal nodes, without starting any workers
+        """
+
+        self.assertEqual(find_internal_nodes_num_parallel([], workers=2), 0)
+        self.assertEqual(find_internal_nodes_num_parallel(
+            np.zeros(0, dtype=np.int32), workers=2), 0)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "empty.bin")
+            open(path, "wb").close()
+            self.assertEqual(find_internal_nodes_num_parallel(path), 0)
+
+class TestIncrementalTree(unittest.TestCase):
+
+    """
+    A test cases class to hold all the unit tests for IncrementalTree
+    """
+
+    def random_change(self, rng, tree):
+
+        """
+        Picks a random valid change to make to the tree
+        """
+
+        nodes = [node for node in range(len(tree.parents)) if node in tree]
+        leaves = [node for node in nodes if tree.child_counts[node] == 0]
+        choice = rng.random()
+        if choice < 0.4 or not nodes:
+            return ("add", rng.choice(nodes + [-1]))
+        if choice < 0.6 and leaves:
+            return ("remove", rng.choice(leaves))
+        node = rng.choice(nodes)
+        # only move nodes to a parent outside their own subtree
+        ancestors = set()
+        candidates = []
+        for parent in nodes + [-1]:
+            ancestors.clear()
+            current = parent
+            while current >= 0 and current not in ancestors:
+                ancestors.add(current)
+                current = tree.parents[current]
+            if node not in ancestors:
+                candidates.append(parent)
+        return ("reparent", node, rng.choice(candidates))
+
+    def test_matches_recount(self):
+
+        """
+        Tests that the running count matches counting from scratch after
+        every one of a long run of random changes, made one at a time
+        """
+
+        rng = random.Random(0)
+        tree = IncrementalTree(MY_TREE)
+        for _ in range(500):
+            tree.apply([self.random_change(rng, tree)])
+            self.assertEqual(tree.internal_count,
+                             find_internal_nodes_num(tree.to_parent_array()))
+
+    def test_batches_match_recount(self):
+
+        """
+        Tests that the running count matches counting from scratch after
+        random batches of changes, starting from random trees
+        """
+
+        rng = random.Random(1)
+        for seed in range(5):
+            tree = IncrementalTree(random_tree(200, seed).tolist())
+            for _ in range(20):
+                trial = copy.deepcopy(tree)
+                changes = []
+                for _ in range(10):
+                    change = self.random_change(rng, trial)
+                    trial.apply([change])
+                    changes.append(change)
+                tree.apply(changes)
+                self.assertEqual(tree.to_parent_array(),
+                                 trial.to_parent_array())
+                self.assertEqual(
+                    tree.internal_count,
+                    find_internal_nodes_num(tree.to_parent_array()))
+
+    def test_single_changes(self):
+
+        """
+        Tests adding, moving and removing nodes on the sample tree
+        """
+
+        tree = IncrementalTree(MY_TREE)
+        self.assertEqual(tree.internal_count, 3)
+        node = tree.add(3)
+        self.assertEqual((node, tree.internal_count), (7, 4))
+        tree.reparent(2, 3)
+        self.assertEqual(tree.internal_count, 3)
+        tree.remove(node)
+        tree.remove(2)
+        self.assertEqual(tree.internal_count, 2)
+        self.assertEqual(len(tree), 6)
+        with self.assertRaises(ValueError):
+            tree.remove(4)
+        with self.assertRaises(ValueError):
+            tree.add(2)
+
+    def test_failed_batch_rolled_back(self):
+
+        """
+        Tests that a batch with an invalid change leaves the tree as it was
+        """
+
+        tree = IncrementalTree(MY_TREE)
+        with self.assertRaises(ValueError):
+            tree.apply([("add", 0), ("reparent", 3, 0), ("remove", 6),
+                        ("remove", 4)])
+        self.assertEqual(tree.to_parent_array(), MY_TREE)
+        self.assertEqual(tree.child_counts, [0, 1, 0, 0, 3, 2, 0])
+        self.assertEqual((tree.internal_count, len(tree)), (3, 7))
+
+    def test_malformed_batch_rolled_back(self):
+
+        """
+        Tests that a batch that fails with an error other than ValueError,
+        e.g. a change that isn't a tuple or a node that isn't an int, also
+        leaves the tree as it was
+        """
+
+        for bad_change in [None, ("reparent", 3, "0"), ("remove", None)]:
+            tree = IncrementalTree(MY_TREE)
+            with self.assertRaises(TypeError):
+                tree.apply([("add", 0), ("reparent", 3, 0), ("remove", 6),
+                            bad_change])
+            self.assertEqual(tree.to_parent_array(), MY_TREE)
+            self.assertEqual(tree.child_counts, [0, 1, 0, 0, 3, 2, 0])
+            self.assertEqual((tree.internal_count, len(tree)), (3, 7))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+Unit tests for the tree benchmark harness
+
+Tests include:
+Testing that every generated shape is a valid tree with the expected number
+of internal nodes
+Testing that a benchmark run gives a record per implementation, and skips
+the memory hungry implementations above the limit
+"""
+
+import json
+import unittest
+from tree_analytics import ParentArrayTree, find_internal_nodes_num_python
+from tree_benchmark import IMPLEMENTATIONS, SHAPES, run
+
+class TestTreeBenchmark(unittest.TestCase):
+
+    """
+    A test cases class to hold all the unit tests for tree_benchmark
+    """
+
+    def test_shapes(self):
+
+        """
+        Tests that each shape has a single root and no cycles, and that the
+        shapes with a known number of internal nodes have it
+        """
+
+        expected = {"star": 1, "straight_line": 999, "kary": 250}
+        for shape, generate in SHAPES.items():
+            parents = generate(1000)
+            tree = ParentArrayTree(parents)
+            self.assertEqual(tree.roots.tolist(), [0])
+            self.assertEqual(tree.subtree_sizes[0], 1000)
+            if shape in expected:
+                self.assertEqual(
+                    find_internal_nodes_num_python(parents.tolist()),
+                    expected[shape])
+
+    def test_run(self):
+
+        """
+        Tests that a run gives one JSON-serializable record for each
+        implementation, all with the same count, and leaves out the memory
+        hungry ones for trees over the limit
+        """
+
+        records = list(run(["random"], [100, 1000], repeat=1,
+                           memory_limit=500))
+        json.dumps(records)
+        small = [r for r in records if r["nodes"] == 100]
+        large = [r for r in records if r["nodes"] == 1000]
+        self.assertEqual([r["implementation"] for r in small],
+                         list(IMPLEMENTATIONS))
+        self.assertEqual([r["implementation"] for r in large],
+                         ["numpy", "stream", "parallel"])
+        self.assertEqual(len({r["internal_nodes"] for r in small}), 1)
+        self.assertTrue(all(r["seconds"] >= 0 and r["peak_bytes"] >= 0
+                            for r in records))
+
+if __name__ == "__main__":
+    unittest.main()
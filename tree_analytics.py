@@ -0,0 +1,707 @@
+"""
+Analytics for trees given as an array of parent indexes, where node i's
+parent is tree[i] and a root has -1 (or any other value that isn't a node
+index). Includes several ways of counting the internal nodes (those with
+at least one child) suited to different sizes of tree,
+ParentArrayTree, which indexes a tree's children once so that repeated
+queries (child counts, leaves, depths, subtree sizes, height) don't need
+to scan it again, and IncrementalTree, which keeps a running count of the
+internal nodes while the tree is changed
+"""
+
+import array
+import itertools
+import multiprocessing
+import os
+from functools import cached_property
+
+from multiprocessing import shared_memory
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# lists with at least this many nodes are counted with NumPy when it is
+# installed, below this the cost of converting a list to an array
+# outweighs the faster scan
+NUMPY_THRESHOLD = 1000
+
+# number of parent indexes read at a time when streaming
+CHUNK_SIZE = 1 << 20
+
+# array.array type codes for the integer sizes of binary parent files
+TYPECODES = {4: "i", 8: "q"}
+
+def find_internal_nodes_num(tree):
+
+    """
+    Finds the total number of internal nodes in the given tree
+    i.e. those with at least one child
+
+    The tree can be a list of parent indexes, a NumPy array, or anything
+    supporting the buffer protocol (e.g. array.array). Large trees, arrays
+    and buffers are counted with NumPy when it is installed, anything else
+    uses the pure Python version
+    """
+
+    if np is not None and (len(tree) >= NUMPY_THRESHOLD
+                           or not isinstance(tree, (list, tuple))):
+        return find_internal_nodes_num_numpy(tree)
+    return find_internal_nodes_num_python(tree)
+
+def find_internal_nodes_num_python(tree):
+
+    """
+    Finds the total number of internal nodes in the given tree
+    i.e. those with at least one child
+
+    Time complexity: O(n) - iterates through tree once, adding all parent nodes
+    to set (i.e. any value in the list that is also an index in the range of
+    the list's length, excluding dummy values like -1 to indicate no parent).
+    In any case, all n nodes in the tree will need to be checked, which is O(n)
+    
+    Space complexity: O(n) - creates a set of parent nodes, which is used to
+    calculate the number of internal nodes, as all parent nodes are internal
+    nodes. In the worst case (a vertical line tree), all but one of the nodes
+    could be parents, i.e. n - 1, which is O(n)
+"""
+
+    internal_nodes = set() #set to ensure no double-counting of nodes
+
+    # for each node i in the tree, its parent is tree[i], all parent nodes
+    # are automatically internal nodes as they have at least one child
+    for i in range(len(tree)):
+        # check if parent is in the range of indexes of the tree
+        # i.e. exclude -1 or other dummy values to show root has no parent
+        # and exclude nodes that are already counted as internal nodes
+        if tree[i] in range(len(tree)):
+            internal_nodes.add(tree[i])
+
+    # return the amount of internal nodes in the set, i.e. the number of
+    # distinct values in the list, excluding the dummy value -1
+    return len(internal_nodes)
+
+def find_internal_nodes_num_numpy(tree):
+
+    """
+    Finds the total number of internal nodes in the given tree using NumPy,
+    for large trees
+
+    Time complexity: O(n) - masks out parents that aren't indexes of the
+    tree (e.g. -1 for the root), then marks each remaining parent in a
+    boolean array and counts the marked nodes, all as vectorized operations
+    rather than a Python loop
+
+    Space complexity: O(n) - one byte per node for the markers, rather than
+    a set of Python ints
+    """
+
+    parents = np.asarray(tree)
+    if parents.dtype.kind not in "iu":
+        # not integer indexes, e.g. an empty list or floats, which the pure
+        # Python version handles the same way as before
+        return find_internal_nodes_num_python(list(parents))
+
+    n = len(parents)
+    parents = parents[(parents >= 0) & (parents < n)]
+    is_internal = np.zeros(n, dtype=bool)
+    is_internal[parents] = True
+    return int(np.count_nonzero(is_internal))
+
+def parent_index_array(tree, n=None):
+
+    """
+    Converts parent indexes to an int64 array, with -1 in place of any
+    outside the range of node indexes (0 to n - 1, where n defaults to the
+    number of indexes). Values that aren't NumPy integers, e.g. Python ints
+    too big for int64, are range checked before they are converted, so
+    they can't overflow
+    """
+
+    parents = np.asarray(tree)
+    if n is None:
+        n = len(parents)
+    if parents.dtype.kind in "iub":
+        parents = parents.astype(np.int64, copy=False)
+    else:
+        parents = np.array([parent if 0 <= parent < n else -1
+                            for parent in parents.tolist()], dtype=np.int64)
+    return np.where((parents >= 0) & (parents < n), parents, -1)
+
+class ParentBitmap:
+
+    """
+    A compact set of the nodes that are parents, using one bit per node,
+    i.e. n / 8 bytes for a tree with n nodes, rather than a set of Python
+    ints. Parent indexes can be marked a chunk at a time, so a tree never
+    needs to be held in memory all at once
+    """
+
+    def __init__(self, n):
+        self.n = n
+        size = (n + 7) // 8
+        self.bits = np.zeros(size, dtype=np.uint8) if np is not None \
+            else bytearray(size)
+
+    def mark(self, parents):
+
+        """
+        Marks each valid parent index in a chunk (a list or an array),
+        ignoring those outside the range of node indexes, e.g. -1 for
+        the root
+        """
+
+        if np is not None:
+            parents = parent_index_array(parents, self.n)
+            parents = parents[parents >= 0]
+            masks = np.left_shift(1, parents & 7).astype(np.uint8)
+            np.bitwise_or.at(self.bits, parents >> 3, masks)
+        else:
+            for parent in parents:
+                if 0 <= parent < self.n:
+                    self.bits[parent >> 3] |= 1 << (parent & 7)
+
+    def count(self):
+
+        """
+        Counts the nodes that have been marked as parents
+        """
+
+        if np is None:
+            return int.from_bytes(self.bits, "little").bit_count()
+        total = 0
+        for start in range(0, len(self.bits), CHUNK_SIZE):
+            total += int(np.unpackbits(
+                self.bits[start:start + CHUNK_SIZE]).sum(dtype=np.int64))
+        return total
+
+def parent_chunks(source, chunk_size=CHUNK_SIZE, itemsize=4):
+
+    """
+    Gets the number of nodes in a tree and an iterator over its parent
+    indexes in chunks, without loading the whole tree into memory.
+
+    The source can be the path to a binary file of native-endian integers
+    (itemsize 4 for int32, or 8 for int64), which is memory-mapped when
+    NumPy is installed and read a chunk at a time otherwise, a NumPy array
+    (including a np.memmap), or any other sequence of parent indexes
+    """
+
+    if isinstance(source, (str, os.PathLike)):
+        n = os.path.getsize(source) // itemsize
+        if np is not None:
+            dtype = np.int32 if itemsize == 4 else np.int64
+            parents = np.memmap(source, dtype=dtype, mode="r") if n else \
+                np.zeros(0, dtype=dtype)
+            return n, (parents[i:i + chunk_size]
+                       for i in range(0, n, chunk_size))
+        return n, read_binary_chunks(source, chunk_size, itemsize)
+
+    n = len(source)
+    if np is not None and isinstance(source, np.ndarray):
+        return n, (source[i:i + chunk_size] for i in range(0, n, chunk_size))
+    iterator = iter(source)
+    return n, iter(lambda: list(itertools.islice(iterator, chunk_size)), [])
+
+def read_binary_chunks(path, chunk_size, itemsize):
+
+    """
+    Yields chunks of parent indexes from a binary file of native-endian
+    integers, for when NumPy is not installed
+    """
+
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk_size * itemsize)
+            if not data:
+                return
+            chunk = array.array(TYPECODES[itemsize])
+            chunk.frombytes(data)
+            yield chunk
+
+def find_internal_nodes_num_stream(source, n=None, chunk_size=CHUNK_SIZE,
+                                   itemsize=4):
+
+    """
+    Finds the total number of internal nodes in the given tree, reading
+    its parent indexes a chunk at a time, so trees too large to hold as a
+    Python list can still be counted.
+
+    The source can be anything accepted by parent_chunks, or an iterator
+    of parent indexes, in which case n (the number of nodes) must be given,
+    as it can't be known before reading the whole tree
+
+    Time complexity: O(n) - every parent index is read once
+
+    Space complexity: O(n / 8 + chunk_size) - one bit per node for the
+    parents seen so far, plus the chunk being read
+    """
+
+    if n is None:
+        n, chunks = parent_chunks(source, chunk_size, itemsize)
+    else:
+        iterator = iter(source)
+        chunks = iter(lambda: list(itertools.islice(iterator, chunk_size)),
+                      [])
+
+    parents = ParentBitmap(n)
+    for chunk in chunks:
+        parents.mark(chunk)
+    return parents.count()
+
+def mark_parent_range(task):
+
+    """
+    Marks the parents in one range of a parent array shared between
+    processes, either a memory-mapped binary file or a block of shared
+    memory, and returns the bitmap of parents found. Runs in a worker
+    process for find_internal_nodes_num_parallel
+    """
+
+    kind, location, dtype, n, start, stop = task
+    if kind == "file":
+        shm = None
+        parents = np.memmap(location, dtype=dtype, mode="r")
+    else:
+        shm = shared_memory.SharedMemory(name=location)
+        parents = np.ndarray((n,), dtype=dtype, buffer=shm.buf)
+
+    bitmap = ParentBitmap(n)
+    for i in range(start, stop, CHUNK_SIZE):
+        bitmap.mark(parents[i:min(i + CHUNK_SIZE, stop)])
+
+    # the array must be released before the shared memory can be closed
+    del parents
+    if shm is not None:
+        shm.close()
+    return bitmap.bits
+
+def find_internal_nodes_num_parallel(source, workers=None, chunks=None,
+                                     itemsize=4):
+
+    """
+    Finds the total number of internal nodes in the given tree using
+    several processes. The parent array is split into chunks, each worker
+    marks the parents in its chunks into its own bitmap, and the bitmaps
+    are merged with a bitwise OR before counting.
+
+    The source can be the path to a binary file of native-endian int32 or
+    int64 parent indexes (set by itemsize), which each worker memory-maps,
+    or a list or array, which is copied once into shared memory. Needs
+    NumPy, and falls back to the streaming version without it
+
+    Time complexity: O(n / workers + chunks * n / 8) - each worker scans its
+    share of the tree, then one bitmap per chunk is merged
+
+    Space complexity: O(n / 8) per worker, for its bitmap
+    """
+
+    if np is None:
+        return find_internal_nodes_num_stream(source, itemsize=itemsize)
+
+    workers = workers or os.cpu_count() or 1
+    chunks = chunks or workers
+    shm = None
+
+    if isinstance(source, (str, os.PathLike)):
+        n = os.path.getsize(source) // itemsize
+        dtype = np.int32 if itemsize == 4 else np.int64
+        kind, location = "file", os.fspath(source)
+    else:
+        parents = np.asarray(source)
+        if parents.dtype.kind not in "iu":
+            return find_internal_nodes_num_python(list(parents))
+        n, dtype = len(parents), parents.dtype
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=max(parents.nbytes, 1))
+        np.ndarray((n,), dtype=dtype, buffer=shm.buf)[:] = parents
+        kind, location = "shm", shm.name
+
+    if n == 0:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+        return 0
+
+    bounds = [n * i // chunks for i in range(chunks + 1)]
+    tasks = [(kind, location, dtype, n, bounds[i], bounds[i + 1])
+             for i in range(chunks) if bounds[i] < bounds[i + 1]]
+
+    merged = ParentBitmap(n)
+    try:
+        with multiprocessing.Pool(min(workers, len(tasks))) as pool:
+            for bits in pool.imap_unordered(mark_parent_range, tasks):
+                np.bitwise_or(merged.bits, bits, out=merged.bits)
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+    return merged.count()
+
+def random_tree(n, seed=0):
+
+    """
+    Generates a random tree with n nodes, where node 0 is the root and
+    every other node's parent is a random node before it
+    """
+
+    rng = np.random.default_rng(seed)
+    parents = (rng.random(n) * np.arange(n)).astype(np.int64)
+    parents[:1] = -1
+    return parents
+
+# when there are fewer than this many nodes per level (on average, for
+# subtree sizes), depths and subtree sizes are worked out node by node
+# rather than level by level
+MIN_NODES_PER_LEVEL = 50
+
+# levels always searched a level at a time before the breadth-first search
+# can go node by node, as most trees start with a few narrow levels
+MIN_VECTORIZED_LEVELS = 16
+
+class ParentArrayTree:
+
+    """
+    A tree stored as an array of parent indexes, in the same format taken
+    by find_internal_nodes_num. The children of every node are indexed once
+    when the tree is created, in compressed sparse row (CSR) form: the
+    children of node i are child_index[offsets[i]:offsets[i + 1]]. Each
+    query is worked out from this index the first time it is asked for and
+    then cached, as the tree can't be changed. Needs NumPy
+    """
+
+    def __init__(self, tree):
+        if np is None:
+            raise ImportError("ParentArrayTree needs NumPy")
+
+        # roots are always stored as -1, whatever value they were given
+        self.parents = parents = parent_index_array(tree)
+        self.n = n = len(parents)
+        has_parent = parents >= 0
+
+        self.child_counts = np.bincount(self.parents[has_parent], minlength=n)
+        self.offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(self.child_counts, out=self.offsets[1:])
+        # sorting the nodes by parent groups each node's children together,
+        # with roots (sorted last, as if their parent were n) left off the end
+        order = np.argsort(np.where(has_parent, parents, n), kind="stable")
+        self.child_index = order[:int(np.count_nonzero(has_parent))]
+
+    def __len__(self):
+        return self.n
+
+    def children(self, node):
+
+        """
+        Gets the children of a node, in index order
+        """
+
+        return self.child_index[self.offsets[node]:self.offsets[node + 1]]
+
+    @cached_property
+    def roots(self):
+
+        """
+        The nodes with no parent
+        """
+
+        return np.flatnonzero(self.parents < 0)
+
+    @cached_property
+    def leaves(self):
+
+        """
+        The nodes with no children
+        """
+
+        return np.flatnonzero(self.child_counts == 0)
+
+    @cached_property
+    def internal_nodes(self):
+
+        """
+        The nodes with at least one child
+        """
+
+        return np.flatnonzero(self.child_counts)
+
+    @cached_property
+    def internal_count(self):
+
+        """
+        The number of internal nodes, the same as find_internal_nodes_num
+        """
+
+        return int(np.count_nonzero(self.child_counts))
+
+    @cached_property
+    def _breadth_first(self):
+        order = np.empty(self.n, dtype=np.int64)
+        depths = np.full(self.n, -1, dtype=np.int64)
+        roots = self.roots
+        order[:len(roots)] = roots
+        depths[roots] = 0
+        head, tail, depth = 0, len(roots), 0
+
+        # a level at a time, finding the children of every node in the
+        # level from their ranges of child_index
+        while head < tail and (tail - head >= MIN_NODES_PER_LEVEL or
+                               depth < MIN_VECTORIZED_LEVELS):
+            level = order[head:tail]
+            counts = self.child_counts[level]
+            total = int(counts.sum())
+            # the position in child_index of each child of the level
+            firsts = np.repeat(self.offsets[level] - np.cumsum(counts)
+                               + counts, counts)
+            children = self.child_index[firsts + np.arange(total)]
+            order[tail:tail + total] = children
+            depth += 1
+            depths[children] = depth
+            head, tail = tail, tail + total
+
+        # the rest node by node, once the levels are too narrow for the
+        # vectorized steps to pay off, e.g. in tall, thin trees
+        if head < tail:
+            offsets = self.offsets.tolist()
+            child_index = self.child_index.tolist()
+            rest = order[head:tail].tolist()
+            depth_list = depths.tolist()
+            for node in rest:
+                depth = depth_list[node] + 1
+                for child in child_index[offsets[node]:offsets[node + 1]]:
+                    depth_list[child] = depth
+                    rest.append(child)
+            order[head:head + len(rest)] = rest
+            depths = np.array(depth_list, dtype=np.int64)
+            tail = head + len(rest)
+
+        if tail < self.n:
+            raise ValueError("the parent array contains a cycle")
+        return order, depths
+
+    @property
+    def bfs_order(self):
+
+        """
+        Every node in breadth-first order from the roots, so each node
+        comes after its parent and the nodes of each level are together
+        """
+
+        return self._breadth_first[0]
+
+    @property
+    def depths(self):
+
+        """
+        The depth of every node, i.e. the number of edges between it and
+        its root, so roots have depth 0.
+
+        Worked out with one breadth-first search from the roots over the
+        child index, so O(n). Raises ValueError if the parent array has a
+        cycle, as those nodes are never reached from a root
+        """
+
+        return self._breadth_first[1]
+
+    @cached_property
+    def height(self):
+
+        """
+        The largest depth of any node, or -1 for an empty tree
+        """
+
+        return int(self.depths.max()) if self.n else -1
+
+    @cached_property
+    def subtree_sizes(self):
+
+        """
+        The number of nodes in the subtree under each node, including the
+        node itself, so leaves have size 1.
+
+        Sizes are added to the parents in reverse breadth-first order, so
+        each node's size is complete before it is added to its parent,
+        which is O(n). Whole levels are added at once, from the deepest
+        level up, but for tall, thin trees (where that would mean many
+        tiny levels) they are added up node by node instead
+        """
+
+        order = self.bfs_order
+        level_counts = np.bincount(self.depths, minlength=1)
+
+        if len(level_counts) * MIN_NODES_PER_LEVEL > self.n:
+            sizes = [1] * self.n
+            parents = self.parents.tolist()
+            for node in reversed(order.tolist()):
+                if parents[node] >= 0:
+                    sizes[parents[node]] += sizes[node]
+            return np.array(sizes, dtype=np.int64)
+
+        sizes = np.ones(self.n, dtype=np.int64)
+        ends = np.cumsum(level_counts)
+        for level in range(len(level_counts) - 1, 0, -1):
+            nodes = order[ends[level] - level_counts[level]:ends[level]]
+            np.add.at(sizes, self.parents[nodes], sizes[nodes])
+        return sizes
+
+# marks a removed node in IncrementalTree's parent list
+REMOVED = -2
+
+class IncrementalTree:
+
+    """
+    A tree that can be changed (nodes added, removed or moved to a new
+    parent) while keeping a running count of its internal nodes, so the
+    count never needs to be worked out from scratch again. Each node's
+    number of children is kept up to date, and a node becomes internal when
+    its count goes from 0 to 1 and stops being internal when it drops back
+    to 0, so every change is O(1).
+
+    Node indexes never change. Removed nodes leave a gap, so a node's
+    index stays valid for as long as the node exists. Moving a node under
+    one of its own descendants isn't checked for, as that would take
+    O(depth), and would make a cycle
+    """
+
+    def __init__(self, tree=()):
+        n = len(tree)
+        self.parents = [parent if 0 <= parent < n else -1 for parent in tree]
+        self.child_counts = [0] * n
+        for parent in self.parents:
+            if parent >= 0:
+                self.child_counts[parent] += 1
+        self.internal_count = sum(1 for count in self.child_counts if count)
+        self.size = n
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, node):
+        return 0 <= node < len(self.parents) and \
+            self.parents[node] != REMOVED
+
+    def _check_parent(self, parent):
+        if parent != -1 and parent not in self:
+            raise ValueError(f"unknown parent node: {parent}")
+
+    def _check_node(self, node):
+        if node not in self:
+            raise ValueError(f"unknown node: {node}")
+
+    def _link(self, parent):
+        if parent >= 0:
+            self.child_counts[parent] += 1
+            if self.child_counts[parent] == 1:
+                self.internal_count += 1
+
+    def _unlink(self, parent):
+        if parent >= 0:
+            self.child_counts[parent] -= 1
+            if self.child_counts[parent] == 0:
+                self.internal_count -= 1
+
+    def add(self, parent=-1):
+
+        """
+        Adds a new node under the given parent (or as a root, for -1) and
+        returns its index
+        """
+
+        self._check_parent(parent)
+        self.parents.append(parent)
+        self.child_counts.append(0)
+        self._link(parent)
+        self.size += 1
+        return len(self.parents) - 1
+
+    def remove(self, node):
+
+        """
+        Removes a node. Only leaves can be removed, so the node's children
+        must be moved or removed first. Raises ValueError otherwise
+        """
+
+        self._check_node(node)
+        if self.child_counts[node]:
+            raise ValueError(f"node {node} still has children")
+        self._unlink(self.parents[node])
+        self.parents[node] = REMOVED
+        self.size -= 1
+
+    def reparent(self, node, parent):
+
+        """
+        Moves a node (along with its subtree) under a new parent, or makes
+        it a root, for -1
+        """
+
+        self._check_node(node)
+        self._check_parent(parent)
+        if parent == node:
+            raise ValueError(f"node {node} can't be its own parent")
+        self._unlink(self.parents[node])
+        self.parents[node] = parent
+        self._link(parent)
+
+    def apply(self, changes):
+
+        """
+        Makes a batch of changes in order, each one a tuple of
+        ("add", parent), ("remove", node) or ("reparent", node, parent),
+        and returns the indexes of the nodes added. Changes may refer to
+        nodes added earlier in the same batch.
+
+        If a change is invalid (ValueError), or the batch is malformed in
+        some other way (e.g. a change that isn't a tuple, or a node that
+        isn't an int), the changes already made are undone before the error
+        is raised again, so the tree is left as it was. The batch costs
+        O(1) per change
+        """
+
+        added = []
+        # the inverse of each change made so far, to roll back on failure
+        undo = []
+        try:
+            for operation, *args in changes:
+                if operation == "add":
+                    added.append(self.add(*args))
+                    undo.append((self._unadd,))
+                elif operation == "remove":
+                    node, = args
+                    parent = self.parents[node] if node in self else None
+                    self.remove(node)
+                    undo.append((self._unremove, node, parent))
+                elif operation == "reparent":
+                    node, parent = args
+                    old_parent = self.parents[node] if node in self else None
+                    self.reparent(node, parent)
+                    undo.append((self.reparent, node, old_parent))
+                else:
+                    raise ValueError(f"unknown change: {operation}")
+        except Exception:
+            for inverse, *args in reversed(undo):
+                inverse(*args)
+            raise
+        return added
+
+    def _unadd(self):
+        self._unlink(self.parents.pop())
+        self.child_counts.pop()
+        self.size -= 1
+
+    def _unremove(self, node, parent):
+        self.parents[node] = parent
+        self._link(parent)
+        self.size += 1
+
+    def to_parent_array(self):
+
+        """
+        Gets the tree in the parent array format taken by
+        find_internal_nodes_num. Removed nodes are left in as roots with no
+        children, so the other indexes don't change and the number of
+        internal nodes is the same
+        """
+
+        return [-1 if parent == REMOVED else parent for parent in self.parents]
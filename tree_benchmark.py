@@ -0,0 +1,242 @@
+"""
+Benchmarks every available way of counting internal nodes on trees of
+different shapes and sizes, measuring the time taken and the peak memory
+allocated, and writes the results as JSON lines (one object per shape,
+size and implementation) so they can be kept and compared between runs to
+catch regressions.
+
+Usage:
+    python tree_benchmark.py [--shapes random star ...] [--sizes 1000 ...]
+                             [--implementations numpy stream ...]
+                             [--repeat 3] [--output results.jsonl]
+
+A summary table is printed to stderr as it runs. Needs NumPy
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+from tree_analytics import (ParentArrayTree, find_internal_nodes_num_numpy,
+                            find_internal_nodes_num_parallel,
+                            find_internal_nodes_num_python,
+                            find_internal_nodes_num_stream)
+
+SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7, 10 ** 8]
+
+# implementations that need the tree as a Python list, or build arrays
+# several times its size, take around 40 bytes per node, so by default they
+# are skipped for trees larger than this
+MEMORY_LIMIT = 10 ** 7
+
+# nodes generated at a time, so generating a huge tree doesn't need
+# several temporary arrays as large as the tree itself
+GENERATE_CHUNK = 1 << 22
+
+def chunked_tree(n, parents_for):
+
+    """
+    Builds a tree of n nodes, filling it a chunk at a time with
+    parents_for(indexes), which gets the parents of a range of node indexes
+    """
+
+    parents = np.empty(n, dtype=np.int64)
+    for start in range(0, n, GENERATE_CHUNK):
+        indexes = np.arange(start, min(start + GENERATE_CHUNK, n))
+        parents[start:start + len(indexes)] = parents_for(indexes)
+    parents[:1] = -1
+    return parents
+
+def random_shape(n, seed=0):
+
+    """
+    Every node's parent is a random node before it, so the tree is
+    O(log n) deep
+    """
+
+    rng = np.random.default_rng(seed)
+    return chunked_tree(n, lambda i: (rng.random(len(i)) * i).astype(np.int64))
+
+def star_shape(n, seed=0):
+
+    """
+    Every node is a child of the root, so there is one internal node
+    """
+
+    parents = np.zeros(n, dtype=np.int64)
+    parents[:1] = -1
+    return parents
+
+def straight_line_shape(n, seed=0):
+
+    """
+    Every node is the child of the one before it, so every node but the
+    last is internal
+    """
+
+    return np.arange(-1, n - 1, dtype=np.int64)
+
+def kary_shape(n, seed=0, k=4):
+
+    """
+    A complete, balanced tree where every internal node has k children
+    (the last one may have fewer), laid out level by level
+    """
+
+    return chunked_tree(n, lambda i: (i - 1) // k)
+
+def skewed_shape(n, seed=0):
+
+    """
+    Every node's parent is a random node before it, but heavily biased
+    towards the earliest nodes, so a few hubs have most of the children
+    and most nodes are leaves
+    """
+
+    rng = np.random.default_rng(seed)
+    return chunked_tree(
+        n, lambda i: (rng.random(len(i)) ** 4 * i).astype(np.int64))
+
+SHAPES = {
+    "random": random_shape,
+    "star": star_shape,
+    "straight_line": straight_line_shape,
+    "kary": kary_shape,
+    "skewed": skewed_shape,
+}
+
+def count_with_tree_class(parents):
+
+    """
+    Builds a ParentArrayTree (including its children index) and gets its
+    internal node count
+    """
+
+    return ParentArrayTree(parents).internal_count
+
+# name: (function, whether it takes a Python list rather than an array,
+# whether it needs MEMORY_LIMIT applied)
+IMPLEMENTATIONS = {
+    "python": (find_internal_nodes_num_python, True, True),
+    "numpy": (find_internal_nodes_num_numpy, False, False),
+    "stream": (find_internal_nodes_num_stream, False, False),
+    "parallel": (find_internal_nodes_num_parallel, False, False),
+    "tree_class": (count_with_tree_class, False, True),
+}
+
+def measure(function, tree, repeat):
+
+    """
+    Runs function(tree) repeat times and once more while tracing memory
+    allocations. Returns its result, the best time in seconds and the peak
+    memory allocated in bytes.
+
+    Memory is traced separately as tracing slows Python code down. Only
+    this process is traced, so for the parallel implementation the memory
+    used by the worker processes isn't included
+    """
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(tree)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        function(tree)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, best, peak
+
+def run(shapes=tuple(SHAPES), sizes=tuple(SIZES),
+        implementations=tuple(IMPLEMENTATIONS), repeat=3,
+        memory_limit=MEMORY_LIMIT, seed=0):
+
+    """
+    Yields a result record (a dict) for each implementation on each shape
+    and size of tree, skipping the memory hungry implementations for trees
+    larger than memory_limit (None for no limit). Raises AssertionError if
+    the implementations don't all give the same count for a tree
+    """
+
+    environment = {
+        "python_version": platform.python_version(),
+        "numpy_version": np.__version__,
+        "cpus": os.cpu_count(),
+        "run_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    for shape in shapes:
+        for n in sizes:
+            parents = SHAPES[shape](n, seed)
+            as_list = None
+            counts = set()
+            for name in implementations:
+                function, takes_list, limited = IMPLEMENTATIONS[name]
+                if limited and memory_limit is not None and n > memory_limit:
+                    continue
+                if takes_list and as_list is None:
+                    as_list = parents.tolist()
+                result, seconds, peak = measure(
+                    function, as_list if takes_list else parents, repeat)
+                counts.add(result)
+                yield {"shape": shape, "nodes": n, "implementation": name,
+                       "internal_nodes": result, "seconds": seconds,
+                       "peak_bytes": peak, **environment}
+            assert len(counts) <= 1, \
+                f"implementations disagree on {shape} tree of {n} nodes"
+            del parents, as_list
+
+def main(argv=None):
+
+    """
+    Runs the benchmarks from the command line
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--shapes", nargs="+", choices=list(SHAPES),
+                        default=list(SHAPES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("--implementations", nargs="+",
+                        choices=list(IMPLEMENTATIONS),
+                        default=list(IMPLEMENTATIONS))
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs to take the best time from")
+    parser.add_argument("--memory-limit", type=int, default=MEMORY_LIMIT,
+                        help="largest tree to run the memory hungry "
+                             "implementations (python, tree_class) on, "
+                             "0 for no limit")
+    parser.add_argument("--output", help="file to append the JSON lines "
+                                         "to, instead of stdout")
+    args = parser.parse_args(argv)
+
+    output = open(args.output, "a", encoding="utf-8") if args.output \
+        else sys.stdout
+    print(f"{'shape':>13} {'nodes':>10} {'implementation':>14} "
+          f"{'time':>10} {'peak memory':>12}", file=sys.stderr)
+    try:
+        for record in run(args.shapes, args.sizes, args.implementations,
+                          args.repeat, args.memory_limit or None):
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            print(f"{record['shape']:>13} {record['nodes']:>10} "
+                  f"{record['implementation']:>14} "
+                  f"{record['seconds']:>9.4f}s "
+                  f"{record['peak_bytes'] / 2 ** 20:>9.1f} MB",
+                  file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+if __name__ == "__main__":
+    main()